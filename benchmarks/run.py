@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015 the pyp2p authors and contributors
+# <see AUTHORS and LICENSE files>
+
+"""
+End-to-end benchmarks of pyp2p, against a local XMPP server unless
+another one is given. Results are written as JSON:
+
+    PYTHONPATH=. python benchmarks/run.py --output bench.json
+"""
+
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+import pyp2p
+from pyp2p.obfuscated_storage import ObfuscatedStorage
+from pyp2p.register import Register, CREATED
+from pyp2p.session import P2pSession
+from pyp2p.testing.xmpp_server import LocalXmppServer
+
+DOMAIN = 'bench.pyp2p'
+PASSWORD = 'bench'
+
+
+def percentiles(values, points=(50, 90, 99)):
+    """ Nearest rank percentiles, plus min, max and mean """
+    values = sorted(values)
+    if not values:
+        return {}
+    result = {'min': values[0], 'max': values[-1],
+              'mean': sum(values) / float(len(values))}
+    for point in points:
+        rank = max(0, int(round(point / 100.0 * len(values))) - 1)
+        result['p%d' % point] = values[rank]
+    return result
+
+
+def rss_bytes():
+    """ Resident memory of the process """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except (IOError, OSError):
+        # peak, in kilobytes on Linux and bytes on OS X
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def new_jid():
+    return '%s@%s' % (uuid.uuid4(), DOMAIN)
+
+
+class Bench(object):
+    """
+
+        Runs the benchmarks against a server, and gathers results
+
+    """
+
+    def __init__(self, server, port):
+        """
+        """
+        self.server = server
+        self.port = port
+        self.register = Register(server_address=server, port=port)
+
+    def new_accounts(self, count):
+        credentials = [(new_jid(), PASSWORD) for _ in range(count)]
+        report = self.register.register_many(credentials, concurrency=8)
+        return [jid for jid, _ in credentials
+                if report[jid]['status'] == CREATED]
+
+    def open_session(self, jid):
+        session = P2pSession(server_address=self.server, port=self.port,
+                             jid=jid, password=PASSWORD)
+        session.set_log_bodies(False)
+        session.wait_ready(timeout=10)
+        return session
+
+    def open_pair(self):
+        """ Two sessions of mutually subscribed accounts """
+        alice_jid, bob_jid = self.new_accounts(2)
+        alice = self.open_session(alice_jid)
+        bob = self.open_session(bob_jid)
+        alice.authorize_subscriptions()
+        bob.authorize_subscriptions()
+        alice.subscribe(targetjid=bob_jid)
+        alice.wait_online(bob_jid, timeout=10)
+        bob.wait_online(alice_jid, timeout=10)
+        return alice, bob
+
+    def session_start(self, count):
+        """ Time from session creation to ready to send """
+        jids = self.new_accounts(count)
+        durations = []
+        for jid in jids:
+            started = time.time()
+            session = self.open_session(jid)
+            durations.append(time.time() - started)
+            session.session_disconnect()
+        return {'sessions': len(durations),
+                'seconds': percentiles(durations)}
+
+    def register_rate(self, count, concurrency=8):
+        """ Accounts created per second, one by one and concurrently """
+        started = time.time()
+        for _ in range(count):
+            self.register.register(new_jid(), PASSWORD)
+        sequential = time.time() - started
+
+        credentials = [(new_jid(), PASSWORD) for _ in range(count)]
+        started = time.time()
+        report = self.register.register_many(credentials,
+                                             concurrency=concurrency)
+        concurrent = time.time() - started
+        created = sum(1 for result in report.values()
+                      if result['status'] == CREATED)
+        return {'accounts': count,
+                'sequential_per_sec': count / sequential,
+                'concurrent_per_sec': created / concurrent,
+                'concurrency': concurrency}
+
+    def send_throughput(self, count):
+        """ session_send calls per second, and deliveries per second """
+        alice, bob = self.open_pair()
+        received = []
+        done = threading.Event()
+
+        def callback(from_jid, msg_body):
+            received.append(msg_body)
+            if len(received) >= count:
+                done.set()
+
+        bob.set_msg_callback(cb=callback)
+        started = time.time()
+        for index in range(count):
+            alice.session_send(recipient=bob.boundjid.bare,
+                               msg='message %d' % index)
+        sent = time.time() - started
+        done.wait(60)
+        delivered = time.time() - started
+        result = {'messages': count,
+                  'received': len(received),
+                  'send_per_sec': count / sent,
+                  'delivered_per_sec': len(received) / delivered}
+        alice.session_disconnect()
+        bob.session_disconnect()
+        return result
+
+    def round_trip(self, count):
+        """ Latency of a message and its answer, through msg callbacks """
+        alice, bob = self.open_pair()
+        answered = threading.Event()
+
+        def echo(from_jid, msg_body):
+            bob.session_send(recipient=from_jid, msg=msg_body)
+
+        def pong(from_jid, msg_body):
+            answered.set()
+
+        bob.set_msg_callback(cb=echo)
+        alice.set_msg_callback(cb=pong)
+        rtts = []
+        lost = 0
+        for index in range(count):
+            answered.clear()
+            started = time.time()
+            alice.session_send(recipient=bob.boundjid.bare,
+                               msg='ping %d' % index)
+            if answered.wait(5):
+                rtts.append((time.time() - started) * 1000)
+            else:
+                lost += 1
+        alice.session_disconnect()
+        bob.session_disconnect()
+        return {'pings': count, 'lost': lost, 'ms': percentiles(rtts)}
+
+    def idle_memory(self, count):
+        """
+        Resident memory added by each idle session. With the local
+        server, its side of the connections is accounted for too
+        """
+        jids = self.new_accounts(count)
+        gc.collect()
+        before = rss_bytes()
+        threads = threading.active_count()
+        sessions = [self.open_session(jid) for jid in jids]
+        time.sleep(1)
+        gc.collect()
+        after = rss_bytes()
+        result = {'sessions': len(sessions),
+                  'bytes_per_session': (after - before) / max(1, len(sessions)),
+                  'threads_per_session': (threading.active_count() - threads) /
+                  float(max(1, len(sessions)))}
+        for session in sessions:
+            session.session_disconnect()
+        return result
+
+    def storage(self, megabytes):
+        """
+        Store and retrieve times of an encrypted storage holding
+        megabytes of data, transformed by blocks (stream) or in
+        memory (whole)
+        """
+        data = {'blob': os.urandom(megabytes * 1024 * 1024),
+                'roster': dict(('%d@%s' % (index, DOMAIN), PASSWORD)
+                               for index in range(1000))}
+        directory = tempfile.mkdtemp()
+        result = {'megabytes': megabytes}
+        try:
+            for mode in ('stream', 'whole'):
+                storage = ObfuscatedStorage(
+                    filename=os.path.join(directory, mode))
+                if mode == 'whole':
+                    storage.store_stream_hook = None
+                    storage.retrieve_stream_hook = None
+                started = time.time()
+                storage.store(data)
+                stored = time.time()
+                assert storage.retrieve() == data
+                result[mode] = {'store_s': stored - started,
+                                'retrieve_s': time.time() - stored}
+        finally:
+            shutil.rmtree(directory)
+        return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--server', help="host:port of the XMPP server "
+                        "(a local server is started by default)")
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--pings', type=int, default=200)
+    parser.add_argument('--starts', type=int, default=10)
+    parser.add_argument('--accounts', type=int, default=5)
+    parser.add_argument('--idle-sessions', type=int, default=20)
+    parser.add_argument('--storage-mb', type=int, default=20)
+    parser.add_argument('--only', action='append',
+                        help="run only this benchmark (repeatable)")
+    parser.add_argument('--output', help="JSON file (stdout by default)")
+    args = parser.parse_args(argv)
+
+    # sessions log at debug level otherwise
+    logging.basicConfig(level=logging.WARNING)
+
+    local = None
+    if args.server:
+        server, _, port = args.server.rpartition(':')
+    else:
+        local = LocalXmppServer().start()
+        server, port = local.address
+
+    bench = Bench(server, port)
+    benchmarks = [('session_start', bench.session_start, args.starts),
+                  ('register', bench.register_rate, args.accounts),
+                  ('send_throughput', bench.send_throughput, args.messages),
+                  ('round_trip', bench.round_trip, args.pings),
+                  ('idle_memory', bench.idle_memory, args.idle_sessions),
+                  ('storage', bench.storage, args.storage_mb)]
+    results = {}
+    for name, func, count in benchmarks:
+        if args.only and name not in args.only:
+            continue
+        started = time.time()
+        results[name] = func(count)
+        results[name]['elapsed'] = time.time() - started
+
+    if local is not None:
+        local.stop()
+
+    report = {'pyp2p': pyp2p.__version__,
+              'python': platform.python_version(),
+              'platform': platform.platform(),
+              'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+              'server': 'local' if local is not None else args.server,
+              'results': results}
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as report_file:
+            report_file.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015 the pyp2p authors and contributors
+# <see AUTHORS and LICENSE files>
+
+"""
+    Asyncio front-end for pyp2p sessions (python >= 3.6)
+
+    SleekXMPP still owns the socket, but none of the session handlers
+    runs in a thread of its own: events are forwarded to the asyncio
+    event loop, which can drive many sessions at once.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+
+from pyp2p.core.exceptions import PyP2pDenied, PyP2pTimedOut
+from pyp2p.presence import bare_jid
+from pyp2p.session import SessionBot
+
+
+class AsyncSessionBot(SessionBot):
+
+    """
+    A session bot whose session start never blocks the event thread
+    """
+
+    def __init__(self, jid, password, logger):
+        SessionBot.__init__(self, jid=jid, password=password, logger=logger)
+        # start is registered as a threaded handler by SessionBot
+        self.del_event_handler("session_start", self.start)
+        self.add_event_handler("session_start", self.start)
+
+    def start(self, event):
+        """
+        Process the session_start event, the roster is requested
+        without waiting for the answer
+        """
+        started = self.session_starting()
+        self.get_roster(block=False,
+                        callback=lambda iq: self.roster_received(iq, started))
+
+    def roster_received(self, iq, started):
+        """
+        Process the roster answer, then finish starting the session
+        """
+        if iq['type'] == 'error':
+            self.logger.error('%s' % iq['error']['condition'])
+        else:
+            self.roster_rtt.observe(time.time() - started)
+        if self.needs_privacy:
+            # privacy requests wait for their answer
+            thread = threading.Thread(target=self.ready_to_send,
+                                      name="pyp2p session start")
+            thread.daemon = True
+            thread.start()
+        else:
+            self.ready_to_send()
+
+    def ready_to_send(self):
+        self.session_started()
+        self.event("session_ready")
+
+
+class AsyncP2pSession(object):
+
+    """
+    An xmpp session driven by an asyncio event loop
+    """
+
+    def __init__(self, server_address, port, jid, password):
+        self.server_address = server_address
+        self.port = port
+        self.logger = logging.getLogger("p2psession")
+
+        self.bot = AsyncSessionBot(jid=jid, password=password,
+                                   logger=self.logger)
+        self.bot.setup_session()
+        self.bot.set_msg_callback(self.received)
+        self.bot.add_event_handler("session_ready", self.session_ready)
+        self.bot.add_event_handler("session_resumed", self.session_ready)
+        self.bot.add_event_handler("got_online", self.buddy_online)
+        self.bot.add_event_handler("presence_available", self.buddy_online)
+
+        self.loop = None
+        self.inbox = None
+        self.ready_waiters = []
+        self.online_waiters = {}
+
+    async def start(self, timeout=None):
+        """
+        Connect to the server and wait until the session is ready
+        """
+        self.loop = asyncio.get_event_loop()
+        self.inbox = asyncio.Queue()
+
+        self.logger.info("Connecting...")
+        connected = await self.loop.run_in_executor(
+            None, self.bot.connect, (self.server_address, self.port))
+        if not connected:
+            return False
+
+        self.logger.info("Processing...")
+        self.bot.process(block=False)
+        await self.wait_ready(timeout)
+        return True
+
+    async def stop(self):
+        """
+        Ends session
+        """
+        self.bot.send_presence(ptype='unavailable')
+        await self.loop.run_in_executor(None, self.bot.disconnect)
+        self.inbox.put_nowait(None)
+
+    async def send(self, recipient, msg):
+        """
+        Send a single message to a recipient
+        """
+        self.bot.bot_send(recipient=recipient, msg=msg)
+
+    async def send_batch(self, messages):
+        """
+        Send a batch of (recipient, message) tuples, returns the
+        (recipient, status) tuple of each message
+        """
+        return self.bot.bot_send_batch(messages=messages)
+
+    async def messages(self):
+        """
+        Iterate over received (from_jid, msg_body) tuples, until
+        the session is stopped
+        """
+        if self.inbox is None:
+            raise PyP2pDenied("Session not started")
+        while True:
+            item = await self.inbox.get()
+            if item is None:
+                return
+            yield item
+
+    async def wait_ready(self, timeout=None):
+        """
+        Waits until the session is ready to send, raises
+        PyP2pTimedOut if timeout (in seconds) expires first
+        """
+        if self.bot.is_ready():
+            return
+        await self.wait_for(self.ready_waiters, timeout,
+                            "Session not ready after %ss" % timeout)
+
+    async def wait_online(self, jid=None, timeout=None):
+        """
+        Waits until a buddy (ourself by default) got online,
+        raises PyP2pTimedOut if timeout (in seconds) expires first
+        """
+        if jid is None:
+            jid = self.bot.boundjid.bare
+        bare = bare_jid(jid)
+        if self.bot.is_online(bare):
+            return
+        waiters = self.online_waiters.setdefault(bare, [])
+        await self.wait_for(waiters, timeout,
+                            "%s not online after %ss" % (bare, timeout))
+
+    async def wait_for(self, waiters, timeout, error):
+        future = self.loop.create_future()
+        waiters.append(future)
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise PyP2pTimedOut(error)
+        finally:
+            if future in waiters:
+                waiters.remove(future)
+
+    def get_session_jid(self):
+        """
+        Return current session bare jid
+        """
+        return self.bot.boundjid.bare
+
+    def get_session_roster(self):
+        return self.bot.client_roster
+
+    # The methods below are run by SleekXMPP threads, they hand
+    # the events over to the event loop.
+
+    def received(self, from_jid, msg_body):
+        self.loop.call_soon_threadsafe(self.inbox.put_nowait,
+                                       (from_jid, msg_body))
+
+    def session_ready(self, event):
+        self.loop.call_soon_threadsafe(self.wake, self.ready_waiters)
+
+    def buddy_online(self, presence):
+        self.loop.call_soon_threadsafe(self.wake_online, presence['from'].bare)
+
+    def wake_online(self, bare):
+        self.wake(self.online_waiters.get(bare, []))
+
+    @staticmethod
+    def wake(waiters):
+        for future in list(waiters):
+            if not future.done():
+                future.set_result(True)
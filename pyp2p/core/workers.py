@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015 the pyp2p authors and contributors
+# <see AUTHORS and LICENSE files>
+
+"""This module runs jobs from a bounded number of threads"""
+
+import logging
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from pyp2p.core.exceptions import PyP2pBadArgument
+
+
+def run_concurrently(func, items, concurrency):
+    """
+    Call func(item) for every item, from at most concurrency
+    threads. Returns the results, in items order (None when
+    func raised an exception). Items may hold secrets, only
+    their index is logged
+    """
+    if concurrency < 1:
+        raise PyP2pBadArgument("concurrency must be positive")
+
+    logger = logging.getLogger("workers")
+    items = list(items)
+    results = [None] * len(items)
+    pending = queue.Queue()
+    for index, item in enumerate(items):
+        pending.put((index, item))
+
+    def work():
+        while True:
+            try:
+                index, item = pending.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                results[index] = func(item)
+            except Exception:
+                logger.exception("Job %d failed" % index)
+
+    threads = [threading.Thread(target=work)
+               for _ in range(min(concurrency, len(items)))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
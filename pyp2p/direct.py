@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015 the pyp2p authors and contributors
+# <see AUTHORS and LICENSE files>
+
+"""This module moves payloads over direct TCP connections"""
+
+import binascii
+import hashlib
+import hmac
+import numbers
+import os
+import socket
+import threading
+import time
+
+from pyp2p.core.exceptions import PyP2pBadFormat, PyP2pFailed, PyP2pTimedOut
+
+# receiver acknowledgement, once the payload digest is checked
+ACK_OK = b'\x01'
+ACK_BAD = b'\x00'
+
+TOKEN_LEN = 32
+BLOCK_SIZE = 65536
+
+
+def new_token():
+    return binascii.hexlify(os.urandom(TOKEN_LEN // 2)).decode('ascii')
+
+
+def payload_digest(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def read_exactly(conn, size):
+    """ Read size bytes from a socket """
+    data = bytearray(size)
+    view = memoryview(data)
+    received = 0
+    while received < size:
+        count = conn.recv_into(view[received:],
+                               min(BLOCK_SIZE, size - received))
+        if not count:
+            raise PyP2pFailed("Connection closed after %d of %d bytes"
+                              % (received, size))
+        received += count
+    return bytes(data)
+
+
+class DirectSender(object):
+    """
+
+        Serves a payload, once, to the peer presenting the token of
+        the offer. The receiver acknowledges the payload once its
+        digest is checked.
+
+    """
+
+    def __init__(self, data, host='0.0.0.0', port=0, advertise=None):
+        """  - host and port are the listening address, any free port
+               by default
+             - advertise is the host given to the peer, if it differs
+               from the listening one
+        """
+        self.data = data
+        self.token = new_token()
+        self.sha1 = payload_digest(data)
+        self.cancelled = threading.Event()
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((host, port))
+        self.server.listen(1)
+        self.host = advertise or host
+        self.port = self.server.getsockname()[1]
+
+    def offer(self):
+        """ What the receiver needs to fetch the payload """
+        return {'host': self.host,
+                'port': self.port,
+                'size': len(self.data),
+                'sha1': self.sha1,
+                'token': self.token}
+
+    def cancel(self):
+        """ Give up waiting for the receiver """
+        self.cancelled.set()
+
+    def serve(self, timeout=10, poll=0.1):
+        """
+        Wait for the receiver and send the payload. Raises
+        PyP2pTimedOut if it does not connect within timeout seconds,
+        and PyP2pFailed if the transfer fails or is cancelled
+        """
+        deadline = time.time() + timeout
+        self.server.settimeout(poll)
+        try:
+            while True:
+                if self.cancelled.is_set():
+                    raise PyP2pFailed("Direct transfer cancelled")
+                if time.time() > deadline:
+                    raise PyP2pTimedOut("No direct connection after %ss"
+                                        % timeout)
+                try:
+                    conn, address = self.server.accept()
+                except socket.timeout:
+                    continue
+                try:
+                    conn.settimeout(timeout)
+                    if self.transmit(conn):
+                        return
+                except (socket.error, socket.timeout) as error:
+                    raise PyP2pFailed("Direct transfer failed", detail=error)
+                finally:
+                    conn.close()
+        finally:
+            self.server.close()
+
+    def transmit(self, conn):
+        try:
+            token = read_exactly(conn, TOKEN_LEN)
+        except PyP2pFailed:
+            return False
+        if not hmac.compare_digest(token, self.token.encode('ascii')):
+            # not our peer, keep waiting
+            return False
+        conn.sendall(self.data)
+        if read_exactly(conn, 1) != ACK_OK:
+            raise PyP2pFailed("Payload rejected by the receiver")
+        return True
+
+
+def receive_direct(host, port, token, size, sha1, timeout=10,
+                   max_size=None):
+    """
+    Fetch a payload offered by a DirectSender. Raises PyP2pFailed
+    if the sender cannot be reached, and PyP2pBadFormat if the
+    offered size is negative or above max_size, or if the payload
+    does not match its digest
+    """
+    if not isinstance(size, numbers.Integral) or size < 0 or \
+            (max_size is not None and size > max_size):
+        raise PyP2pBadFormat("Bad payload size: %r" % (size,))
+    try:
+        conn = socket.create_connection((host, port), timeout)
+    except (socket.error, socket.timeout) as error:
+        raise PyP2pFailed("Cannot connect to %s:%s" % (host, port),
+                          detail=error)
+    try:
+        conn.sendall(token.encode('ascii'))
+        data = read_exactly(conn, size)
+        if payload_digest(data) != sha1:
+            conn.sendall(ACK_BAD)
+            raise PyP2pBadFormat("Payload digest mismatch")
+        conn.sendall(ACK_OK)
+        return data
+    except (socket.error, socket.timeout) as error:
+        raise PyP2pFailed("Direct transfer failed", detail=error)
+    finally:
+        conn.close()
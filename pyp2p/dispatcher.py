@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015 the pyp2p authors and contributors
+# <see AUTHORS and LICENSE files>
+
+import logging
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from pyp2p.core.exceptions import PyP2pBadArgument
+from pyp2p.metrics import NULL_METRIC
+
+_STOP = object()
+
+
+class MessageDispatcher(object):
+    """
+
+        Hands received messages over to a pool of worker threads,
+        so that a slow callback does not stall stanza processing.
+
+        Messages of a given sender are always handled by the same
+        worker, in reception order. Each worker has a bounded queue:
+        when it is full, dispatch blocks the caller (backpressure)
+        up to put_timeout seconds, then rejects the message.
+
+    """
+
+    def __init__(self, callback, workers=4, max_pending=1000,
+                 put_timeout=None, latency=NULL_METRIC):
+        """
+        latency is a histogram observing the callback durations
+        """
+        if workers < 1:
+            raise PyP2pBadArgument("At least one worker is required")
+
+        self.logger = logging.getLogger("dispatcher")
+        self.callback = callback
+        self.put_timeout = put_timeout
+        self.lock = threading.Lock()
+        self.handled = 0
+        self.rejected = 0
+        self.failed = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.latency = latency
+        self.stopping = threading.Event()
+
+        depth = max(1, max_pending // workers)
+        self.queues = [queue.Queue(maxsize=depth) for _ in range(workers)]
+        self.threads = []
+        for index, worker_queue in enumerate(self.queues):
+            thread = threading.Thread(target=self.run, args=(worker_queue,),
+                                      name="pyp2p dispatcher %d" % index)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def dispatch(self, from_jid, msg_body):
+        """ Queue a message for its sender's worker.
+
+            Returns False if the message was rejected
+        """
+        if self.stopping.is_set():
+            self.logger.warning("Message from %s rejected (stopped)", from_jid)
+            return False
+        worker_queue = self.queues[hash(from_jid) % len(self.queues)]
+        try:
+            worker_queue.put((from_jid, msg_body), timeout=self.put_timeout)
+        except queue.Full:
+            with self.lock:
+                self.rejected += 1
+            self.logger.warning("Message from %s rejected (queue full)", from_jid)
+            return False
+        return True
+
+    def run(self, worker_queue):
+        while True:
+            # the stop marker may not fit in a full queue
+            if self.stopping.is_set() and worker_queue.empty():
+                return
+            item = worker_queue.get()
+            if item is _STOP:
+                return
+            from_jid, msg_body = item
+            started = time.time()
+            try:
+                self.callback(from_jid=from_jid, msg_body=msg_body)
+            except Exception:
+                self.logger.exception("Message callback failed")
+                with self.lock:
+                    self.failed += 1
+            elapsed = time.time() - started
+            self.latency.observe(elapsed)
+            with self.lock:
+                self.handled += 1
+                self.latency_total += elapsed
+                self.latency_max = max(self.latency_max, elapsed)
+
+    def stop(self, wait=True):
+        """ Stop workers once the pending messages are handled,
+            further messages are rejected
+        """
+        self.stopping.set()
+        for worker_queue in self.queues:
+            try:
+                # wakes up an idle worker
+                worker_queue.put_nowait(_STOP)
+            except queue.Full:
+                pass
+        if wait:
+            for thread in self.threads:
+                if thread is not threading.current_thread():
+                    thread.join()
+
+    def depth(self):
+        """ Number of messages waiting for a worker """
+        return sum(worker_queue.qsize() for worker_queue in self.queues)
+
+    def get_stats(self):
+        """ Return queue depth, counters and callback latency """
+        with self.lock:
+            average = self.latency_total / self.handled if self.handled else 0.0
+            return {'pending': self.depth(),
+                    'handled': self.handled,
+                    'rejected': self.rejected,
+                    'failed': self.failed,
+                    'latency_avg': average,
+                    'latency_max': self.latency_max}
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015 the pyp2p authors and contributors
+# <see AUTHORS and LICENSE files>
+
+import logging
+import threading
+import time
+
+from pyp2p.scheduler import TimerWheel
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def get_shared_keepalive():
+    """ Return the AdaptiveKeepalive shared by the whole process """
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = AdaptiveKeepalive()
+        return _shared
+
+
+class KeepaliveState(object):
+    """
+
+        Keepalive bookkeeping of a session
+
+    """
+
+    def __init__(self, interval):
+        """
+        """
+        self.interval = interval
+        self.last_activity = time.time()
+        self.ping_sent = None
+        self.rtt = None
+        self.task = None
+        self.handlers = None
+
+
+class AdaptiveKeepalive(object):
+    """
+
+        Pings the server of idle sessions only.
+
+        Any stanza received or sent counts as a proof of liveness.
+        A session is pinged when it has been idle for its interval;
+        each answered ping doubles the interval (up to max_interval),
+        and a lost one resets it to min_interval. Every session shares
+        the same timer wheel.
+
+    """
+
+    def __init__(self, timer=None, min_interval=45, max_interval=180,
+                 backoff=2.0, timeout=5):
+        """  - timer is a started TimerWheel (or Scheduler), a new
+               TimerWheel is started if none is given
+             - timeout is the time given to the server to answer a ping
+        """
+        self.logger = logging.getLogger("keepalive")
+        if timer is None:
+            timer = TimerWheel()
+            timer.start()
+        self.timer = timer
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.states = {}
+
+    def register(self, session):
+        """ Start watching a session """
+        state = KeepaliveState(self.min_interval)
+
+        def touch(stanza):
+            state.last_activity = time.time()
+            return stanza
+
+        state.handlers = (touch,
+                          lambda iq: self.pong(session),
+                          lambda iq: self.lost(session))
+        session.add_filter('in', touch)
+        session.add_filter('out', touch)
+        session.add_event_handler("keepalive_pong", state.handlers[1])
+        session.add_event_handler("keepalive_lost", state.handlers[2])
+        with self.lock:
+            self.states[session] = state
+        self.schedule(session, state, state.interval)
+
+    def unregister(self, session):
+        """ Stop watching a session """
+        with self.lock:
+            state = self.states.pop(session, None)
+        if state is None:
+            return
+        if state.task is not None:
+            state.task.cancel()
+        touch, pong, lost = state.handlers
+        session.del_filter('in', touch)
+        session.del_filter('out', touch)
+        session.del_event_handler("keepalive_pong", pong)
+        session.del_event_handler("keepalive_lost", lost)
+
+    def schedule(self, session, state, delay):
+        with self.lock:
+            if state.task is not None:
+                state.task.cancel()
+            state.task = self.timer.call_later(delay, self.check, session)
+
+    def check(self, session):
+        state = self.states.get(session)
+        if state is None:
+            return
+        idle = time.time() - state.last_activity
+        if idle < state.interval:
+            self.schedule(session, state, state.interval - idle)
+            return
+        if not session.is_ready():
+            self.schedule(session, state, self.min_interval)
+            return
+
+        state.ping_sent = time.time()
+        session.keepalive_ping(timeout=self.timeout)
+        # in case neither the answer nor the timeout shows up
+        self.schedule(session, state, state.interval + self.timeout)
+
+    def pong(self, session):
+        state = self.states.get(session)
+        if state is None:
+            return
+        if state.ping_sent is not None:
+            state.rtt = time.time() - state.ping_sent
+            state.ping_sent = None
+        state.interval = min(state.interval * self.backoff, self.max_interval)
+        self.schedule(session, state, state.interval)
+
+    def lost(self, session):
+        state = self.states.get(session)
+        if state is None:
+            return
+        state.ping_sent = None
+        state.interval = self.min_interval
+        self.schedule(session, state, state.interval)
+
+    def get_stats(self, session):
+        """ Return the current interval and last ping round trip time """
+        state = self.states.get(session)
+        if state is None:
+            return None
+        return {'interval': state.interval,
+                'rtt': state.rtt,
+                'idle': time.time() - state.last_activity}
@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015 the pyp2p authors and contributors
+# <see AUTHORS and LICENSE files>
+
+import hashlib
+import io
+import os
+import pickle
+import struct
+import threading
+import zlib
+
+from pyp2p.core.exceptions import PyP2pBadArgument
+from pyp2p.storage import RawStorage, sync_directory
+
+PUT = 1
+DELETE = 2
+
+# record header: operation, payload length and payload crc32
+HEADER = struct.Struct('>BII')
+PROTOCOL = 2
+
+# key of data stored by store() that is not a dictionary
+WHOLE = '__pyp2p_whole__'
+
+
+class LogStorage(RawStorage):
+    """
+
+        Key-value storage kept in an append-only log.
+
+        Each put or delete appends a record to the log file, and an
+        in-memory index gives the offset of the last record of each
+        key, so updates cost the size of the record instead of the
+        size of the store. The log is compacted once the records
+        that were overwritten or deleted outweigh the live ones.
+
+        store() and retrieve() work on dictionaries: store() only
+        appends the keys whose value changed and deletes the missing
+        ones. Other data is kept as a single record.
+
+        Records are in plain text unless store and retrieve hooks
+        are set, see ObfuscatedLogStorage to keep secrets.
+
+        The file must not be shared between processes.
+
+    """
+
+    def __init__(self, filename=None, compact_ratio=1.0,
+                 compact_min_size=65536, commit_delay=None, cache=False):
+        """
+        The log is compacted when it is over compact_min_size bytes
+        and its dead records are over compact_ratio times the live ones.
+
+        Every update is appended at once and reads go through the
+        index, so the commit_delay and cache options of other storages
+        are refused.
+        """
+        if commit_delay is not None or cache:
+            raise PyP2pBadArgument("Log storage supports neither "
+                                   "commit_delay nor cache")
+        super(LogStorage, self).__init__(filename=filename or "store.log")
+        self.compact_ratio = compact_ratio
+        self.compact_min_size = compact_min_size
+        self.lock = threading.RLock()
+        self.log = None
+        # key -> (offset, size, value digest)
+        self.index = None
+        self.live_size = 0
+        self.log_size = 0
+
+    def encode(self, data):
+        if self.store_hook is not None:
+            data = self.store_hook(data, self.hooks_extra_args)
+        return data
+
+    def decode(self, data):
+        if self.retrieve_hook is not None:
+            data = self.retrieve_hook(data, self.hooks_extra_args)
+        return data
+
+    def open(self):
+        """ Open the log and build the index, once """
+        if self.log is not None:
+            return
+        # left by a compaction that did not complete
+        if os.path.exists(self.filename + '.compact'):
+            os.remove(self.filename + '.compact')
+        self.log = open(self.filename, 'a+b')
+        os.chmod(self.filename, 0o600)
+        self.index = {}
+        self.live_size = 0
+        offset = 0
+        self.log.seek(0)
+        while True:
+            header = self.log.read(HEADER.size)
+            if not header:
+                break
+            record = self.read_record(header)
+            if record is None:
+                self.logger.warning("Truncated record at %d in %s, dropped"
+                                    % (offset, self.filename))
+                self.log.truncate(offset)
+                break
+            operation, key, value, size = record
+            self.index_record(operation, key, value, offset, size)
+            offset += size
+        self.log_size = offset
+
+    def read_record(self, header):
+        """ Returns operation, key, value pickle and size, or None """
+        if len(header) < HEADER.size:
+            return None
+        operation, length, crc = HEADER.unpack(header)
+        payload = self.log.read(length)
+        if len(payload) < length or zlib.crc32(payload) & 0xffffffff != crc:
+            return None
+        stream = io.BytesIO(self.decode(payload))
+        key = pickle.load(stream)
+        return operation, key, stream.read(), HEADER.size + length
+
+    def index_record(self, operation, key, value, offset, size):
+        previous = self.index.pop(key, None)
+        if previous is not None:
+            self.live_size -= previous[1]
+        if operation == PUT:
+            self.index[key] = (offset, size, hashlib.sha1(value).digest())
+            self.live_size += size
+
+    def append(self, operation, key, value=b''):
+        payload = self.encode(pickle.dumps(key, PROTOCOL) + value)
+        record = HEADER.pack(operation, len(payload),
+                             zlib.crc32(payload) & 0xffffffff) + payload
+        offset = self.log_size
+        self.log.seek(0, os.SEEK_END)
+        self.log.write(record)
+        self.log_size += len(record)
+        self.index_record(operation, key, value, offset, len(record))
+
+    def get(self, key, default=None):
+        """ Return the value of a key, or default """
+        with self.lock:
+            self.open()
+            entry = self.index.get(key)
+            if entry is None:
+                return default
+            self.log.flush()
+            self.log.seek(entry[0])
+            _, _, value, _ = self.read_record(self.log.read(HEADER.size))
+        return pickle.loads(value)
+
+    def put(self, key, value):
+        """ Set the value of a key """
+        value = pickle.dumps(value, PROTOCOL)
+        with self.lock:
+            self.open()
+            self.append(PUT, key, value)
+            self.commit()
+
+    def delete(self, key):
+        """ Remove a key, returns False if it was not there """
+        with self.lock:
+            self.open()
+            if key not in self.index:
+                return False
+            self.append(DELETE, key)
+            self.commit()
+        return True
+
+    def keys(self):
+        with self.lock:
+            self.open()
+            return list(self.index)
+
+    def __len__(self):
+        with self.lock:
+            self.open()
+            return len(self.index)
+
+    def commit(self):
+        self.log.flush()
+        if self.log_size > self.compact_min_size and \
+                self.log_size - self.live_size > \
+                self.compact_ratio * self.live_size:
+            self.compact()
+
+    def retrieve(self):
+        """ Return the stored dictionary, or the data stored whole """
+        self.logger.info("Retreiving data...")
+        with self.lock:
+            self.open()
+            keys = list(self.index)
+            if WHOLE in self.index:
+                return self.get(WHOLE)
+            return dict((key, self.get(key)) for key in keys)
+
+    def store(self, data):
+        """ Write the keys of a dictionary that changed, and delete
+            the missing ones
+        """
+        self.logger.info("Storing data...")
+        if not isinstance(data, dict):
+            data = {WHOLE: data}
+        with self.lock:
+            self.open()
+            for key in [key for key in self.index if key not in data]:
+                self.append(DELETE, key)
+            for key, value in data.items():
+                value = pickle.dumps(value, PROTOCOL)
+                entry = self.index.get(key)
+                if entry is None or entry[2] != hashlib.sha1(value).digest():
+                    self.append(PUT, key, value)
+            self.commit()
+
+    def compact(self):
+        """ Rewrite the log with the live records only """
+        with self.lock:
+            self.open()
+            temp_name = self.filename + '.compact'
+            entries = sorted((entry, key)
+                             for key, entry in self.index.items())
+            index = {}
+            offset = 0
+            with open(temp_name, 'wb') as temp:
+                os.chmod(temp_name, 0o600)
+                for (old_offset, size, digest), key in entries:
+                    self.log.seek(old_offset)
+                    temp.write(self.log.read(size))
+                    index[key] = (offset, size, digest)
+                    offset += size
+                temp.flush()
+                os.fsync(temp.fileno())
+            self.log.close()
+            try:
+                os.rename(temp_name, self.filename)
+            finally:
+                # the old log is still valid if it was not replaced
+                self.log = open(self.filename, 'a+b')
+            sync_directory(os.path.dirname(os.path.abspath(self.filename)))
+            self.index = index
+            self.log_size = self.live_size = offset
+            self.logger.debug("Compacted %s to %d bytes"
+                              % (self.filename, offset))
+
+    def close(self):
+        with self.lock:
+            if self.log is not None:
+                self.log.close()
+                self.log = None
+                self.index = None
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015 the pyp2p authors and contributors
+# <see AUTHORS and LICENSE files>
+
+"""This module contains counters and histograms, and their exporters"""
+
+import bisect
+import threading
+
+from pyp2p.core.exceptions import PyP2pBadArgument
+
+# histogram buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Counter(object):
+    """
+
+        A value that only goes up
+
+    """
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text):
+        """
+        """
+        self.name = name
+        self.help = help_text
+        self.lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+
+class Histogram(object):
+    """
+
+        Counts observed values by bucket, and keeps their sum
+
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        """
+        """
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        self.lock = threading.Lock()
+        # the last count is for values above every bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        """ Cumulative counts by upper bound, sum and count """
+        with self.lock:
+            counts = list(self.counts)
+            total, count = self.sum, self.count
+        cumulative = []
+        running = 0
+        for bound, bucket_count in zip(self.buckets + (float('inf'),),
+                                       counts):
+            running += bucket_count
+            cumulative.append((bound, running))
+        return {'buckets': cumulative, 'sum': total, 'count': count}
+
+
+class NullMetric(object):
+    """
+
+        Stands for any metric when metrics are disabled
+
+    """
+
+    def inc(self, amount=1):
+        pass
+
+    def observe(self, value):
+        pass
+
+
+NULL_METRIC = NullMetric()
+
+
+class MetricsRegistry(object):
+    """
+
+        Holds the metrics of one or several sessions
+
+    """
+
+    enabled = True
+
+    def __init__(self):
+        """
+        """
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def counter(self, name, help_text):
+        """ Return the counter of that name, created if needed """
+        return self._get(Counter, name, help_text)
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        """ Return the histogram of that name, created if needed """
+        return self._get(Histogram, name, help_text, buckets)
+
+    def _get(self, cls, name, *args):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = cls(name, *args)
+                self.metrics[name] = metric
+            elif not isinstance(metric, cls):
+                raise PyP2pBadArgument("%s is a %s" % (name, metric.kind))
+            return metric
+
+    def collect(self):
+        """ The metrics, sorted by name """
+        with self.lock:
+            return [self.metrics[name] for name in sorted(self.metrics)]
+
+
+class NullRegistry(object):
+    """
+
+        Registry of disabled metrics: every metric is a no-op
+
+    """
+
+    enabled = False
+
+    def counter(self, name, help_text):
+        return NULL_METRIC
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        return NULL_METRIC
+
+    def collect(self):
+        return []
+
+
+NULL_REGISTRY = NullRegistry()
+
+
+class SnapshotExporter(object):
+    """
+
+        Exports metrics as a dictionary, by metric name
+
+    """
+
+    def export(self, registry):
+        return dict((metric.name, metric.snapshot())
+                    for metric in registry.collect())
+
+
+class PrometheusExporter(object):
+    """
+
+        Exports metrics in the Prometheus text exposition format
+
+    """
+
+    def export(self, registry):
+        lines = []
+        for metric in registry.collect():
+            lines.append('# HELP %s %s' % (metric.name, metric.help))
+            lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+            snapshot = metric.snapshot()
+            if metric.kind == 'counter':
+                lines.append('%s %s' % (metric.name, format_value(snapshot)))
+                continue
+            for bound, count in snapshot['buckets']:
+                lines.append('%s_bucket{le="%s"} %d'
+                             % (metric.name, format_value(bound), count))
+            lines.append('%s_sum %s' % (metric.name,
+                                        format_value(snapshot['sum'])))
+            lines.append('%s_count %d' % (metric.name, snapshot['count']))
+        return '\n'.join(lines) + '\n'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(value) if isinstance(value, float) else str(value)
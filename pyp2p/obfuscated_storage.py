@@ -3,30 +3,96 @@
 # Copyright (C) 2015 the pyp2p authors and contributors
 # <see AUTHORS and LICENSE files>
 
+import hashlib
+import hmac
 import random
 import string
+import struct
+import threading
 import os.path
 from Crypto.Cipher import AES
+from Crypto.Util import Counter
 from Crypto import Random
-from pyp2p.storage import RawStorage
+from pyp2p.log_storage import LogStorage
+from pyp2p.storage import RawStorage, StreamReader, StreamWriter
+from pyp2p.storage import BINARY_PROTOCOL, BLOCK_SIZE
 KEY_LEN = 24
 
+# file header: magic, format version, PBKDF2 iterations, salt, nonce
+MAGIC = b'PYP2PS'
+VERSION = 1
+HEADER = struct.Struct('>6sBI16s8s')
+SALT_LEN = 16
+NONCE_LEN = 8
+MAC_LEN = 32
+ITERATIONS = 20000
+# bounds the work a forged header can ask for
+MAX_ITERATIONS = 1000000
+
+
+class AuthenticatedWriter(StreamWriter):
+    """
+
+        Encrypts blocks and authenticates the ciphertext, the MAC is
+        written after it on close
+
+    """
+
+    def __init__(self, fileobj, cipher, mac):
+        """
+        """
+        super(AuthenticatedWriter, self).__init__(fileobj, self.encrypt)
+        self.cipher = cipher
+        self.mac = mac
+
+    def encrypt(self, data):
+        data = self.cipher.encrypt(data)
+        self.mac.update(data)
+        return data
+
+    def close(self):
+        self.flush()
+        self.fileobj.write(self.mac.digest())
+
 
 class ObfuscatedStorage(RawStorage):
     """
 
         Implements a permanent storage that is not human readable
 
+        Files start with a versioned header, followed by the data
+        encrypted with AES-CTR and an HMAC-SHA256 of the header and
+        ciphertext (encrypt-then-MAC). Keys are derived from the
+        storage key with PBKDF2, using the salt and iterations of the
+        header. A corrupted or tampered file is rejected with a
+        ValueError before anything is decrypted or unpickled.
+
+        Files of the previous format (AES-CFB, not authenticated) are
+        only read when legacy is set, to migrate them: they are
+        written in the new format on next store. Otherwise a file
+        without the header is rejected as corrupted.
+
     """
 
-    def __init__(self):
+    def __init__(self, filename=None, commit_delay=None, cache=False,
+                 legacy=False):
         """
         """
-        super(ObfuscatedStorage, self).__init__()
-        self.filename = os.path.expanduser("~") + "/.store.lock"
+        super(ObfuscatedStorage, self).__init__(commit_delay=commit_delay,
+                                                cache=cache)
+        self.legacy = legacy
+        self.filename = filename or os.path.expanduser("~") + "/.store.lock"
         self.store_hook = self.encrypt
         self.retrieve_hook = self.decrypt
+        self.store_stream_hook = self.encrypt_stream
+        self.retrieve_stream_hook = self.decrypt_stream
         self.hooks_extra_args = self.randomize_key(KEY_LEN)
+        # binary pickles: large strings are read by blocks, not lines
+        self.protocol = BINARY_PROTOCOL
+        self.salt = Random.new().read(SALT_LEN)
+        self.keys_lock = threading.Lock()
+        # derived keys, by storage key, salt and iterations
+        self.derived_keys = {}
 
     def randomize_key(self, length):
         """ Randomize """
@@ -36,19 +102,126 @@ class ObfuscatedStorage(RawStorage):
         (lambda _, __: chr(__ % 256) + _(_, __ // 256) if __ else "", 28539402405045607))())  # noqa
         return str().join(generator.choice(string.hexdigits) for _ in range(length))
 
+    def derive_keys(self, key, salt, iterations):
+        """ Encryption and MAC keys, derived once per salt """
+        with self.keys_lock:
+            keys = self.derived_keys.get((key, salt, iterations))
+            if keys is None:
+                material = hashlib.pbkdf2_hmac('sha256', key.encode('ascii'),
+                                               salt, iterations, 64)
+                keys = material[:32], material[32:]
+                self.derived_keys[(key, salt, iterations)] = keys
+            return keys
+
+    def start_encryption(self, key):
+        """ Returns a new header, and the cipher and MAC that follow it """
+        nonce = Random.new().read(NONCE_LEN)
+        header = HEADER.pack(MAGIC, VERSION, ITERATIONS, self.salt, nonce)
+        return (header,) + self.start_decryption(header, key)
+
+    def start_decryption(self, header, key):
+        """ Returns the cipher and MAC of a header """
+        magic, version, iterations, salt, nonce = HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Unsupported storage format %d" % version)
+        if iterations > MAX_ITERATIONS:
+            raise ValueError("Storage header corrupted")
+        cipher_key, mac_key = self.derive_keys(key, salt, iterations)
+        cipher = AES.new(cipher_key, AES.MODE_CTR,
+                         counter=Counter.new(64, prefix=nonce))
+        mac = hmac.new(mac_key, header, hashlib.sha256)
+        return cipher, mac
+
+    def verify(self, mac, tag):
+        if not hmac.compare_digest(mac.digest(), tag):
+            raise ValueError("Storage corrupted or tampered with")
+
     def encrypt(self, data, key):
         """ Encrypt data"""
-        init_vector = Random.new().read(AES.block_size)
-        cipher = AES.new(key, AES.MODE_CFB, init_vector)
-        crypto = init_vector + cipher.encrypt(data)
-        self.logger.debug("Encrypting with key %s, init vector:%s" % (key, init_vector))
-        return crypto
+        header, cipher, mac = self.start_encryption(key)
+        crypto = cipher.encrypt(data)
+        mac.update(crypto)
+        return header + crypto + mac.digest()
 
     def decrypt(self, data, key):
         """ Decode cipher"""
+        if not data.startswith(MAGIC):
+            self.check_legacy()
+            return self.decrypt_cfb(data, key)
+        if len(data) < HEADER.size + MAC_LEN:
+            raise ValueError("Storage truncated")
+        cipher, mac = self.start_decryption(data[:HEADER.size], key)
+        crypto = data[HEADER.size:-MAC_LEN]
+        mac.update(crypto)
+        self.verify(mac, data[-MAC_LEN:])
+        return cipher.decrypt(crypto)
+
+    def encrypt_stream(self, fileobj, key):
+        """ Writer encrypting to fileobj, same format as encrypt """
+        header, cipher, mac = self.start_encryption(key)
+        fileobj.write(header)
+        return AuthenticatedWriter(fileobj, cipher, mac)
+
+    def decrypt_stream(self, fileobj, key):
+        """
+        Reader decrypting fileobj, same format as decrypt. The whole
+        file is authenticated first, by blocks
+        """
+        header = fileobj.read(HEADER.size)
+        if not header.startswith(MAGIC):
+            self.check_legacy()
+            fileobj.seek(0)
+            return self.decrypt_cfb_stream(fileobj, key)
+        fileobj.seek(0, os.SEEK_END)
+        length = fileobj.tell() - HEADER.size - MAC_LEN
+        if len(header) < HEADER.size or length < 0:
+            raise ValueError("Storage truncated")
+        cipher, mac = self.start_decryption(header, key)
+
+        fileobj.seek(HEADER.size)
+        remaining = length
+        while remaining:
+            block = fileobj.read(min(BLOCK_SIZE, remaining))
+            if not block:
+                raise ValueError("Storage truncated")
+            mac.update(block)
+            remaining -= len(block)
+        self.verify(mac, fileobj.read(MAC_LEN))
+
+        fileobj.seek(HEADER.size)
+        return StreamReader(fileobj, cipher.decrypt, length=length)
+
+    def check_legacy(self):
+        """ Files without header are only read to migrate them """
+        if not self.legacy:
+            raise ValueError("Storage corrupted or of the previous format")
+
+    def decrypt_cfb(self, data, key):
+        """ Decode cipher of the previous format """
         init_vector = data[:AES.block_size]
         data = data[AES.block_size:]
         cipher = AES.new(key, AES.MODE_CFB, init_vector)
-        msg = cipher.decrypt(data)
-        self.logger.debug("Decrypting with key %s, init vector:%s" % (key, init_vector))
-        return msg
+        return cipher.decrypt(data)
+
+    def decrypt_cfb_stream(self, fileobj, key):
+        """ Reader decrypting fileobj, in the previous format """
+        init_vector = fileobj.read(AES.block_size)
+        cipher = AES.new(key, AES.MODE_CFB, init_vector)
+        return StreamReader(fileobj, cipher.decrypt)
+
+
+class ObfuscatedLogStorage(LogStorage, ObfuscatedStorage):
+    """
+
+        Log storage whose records are encrypted and authenticated
+        each, in the format of ObfuscatedStorage files: the kind to
+        keep credentials in a log
+
+    """
+
+    def __init__(self, filename=None, **options):
+        """
+        """
+        super(ObfuscatedLogStorage, self).__init__(
+            filename=filename or os.path.expanduser("~") + "/.store.log",
+            **options)
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015 the pyp2p authors and contributors
+# <see AUTHORS and LICENSE files>
+
+import threading
+import time
+from collections import deque
+
+from pyp2p.core.exceptions import PyP2pBadArgument
+from pyp2p.presence import bare_jid
+
+# what to do with a message pushed to a full queue
+DROP_OLDEST = 'oldest'
+DROP_NEWEST = 'newest'
+
+
+class Outbox(object):
+    """
+
+        Holds messages for offline recipients, until they got online.
+        Each recipient has its own bounded queue, and messages older
+        than ttl seconds are expired.
+
+    """
+
+    def __init__(self, max_depth=100, ttl=300, drop_policy=DROP_OLDEST):
+        """  - max_depth is the maximum number of messages queued
+               per recipient
+             - ttl is the time to live of a message, in seconds (None
+               to keep messages forever)
+             - drop_policy tells which message is dropped when a
+               queue is full: the oldest one or the one being pushed
+        """
+        if drop_policy not in (DROP_OLDEST, DROP_NEWEST):
+            raise PyP2pBadArgument("Unknown drop policy: %s" % drop_policy)
+        if max_depth < 1:
+            raise PyP2pBadArgument("max_depth must be positive")
+
+        self.max_depth = max_depth
+        self.ttl = ttl
+        self.drop_policy = drop_policy
+        self.lock = threading.Lock()
+        self.queues = {}
+        self.queued = 0
+        self.flushed = 0
+        self.expired = 0
+        self.dropped = 0
+
+    def push(self, recipient, msg):
+        """ Queue a message for a recipient.
+
+            Returns False if the message was dropped
+        """
+        now = time.time()
+        bare = bare_jid(recipient)
+        with self.lock:
+            queue = self.queues.get(bare)
+            if queue is None:
+                queue = self.queues[bare] = deque()
+            else:
+                self._expire(queue, now)
+
+            if len(queue) >= self.max_depth:
+                self.dropped += 1
+                if self.drop_policy == DROP_NEWEST:
+                    return False
+                queue.popleft()
+
+            queue.append((now, msg))
+            self.queued += 1
+            return True
+
+    def pop(self, recipient):
+        """ Remove and return the pending messages of a recipient,
+            oldest first
+        """
+        with self.lock:
+            queue = self.queues.pop(bare_jid(recipient), None)
+            if queue is None:
+                return []
+            self._expire(queue, time.time())
+            self.flushed += len(queue)
+            return [msg for _, msg in queue]
+
+    def expire(self):
+        """ Drop expired messages of every recipient """
+        now = time.time()
+        with self.lock:
+            for bare, queue in list(self.queues.items()):
+                self._expire(queue, now)
+                if not queue:
+                    del self.queues[bare]
+
+    def _expire(self, queue, now):
+        if self.ttl is None:
+            return
+        while queue and now - queue[0][0] > self.ttl:
+            queue.popleft()
+            self.expired += 1
+
+    def depth(self, recipient=None):
+        """ Number of pending messages, for a recipient or overall """
+        with self.lock:
+            if recipient is not None:
+                return len(self.queues.get(bare_jid(recipient), ()))
+            return sum(len(queue) for queue in self.queues.values())
+
+    def get_counters(self):
+        """ Return the queued, flushed, expired and dropped counters """
+        with self.lock:
+            return {'queued': self.queued,
+                    'flushed': self.flushed,
+                    'expired': self.expired,
+                    'dropped': self.dropped}
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015 the pyp2p authors and contributors
+# <see AUTHORS and LICENSE files>
+
+import base64
+import threading
+import time
+import uuid
+import zlib
+
+from pyp2p.core.exceptions import PyP2pBadFormat
+
+# payload encodings
+BASE64 = 'base64'
+ZLIB_BASE64 = 'zlib+base64'
+
+# number of base64 characters per message
+CHUNK_SIZE = 16384
+
+# largest payload accepted, once decompressed
+MAX_PAYLOAD = 64 * 1024 * 1024
+
+
+def encode_payload(data, chunk_size=CHUNK_SIZE, compress=True):
+    """
+    Split binary data into text chunks that fit in messages. Data
+    is compressed when it makes it smaller.
+
+    Returns the encoding and the list of chunks
+    """
+    encoding = BASE64
+    if compress:
+        compressed = zlib.compress(data)
+        if len(compressed) < len(data):
+            data = compressed
+            encoding = ZLIB_BASE64
+
+    text = base64.b64encode(data).decode('ascii')
+    chunks = [text[index:index + chunk_size]
+              for index in range(0, len(text), chunk_size)]
+    return encoding, chunks or ['']
+
+
+def decode_payload(encoding, chunks, max_size=MAX_PAYLOAD):
+    """
+    Rebuild binary data from its text chunks, payloads of more than
+    max_size bytes once decompressed are rejected
+    """
+    try:
+        data = base64.b64decode(''.join(chunks).encode('ascii'))
+        if encoding == ZLIB_BASE64:
+            decompressor = zlib.decompressobj()
+            data = decompressor.decompress(data, max_size)
+            if decompressor.unconsumed_tail:
+                raise PyP2pBadFormat("Payload larger than %d bytes"
+                                     % max_size)
+        elif encoding != BASE64:
+            raise PyP2pBadFormat("Unknown payload encoding: %s" % encoding)
+    except (TypeError, ValueError, zlib.error) as error:
+        raise PyP2pBadFormat("Corrupted payload", detail=error)
+    return data
+
+
+def new_payload_id():
+    return uuid.uuid4().hex
+
+
+class PayloadAssembler(object):
+    """
+
+        Gathers the chunks of payloads being received.
+
+        Incomplete payloads are dropped after ttl seconds, at most
+        max_pending payloads are gathered at once, and payloads of
+        more than max_chunks chunks, or max_size bytes once
+        decompressed, are rejected.
+
+    """
+
+    def __init__(self, ttl=60, max_pending=64, max_chunks=4096,
+                 max_size=MAX_PAYLOAD):
+        """
+        """
+        self.ttl = ttl
+        self.max_pending = max_pending
+        self.max_chunks = max_chunks
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.pending = {}
+
+    def feed(self, from_jid, payload_id, seq, total, encoding, chunk):
+        """ Add a chunk, returns the payload data once complete """
+        key = (from_jid, payload_id)
+        now = time.time()
+        with self.lock:
+            self._expire(now)
+            transfer = self.pending.get(key)
+            if transfer is None:
+                if not 0 < total <= self.max_chunks or \
+                        (total > 1 and len(self.pending) >= self.max_pending):
+                    raise PyP2pBadFormat("Payload %s from %s rejected"
+                                         % (payload_id, from_jid))
+                transfer = {'started': now, 'chunks': [None] * total,
+                            'missing': total, 'encoding': encoding}
+                self.pending[key] = transfer
+            if not 0 <= seq < len(transfer['chunks']):
+                raise PyP2pBadFormat("Bad chunk %s of payload %s"
+                                     % (seq, payload_id))
+            if transfer['chunks'][seq] is None:
+                transfer['missing'] -= 1
+            transfer['chunks'][seq] = chunk
+            if transfer['missing']:
+                return None
+            del self.pending[key]
+
+        return decode_payload(transfer['encoding'], transfer['chunks'],
+                              self.max_size)
+
+    def _expire(self, now):
+        for key, transfer in list(self.pending.items()):
+            if now - transfer['started'] > self.ttl:
+                del self.pending[key]
+
+    def __len__(self):
+        return len(self.pending)
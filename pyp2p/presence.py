@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015 the pyp2p authors and contributors
+# <see AUTHORS and LICENSE files>
+
+import threading
+import time
+
+from sleekxmpp.jid import JID
+
+
+def bare_jid(jid):
+    """ Strip the resource part of a jid, given as a string or a JID """
+    if isinstance(jid, JID):
+        return jid.bare
+    return jid.split('/', 1)[0]
+
+
+class PresenceIndex(object):
+    """
+
+        Keeps track of available buddies, indexed by bare jid.
+        Each bare jid maps to the set of its available full jids
+        (one per resource), so that lookups are O(1).
+
+    """
+
+    def __init__(self):
+        """
+        """
+        self.lock = threading.Condition(threading.RLock())
+        self.resources = {}
+
+    def add(self, jid):
+        """ Record an available resource.
+
+            Returns True if the bare jid was not online before
+        """
+        bare = bare_jid(jid)
+        with self.lock:
+            known = self.resources.get(bare)
+            if known is None:
+                self.resources[bare] = set([jid])
+                self.lock.notify_all()
+                return True
+            known.add(jid)
+            return False
+
+    def remove(self, jid):
+        """ Forget an available resource.
+
+            When jid is a bare jid, all its resources are dropped.
+            Returns True if the bare jid went offline
+        """
+        bare = bare_jid(jid)
+        with self.lock:
+            known = self.resources.get(bare)
+            if known is None:
+                return False
+            if bare != jid:
+                known.discard(jid)
+                if known:
+                    return False
+            del self.resources[bare]
+            return True
+
+    def knows(self, jid):
+        """ Tell if a resource (full jid) or a buddy (bare jid) is
+            available
+        """
+        bare = bare_jid(jid)
+        with self.lock:
+            known = self.resources.get(bare)
+            return known is not None and (bare == jid or jid in known)
+
+    def clear(self):
+        """ Forget every buddy """
+        with self.lock:
+            self.resources.clear()
+
+    def is_online(self, jid):
+        """ Tell if a jid (bare or full) is available """
+        return bare_jid(jid) in self.resources
+
+    def wait_online(self, jid, timeout=None):
+        """ Block until a jid is available.
+
+            Returns False if timeout (in seconds) expired before
+        """
+        bare = bare_jid(jid)
+        deadline = None if timeout is None else time.time() + timeout
+        with self.lock:
+            while bare not in self.resources:
+                if deadline is None:
+                    self.lock.wait()
+                    continue
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self.lock.wait(remaining)
+            return True
+
+    def get_resources(self, jid):
+        """ Return the available full jids of a buddy """
+        with self.lock:
+            return frozenset(self.resources.get(bare_jid(jid), ()))
+
+    def snapshot(self):
+        """ Return the set of online bare jids """
+        with self.lock:
+            return frozenset(self.resources)
+
+    def __contains__(self, jid):
+        return self.is_online(jid)
+
+    def __iter__(self):
+        return iter(self.snapshot())
+
+    def __len__(self):
+        return len(self.resources)
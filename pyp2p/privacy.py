@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015 the pyp2p authors and contributors
+# <see AUTHORS and LICENSE files>
+
+import hashlib
+import pickle
+import threading
+import time
+
+from sleekxmpp.exceptions import IqError, IqTimeout
+from sleekxmpp.xmlstream.handler import Callback
+from sleekxmpp.xmlstream.matcher import StanzaPath
+
+from pyp2p.metrics import NULL_METRIC
+
+ROSTER_ONLY = 'roster_only'
+
+# deny message if subscrition is none
+ROSTER_ONLY_RULES = ({'value': 'none',
+                      'action': 'deny',
+                      'order': '437',
+                      'itype': 'subscription',
+                      'message': True},)
+
+
+def list_digest(name, rules, default):
+    """ Fingerprint of a privacy list definition """
+    items = [sorted(rule.items()) for rule in rules]
+    return hashlib.sha1(repr((name, items, default)).encode('utf-8')).hexdigest()
+
+
+class PrivacyManager(object):
+    """
+
+        Defines privacy lists of an xmpp client, only when they
+        differ from what was last set on the server.
+
+        The fingerprints of the lists that were set are cached in
+        memory and, when a storage is given, persisted through it.
+        Privacy lists read from the server are cached too, until the
+        server pushes a change.
+
+    """
+
+    def __init__(self, xmpp, logger, storage=None):
+        """
+        """
+        self.xmpp = xmpp
+        self.logger = logger
+        self.storage = storage
+        self.lock = threading.Lock()
+        self.digests = None
+        self.lists = {}
+        self.all_lists = None
+        # pushes caused by our own edits, by list name
+        self.own_pushes = {}
+        # histogram of the privacy requests round trip times
+        self.rtt = NULL_METRIC
+
+        xmpp.register_handler(
+            Callback('Privacy list push',
+                     StanzaPath('iq@type=set/privacy'),
+                     self.privacy_push))
+
+    def set_storage(self, storage):
+        """ Persist fingerprints through a storage """
+        with self.lock:
+            self.storage = storage
+            self.digests = None
+
+    def load_digests(self):
+        """ Return the fingerprints of the lists set, by list name """
+        if self.digests is None:
+            digests = {}
+            if self.storage is not None:
+                try:
+                    digests = self.storage.retrieve()
+                except (IOError, EOFError, ValueError,
+                        pickle.UnpicklingError) as error:
+                    self.logger.debug("No privacy cache: %s" % error)
+            self.digests = digests
+        return self.digests.setdefault(self.xmpp.boundjid.bare, {})
+
+    def save_digest(self, name, digest):
+        with self.lock:
+            digests = self.load_digests()
+            if digest is None:
+                digests.pop(name, None)
+            else:
+                digests[name] = digest
+            if self.storage is not None:
+                self.storage.store(self.digests)
+
+    def invalidate(self, name=None):
+        """ Forget what is known about a list, or about every list """
+        with self.lock:
+            digests = self.load_digests()
+            if name is None:
+                digests.clear()
+                self.lists.clear()
+            else:
+                digests.pop(name, None)
+                self.lists.pop(name, None)
+            self.all_lists = None
+            if self.storage is not None:
+                self.storage.store(self.digests)
+
+    def ensure_list(self, name=ROSTER_ONLY, rules=ROSTER_ONLY_RULES,
+                    default=True):
+        """
+        Define a privacy list and make it the default one, unless
+        the same definition was already set. Returns True when the
+        list is known to be set on the server
+        """
+        digest = list_digest(name, rules, default)
+        with self.lock:
+            if self.load_digests().get(name) == digest:
+                self.logger.debug("Privacy list %s up to date" % name)
+                return True
+
+        iq = self.xmpp.Iq()
+        iq['type'] = 'set'
+        iq['privacy']['list']['name'] = name
+        items = iq['privacy']['list']
+        for rule in rules:
+            items.add_item(**rule)
+
+        with self.lock:
+            self.own_pushes[name] = self.own_pushes.get(name, 0) + 1
+        if not self.send(iq, "Privacy rules defined"):
+            with self.lock:
+                self.own_pushes[name] -= 1
+            return False
+
+        if default:
+            iq = self.xmpp.Iq()
+            iq['type'] = 'set'
+            iq['privacy']['default']['name'] = name
+            if not self.send(iq, "Default privacy rules set"):
+                return False
+
+        self.lists.pop(name, None)
+        self.all_lists = None
+        self.save_digest(name, digest)
+        return True
+
+    def request(self, iq):
+        """
+        Send an iq and wait for its answer, timing the round trip of
+        answers, errors included. Timed out requests are not timed
+        """
+        started = time.time()
+        try:
+            resp = iq.send(now=True)
+        except IqError:
+            self.rtt.observe(time.time() - started)
+            raise
+        self.rtt.observe(time.time() - started)
+        return resp
+
+    def send(self, iq, success):
+        try:
+            self.request(iq)
+            self.logger.info(success)
+            return True
+        except IqError as e:
+            self.logger.error("Error: %s" % e.iq['error']['condition'])
+        except IqTimeout:
+            self.logger.error("No response from server.")
+        return False
+
+    def get_list(self, name):
+        """ Get a privacy list, from cache when possible """
+        resp = self.lists.get(name)
+        if resp is not None:
+            return resp
+
+        iq = self.xmpp.Iq()
+        iq['type'] = 'get'
+        iq['privacy']['list']['name'] = name
+        try:
+            resp = self.request(iq)
+            self.logger.info("Privacy get")
+            self.lists[name] = resp
+            return resp
+        except IqError as e:
+            self.logger.error("Error: %s" % e)
+        except IqTimeout:
+            self.logger.error("No response from server.")
+
+    def get_lists(self):
+        """ Get the names of privacy lists, from cache when possible """
+        if self.all_lists is not None:
+            return self.all_lists
+
+        iq = self.xmpp.Iq()
+        iq['type'] = 'get'
+        iq.enable('privacy')
+        try:
+            resp = self.request(iq)
+            self.logger.info("Privacy lists get")
+            self.all_lists = resp
+            return resp
+        except IqError as e:
+            self.logger.error("Error: %s" % e)
+        except IqTimeout:
+            self.logger.error("No response from server.")
+
+    def privacy_push(self, iq):
+        """ Process privacy list push: the server state changed """
+        name = iq['privacy']['list']['name'] or None
+        self.logger.debug("Privacy list pushed: %s" % name)
+        with self.lock:
+            own = self.own_pushes.get(name, 0)
+            if own:
+                self.own_pushes[name] = own - 1
+        if own:
+            self.lists.pop(name, None)
+            self.all_lists = None
+        else:
+            self.invalidate(name)
+        iq.reply(clear=True).send()
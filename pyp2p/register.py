@@ -11,10 +11,14 @@
 
 import sys
 import logging
+import time
 
 import sleekxmpp
 from sleekxmpp.exceptions import IqError, IqTimeout
 
+from pyp2p.core.workers import run_concurrently
+from pyp2p.privacy import PrivacyManager, ROSTER_ONLY
+
 # Python versions before 3.0 do not use UTF-8 encoding
 # by default. To ensure that Unicode is handled properly
 # throughout SleekXMPP, we will set the default encoding
@@ -25,6 +29,19 @@ if sys.version_info < (3, 0):
 else:
     raw_input = input
 
+# plugins required by the registration workflow
+PLUGINS = ('xep_0030',  # Service Discovery
+           'xep_0004',  # Data forms
+           'xep_0077',  # In-band Registration
+           'xep_0016')  # Privacy
+
+# registration outcomes
+CREATED = 'created'
+CONFLICT = 'conflict'
+FAILED = 'failed'
+TIMEOUT = 'timeout'
+UNREACHABLE = 'unreachable'
+
 
 class RegisterBot(sleekxmpp.ClientXMPP):
 
@@ -37,10 +54,13 @@ class RegisterBot(sleekxmpp.ClientXMPP):
           workflows will need to check for data forms, etc.
     """
 
-    def __init__(self, logger, jid, password):
+    def __init__(self, logger, jid, password, privacy_storage=None):
         sleekxmpp.ClientXMPP.__init__(self, jid, password)
 
         self.logger = logger
+        self.status = None
+        self.error = None
+        self.privacy = PrivacyManager(self, logger, privacy_storage)
         # The session_start event will be triggered when
         # the bot establishes its connection with the server
         # and the XML streams are ready for use. We want to
@@ -73,39 +93,11 @@ class RegisterBot(sleekxmpp.ClientXMPP):
         self.send_presence()
         self.get_roster()
 
-        # define a privacy list
-        iq = self.Iq()
-        iq['type'] = 'set'
-        iq['privacy']['list']['name'] = 'roster_only'
-        rules = iq['privacy']['list']
-
-        # deny message if subscrition is none
-        rules.add_item(value='none',
-                       action='deny',
-                       order='437',
-                       itype='subscription',
-                       message=True)
-
-        try:
-            iq.send(now=True)
-            logging.info("Privacy rules defined")
-        except IqError as e:
-            logging.error("Error: %s" % e.iq['error']['text'])
-        except IqTimeout:
-            logging.error("No response from server.")
-
-        # set the list to be the defaut one
-        iq = self.Iq()
-        iq['type'] = 'set'
-        iq['privacy']['default']['name'] = 'roster_only'
-
-        try:
-            iq.send(now=True)
-            logging.info("Default privacy rules set")
-        except IqError as e:
-            logging.error("Error: %s" % e.iq['error']['text'])
-        except IqTimeout:
-            logging.error("No response from server.")
+        # define the privacy list, and set it to be the defaut one
+        if self.status == CREATED:
+            # a new account has no privacy list yet
+            self.privacy.invalidate()
+        self.privacy.ensure_list(ROSTER_ONLY)
 
         self.send_presence(ptype='unavailable')
         self.disconnect()
@@ -114,28 +106,55 @@ class RegisterBot(sleekxmpp.ClientXMPP):
         """
         Fill out and submit a registration form.
         """
-        resp = self.Iq()
-        resp['type'] = 'set'
-        resp['register']['username'] = self.boundjid.user
-        resp['register']['password'] = self.password
-
-        try:
-            resp.send(now=True)
+        self.status, self.error = submit_registration(self)
+        if self.status == CREATED:
             self.logger.info("Account created for %s!" % self.boundjid)
-        except IqError as e:
-            self.logger.error("Could not register account: %s"
-                              % e.iq['error']['text'])
+        elif self.status == TIMEOUT:
+            self.logger.error(self.error)
             self.disconnect()
-        except IqTimeout:
-            self.logger.error("No response from server.")
+        else:
+            self.logger.error("Could not register account: %s" % self.error)
             self.disconnect()
 
 
+def submit_registration(xmpp):
+    """
+    Submit a registration form for the account of an xmpp client,
+    returns the registration status and the error text, if any
+    """
+    resp = xmpp.Iq()
+    resp['type'] = 'set'
+    resp['register']['username'] = xmpp.boundjid.user
+    resp['register']['password'] = xmpp.password
+
+    try:
+        resp.send(now=True)
+        return CREATED, None
+    except IqError as e:
+        if e.iq['error']['condition'] == 'conflict':
+            return CONFLICT, e.iq['error']['text']
+        return FAILED, e.iq['error']['text']
+    except IqTimeout:
+        return TIMEOUT, "No response from server."
+
+
 class Register(object):
 
-    def __init__(self, server_address, port):
+    def __init__(self, server_address, port, privacy_storage=None):
         self.server_address = server_address
         self.port = port
+        self.privacy_storage = privacy_storage
+
+    def make_bot(self, logger, jid, password):
+        """
+        Setup the RegisterBot and register plugins.
+        """
+        # Note that while plugins may have interdependencies,
+        # the order in which you register them does not matter.
+        xmpp = RegisterBot(logger, jid, password, self.privacy_storage)
+        for plugin in PLUGINS:
+            xmpp.register_plugin(plugin)
+        return xmpp
 
     def register(self, jid, password):
         # Setup logging.
@@ -143,14 +162,7 @@ class Register(object):
 
         logger = logging.getLogger("register")
 
-        # Setup the RegisterBot and register plugins.
-        # Note that while plugins may have interdependencies,
-        # the order in which you register them does not matter.
-        xmpp = RegisterBot(logger, jid, password)
-        xmpp.register_plugin('xep_0030')  # Service Discovery
-        xmpp.register_plugin('xep_0004')  # Data forms
-        xmpp.register_plugin('xep_0077')  # In-band Registration
-        xmpp.register_plugin('xep_0016')  # Privacy
+        xmpp = self.make_bot(logger, jid, password)
 
         # Connect to the XMPP server and start processing XMPP stanzas.
         logger.info("Connecting...")
@@ -161,3 +173,54 @@ class Register(object):
             return True
         else:
             return False
+
+    def register_and_login(self, jid, password):
+        """
+        Register an account and keep its stream open, returns the
+        P2pSession opened on it
+        """
+        from pyp2p.session import P2pSession
+        return P2pSession(server_address=self.server_address,
+                          port=self.port,
+                          jid=jid,
+                          password=password,
+                          create_account=True)
+
+    def register_many(self, credentials, concurrency=8):
+        """
+        Register several accounts, with at most concurrency
+        connections in flight.
+
+        Arguments:
+            credentials -- An iterable of (jid, password) tuples.
+
+        Returns a dictionary giving, for each jid, a dictionary
+        with the registration 'status' (CREATED, CONFLICT, FAILED,
+        TIMEOUT or UNREACHABLE), the 'error' text if any and the
+        'elapsed' time in seconds.
+        """
+        logging.basicConfig(level=logging.DEBUG)
+        logger = logging.getLogger("register")
+
+        def register_one(credential):
+            jid, password = credential
+            started = time.time()
+            try:
+                xmpp = self.make_bot(logger, jid, password)
+                xmpp.auto_reconnect = False
+                if xmpp.connect((self.server_address, self.port),
+                                reattempt=False):
+                    xmpp.process(block=True)
+                    status = xmpp.status or FAILED
+                else:
+                    status = UNREACHABLE
+                error = xmpp.error
+            except Exception as e:
+                logger.exception("Registration of %s failed" % jid)
+                status, error = FAILED, str(e)
+            return jid, {'status': status,
+                         'error': error,
+                         'elapsed': time.time() - started}
+
+        results = run_concurrently(register_one, credentials, concurrency)
+        return dict(result for result in results if result is not None)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015 the pyp2p authors and contributors
+# <see AUTHORS and LICENSE files>
+
+import logging
+import pickle
+import threading
+
+
+class RosterStore(object):
+    """
+
+        Local roster cache, to be used as a SleekXMPP roster backend.
+
+        It keeps roster items and the roster version (XEP-0237) of
+        each owner jid, so that a session starts with the roster known
+        from the previous one and only requests changes to the server.
+        Updates are written to the storage at most once per
+        flush_delay seconds.
+
+    """
+
+    def __init__(self, storage, flush_delay=1.0):
+        """
+        """
+        self.logger = logging.getLogger("rosterstore")
+        self.storage = storage
+        self.flush_delay = flush_delay
+        self.lock = threading.Lock()
+        self.timer = None
+
+        try:
+            self.rosters = storage.retrieve()
+        except (IOError, EOFError, ValueError, pickle.UnpicklingError) as error:
+            self.logger.debug("No roster cache: %s" % error)
+            self.rosters = {}
+
+    def entries(self, owner, db_state=None):
+        """ Return the owners known, or the jids in an owner's roster """
+        with self.lock:
+            if owner is None:
+                return list(self.rosters)
+            return list(self.rosters.get(owner, {}).get('items', {}))
+
+    def load(self, owner, jid, db_state):
+        """ Return the state of a roster item, or None """
+        with self.lock:
+            item = self.rosters.get(owner, {}).get('items', {}).get(jid)
+            return dict(item) if item is not None else None
+
+    def save(self, owner, jid, item_state, db_state):
+        """ Record the state of a roster item """
+        with self.lock:
+            items = self._roster(owner)['items']
+            if item_state.get('removed'):
+                items.pop(jid, None)
+            else:
+                items[jid] = dict(item_state)
+            self._schedule_flush()
+
+    def version(self, owner):
+        """ Return the roster version of an owner """
+        with self.lock:
+            return self.rosters.get(owner, {}).get('version', '')
+
+    def set_version(self, owner, version):
+        """ Record the roster version of an owner """
+        with self.lock:
+            self._roster(owner)['version'] = version
+            self._schedule_flush()
+
+    def _roster(self, owner):
+        return self.rosters.setdefault(owner, {'version': '', 'items': {}})
+
+    def _schedule_flush(self):
+        if self.timer is None:
+            self.timer = threading.Timer(self.flush_delay, self.flush)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def flush(self):
+        """ Write pending updates to the storage """
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            self.storage.store(self.rosters)
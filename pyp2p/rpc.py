@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015 the pyp2p authors and contributors
+# <see AUTHORS and LICENSE files>
+
+import threading
+import uuid
+
+from sleekxmpp.jid import JID
+from sleekxmpp.xmlstream.handler import Callback
+from sleekxmpp.xmlstream.matcher import StanzaPath
+
+from pyp2p.core.exceptions import PyP2pFailed, PyP2pTimedOut
+from pyp2p.dispatcher import MessageDispatcher
+from pyp2p.scheduler import get_shared_scheduler
+import pyp2p.stanzas  # registers pyp2p stanza extensions
+
+# rpc element types
+REQUEST = 'request'
+RESPONSE = 'response'
+ERROR = 'error'
+
+
+class RpcCall(object):
+    """
+
+        Pending result of a remote call
+
+    """
+
+    def __init__(self, call_id, jid):
+        """
+        """
+        self.id = call_id
+        self.jid = jid
+        self.value = None
+        self.error = None
+        self.task = None
+        self.callbacks = []
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+
+    def done(self):
+        """ Tell if the response (or an error) came """
+        return self.finished.is_set()
+
+    def result(self, timeout=None):
+        """
+        Wait for the response and return it. Raises PyP2pTimedOut
+        when the call timed out, or timeout (in seconds) expires
+        first, and PyP2pFailed when the peer answered an error
+        """
+        if not self.finished.wait(timeout):
+            raise PyP2pTimedOut("No response from %s after %ss"
+                                % (self.jid, timeout))
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+    def add_done_callback(self, func):
+        """ Call func(call) once the call is done """
+        with self.lock:
+            if not self.finished.is_set():
+                self.callbacks.append(func)
+                return
+        func(self)
+
+    def set_result(self, value):
+        self.finish(value, None)
+
+    def set_error(self, error):
+        self.finish(None, error)
+
+    def finish(self, value, error):
+        with self.lock:
+            if self.finished.is_set():
+                return
+            self.value = value
+            self.error = error
+            self.finished.set()
+            callbacks, self.callbacks = self.callbacks, []
+        if self.task is not None:
+            self.task.cancel()
+        for func in callbacks:
+            func(self)
+
+
+class RpcManager(object):
+    """
+
+        Request/response calls between xmpp clients.
+
+        Requests and responses are carried by messages holding an
+        <rpc xmlns="urn:pyp2p:rpc"/> element, and matched by their
+        id: any number of calls may be in flight. Call timeouts are
+        run by a scheduler shared by every session.
+
+    """
+
+    def __init__(self, xmpp, logger, timer=None):
+        """
+        """
+        self.xmpp = xmpp
+        self.logger = logger
+        self.timer = timer
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.handler = None
+        self.dispatcher = None
+
+        xmpp.register_handler(
+            Callback('RPC',
+                     StanzaPath('message/rpc'),
+                     self.received))
+
+    def set_handler(self, handler, workers=0, max_pending=1000):
+        """
+        Serve requests with handler(from_jid=..., payload=...), the
+        returned value is the response. An exception raised by the
+        handler is sent back as an error.
+
+        With workers > 0 requests are served by a pool of worker
+        threads, otherwise by the SleekXMPP event thread.
+        """
+        if self.dispatcher is not None:
+            self.dispatcher.stop(wait=False)
+            self.dispatcher = None
+        self.handler = handler
+        if handler is not None and workers > 0:
+            self.dispatcher = MessageDispatcher(callback=self.dispatched,
+                                                workers=workers,
+                                                max_pending=max_pending)
+
+    def call(self, jid, payload, timeout=30):
+        """
+        Send a request, returns a RpcCall giving its response
+        """
+        call = RpcCall(uuid.uuid4().hex, jid)
+        with self.lock:
+            self.pending[call.id] = call
+        if timeout is not None:
+            if self.timer is None:
+                self.timer = get_shared_scheduler()
+            call.task = self.timer.call_later(timeout, self.expire, call.id,
+                                              timeout)
+        self.send(jid, call.id, REQUEST, payload)
+        return call
+
+    def send(self, jid, call_id, kind, payload):
+        msg = self.xmpp.make_message(mto=jid, mtype='chat')
+        msg['rpc']['id'] = call_id
+        msg['rpc']['type'] = kind
+        msg['rpc']['data'] = payload
+        msg.send()
+
+    def expire(self, call_id, timeout):
+        with self.lock:
+            call = self.pending.pop(call_id, None)
+        if call is not None:
+            call.set_error(PyP2pTimedOut("No response from %s after %ss"
+                                         % (call.jid, timeout)))
+
+    def received(self, msg):
+        """ Process rpc elements: serve requests, match responses """
+        rpc = msg['rpc']
+        from_jid = msg['from']
+        if msg['type'] == 'error':
+            self.complete(rpc['id'], from_jid.bare, None,
+                          PyP2pFailed("Call to %s bounced: %s"
+                                      % (from_jid, msg['error']['condition'])))
+        elif rpc['type'] == REQUEST:
+            if self.dispatcher is not None:
+                self.dispatcher.dispatch(from_jid.bare,
+                                         (from_jid.full, rpc['id'], rpc['data']))
+            else:
+                self.serve(from_jid.full, rpc['id'], rpc['data'])
+        elif rpc['type'] == RESPONSE:
+            self.complete(rpc['id'], from_jid.bare, rpc['data'], None)
+        elif rpc['type'] == ERROR:
+            self.complete(rpc['id'], from_jid.bare, None,
+                          PyP2pFailed("Call to %s failed: %s"
+                                      % (from_jid, rpc['data'])))
+
+    def dispatched(self, from_jid, msg_body):
+        self.serve(*msg_body)
+
+    def serve(self, reply_to, call_id, payload):
+        if self.handler is None:
+            self.send(reply_to, call_id, ERROR, "No handler")
+            return
+        try:
+            response = self.handler(from_jid=JID(reply_to).bare,
+                                    payload=payload)
+        except Exception as error:
+            self.logger.exception("RPC handler failed")
+            self.send(reply_to, call_id, ERROR, "%s" % error)
+            return
+        self.send(reply_to, call_id, RESPONSE,
+                  response if response is not None else '')
+
+    def complete(self, call_id, from_jid, value, error):
+        with self.lock:
+            call = self.pending.get(call_id)
+            # only the callee may answer
+            if call is None or JID(call.jid).bare != from_jid:
+                self.logger.debug("Unexpected response %s from %s"
+                                  % (call_id, from_jid))
+                return
+            del self.pending[call_id]
+        call.finish(value, error)
+
+    def close(self):
+        """ Fail the calls in flight, and stop serving requests """
+        with self.lock:
+            calls, self.pending = list(self.pending.values()), {}
+        for call in calls:
+            call.set_error(PyP2pFailed("Session closed"))
+        if self.dispatcher is not None:
+            self.dispatcher.stop()
+            self.dispatcher = None
+
+    def __len__(self):
+        return len(self.pending)
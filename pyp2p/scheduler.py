@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015 the pyp2p authors and contributors
+# <see AUTHORS and LICENSE files>
+
+import heapq
+import itertools
+import logging
+import math
+import threading
+import time
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def get_shared_scheduler():
+    """ Return the started Scheduler shared by the whole process """
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = Scheduler(name="pyp2p shared scheduler")
+            _shared.start()
+        return _shared
+
+
+class ScheduledTask(object):
+    """
+
+        A call registered in a Scheduler
+
+    """
+
+    def __init__(self, due, func, args, interval=None):
+        """
+        """
+        self.due = due
+        self.func = func
+        self.args = args
+        self.interval = interval
+        self.rounds = 0
+        self.cancelled = False
+
+    def cancel(self):
+        """ Prevent the task from running again """
+        self.cancelled = True
+
+
+class Scheduler(object):
+    """
+
+        Runs delayed and periodic calls from a single thread, so that
+        many sessions can share it instead of owning a timer each.
+        Calls must be short, they delay every other task.
+
+    """
+
+    def __init__(self, name="pyp2p scheduler"):
+        """
+        """
+        self.logger = logging.getLogger("scheduler")
+        self.name = name
+        self.lock = threading.Condition()
+        self.heap = []
+        self.counter = itertools.count()
+        self.thread = None
+        self.running = False
+
+    def start(self):
+        """ Start the scheduler thread """
+        with self.lock:
+            if self.running:
+                return
+            self.running = True
+        self.thread = threading.Thread(target=self.run, name=self.name)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """ Stop the scheduler thread, pending tasks are dropped """
+        with self.lock:
+            self.running = False
+            self.heap = []
+            self.lock.notify()
+        if self.thread is not None and \
+                self.thread is not threading.current_thread():
+            self.thread.join()
+        self.thread = None
+
+    def call_later(self, delay, func, *args):
+        """ Run func(*args) once, in delay seconds """
+        task = ScheduledTask(time.time() + delay, func, args)
+        self.push(task)
+        return task
+
+    def call_every(self, interval, func, *args, **kwargs):
+        """ Run func(*args) every interval seconds.
+
+            The first call happens after the 'delay' keyword
+            argument, or after interval seconds
+        """
+        delay = kwargs.get('delay', interval)
+        task = ScheduledTask(time.time() + delay, func, args, interval)
+        self.push(task)
+        return task
+
+    def push(self, task):
+        with self.lock:
+            heapq.heappush(self.heap, (task.due, next(self.counter), task))
+            self.lock.notify()
+
+    def __len__(self):
+        return len(self.heap)
+
+    def run(self):
+        while True:
+            with self.lock:
+                if not self.running:
+                    return
+                if not self.heap:
+                    self.lock.wait()
+                    continue
+                due, _, task = self.heap[0]
+                delay = due - time.time()
+                if delay > 0:
+                    self.lock.wait(delay)
+                    continue
+                heapq.heappop(self.heap)
+
+            if task.cancelled:
+                continue
+            try:
+                task.func(*task.args)
+            except Exception:
+                self.logger.exception("Scheduled task failed")
+
+            if task.interval is not None and not task.cancelled:
+                task.due = max(task.due + task.interval, time.time())
+                self.push(task)
+
+
+class TimerWheel(object):
+    """
+
+        Hashed timer wheel, for many long and imprecise timers (e.g.
+        one keepalive per session): scheduling and cancelling are
+        O(1), and each tick only scans one slot.
+
+        Delays are rounded up to the tick. Calls are run from a
+        single thread and must be short.
+
+    """
+
+    def __init__(self, tick=1.0, slots=512, name="pyp2p timer wheel"):
+        """
+        """
+        self.logger = logging.getLogger("scheduler")
+        self.tick = tick
+        self.name = name
+        self.lock = threading.Lock()
+        self.slots = [[] for _ in range(slots)]
+        self.current = 0
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """ Start the wheel thread """
+        if self.thread is not None:
+            return
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, name=self.name)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """ Stop the wheel thread, pending timers are dropped """
+        self.stopped.set()
+        if self.thread is not None and \
+                self.thread is not threading.current_thread():
+            self.thread.join()
+        self.thread = None
+        with self.lock:
+            self.slots = [[] for _ in self.slots]
+
+    def call_later(self, delay, func, *args):
+        """ Run func(*args) once, in delay seconds (rounded up) """
+        ticks = max(1, int(math.ceil(delay / self.tick)))
+        task = ScheduledTask(None, func, args)
+        with self.lock:
+            task.rounds = (ticks - 1) // len(self.slots)
+            self.slots[(self.current + ticks) % len(self.slots)].append(task)
+        return task
+
+    def __len__(self):
+        with self.lock:
+            return sum(1 for slot in self.slots for task in slot
+                       if not task.cancelled)
+
+    def advance(self):
+        """ Move to the next slot, returns the expired tasks """
+        with self.lock:
+            self.current = (self.current + 1) % len(self.slots)
+            expired = []
+            remaining = []
+            for task in self.slots[self.current]:
+                if task.cancelled:
+                    continue
+                if task.rounds:
+                    task.rounds -= 1
+                    remaining.append(task)
+                else:
+                    expired.append(task)
+            self.slots[self.current] = remaining
+        return expired
+
+    def run(self):
+        next_tick = time.time() + self.tick
+        while not self.stopped.wait(max(0, next_tick - time.time())):
+            next_tick += self.tick
+            for task in self.advance():
+                if task.cancelled:
+                    continue
+                try:
+                    task.func(*task.args)
+                except Exception:
+                    self.logger.exception("Timer failed")
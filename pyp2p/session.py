@@ -11,11 +11,32 @@
 
 import sys
 import logging
+import threading
 import time
+from xml.sax.saxutils import quoteattr
 
 import sleekxmpp
 from sleekxmpp.exceptions import IqError, IqTimeout
 from sleekxmpp.jid import JID
+from sleekxmpp.xmlstream import tostring
+from sleekxmpp.xmlstream.handler import Callback, Waiter
+from sleekxmpp.xmlstream.matcher import MatchMany, MatchXPath, StanzaPath
+from sleekxmpp.plugins.xep_0198.stanza import Failed, Resume, Resumed
+
+from pyp2p.core.exceptions import PyP2pBadFormat, PyP2pTimedOut
+from pyp2p.dispatcher import MessageDispatcher
+from pyp2p.keepalive import AdaptiveKeepalive
+from pyp2p.metrics import NULL_REGISTRY
+from pyp2p.outbox import Outbox, DROP_OLDEST
+from pyp2p.payload import PayloadAssembler, encode_payload, new_payload_id
+from pyp2p.payload import CHUNK_SIZE
+from pyp2p.presence import PresenceIndex, bare_jid
+from pyp2p.privacy import PrivacyManager, ROSTER_ONLY
+from pyp2p.roster_store import RosterStore
+from pyp2p.rpc import RpcManager
+from pyp2p.transfer import DirectTransferManager, MAX_SIZE
+from pyp2p.register import submit_registration, CREATED, CONFLICT, TIMEOUT
+import pyp2p.stanzas  # registers pyp2p stanza extensions
 
 # Python versions before 3.0 do not use UTF-8 encoding
 # by default. To ensure that Unicode is handled properly
@@ -34,6 +55,18 @@ def my_verify(expected, raw_cert):
 # FIXME: skip certificate verification for now !!!
 sleekxmpp.xmlstream.cert.verify = my_verify
 
+# delivery status of batched messages
+SENT = 'sent'
+SKIPPED_OFFLINE = 'skipped-offline'
+QUEUED = 'queued'
+
+# how bulk payloads were sent
+DIRECT = 'direct'
+INBAND = 'inband'
+
+# number of stanzas written to the stream at once by batched sends
+BATCH_CHUNK_SIZE = 64
+
 
 class SessionBot(sleekxmpp.ClientXMPP):
 
@@ -48,41 +81,279 @@ class SessionBot(sleekxmpp.ClientXMPP):
         self.add_event_handler("message", self.message)
         self.add_event_handler("got_online", self.online_buddy)
         self.add_event_handler("got_offline", self.offline_buddy)
-        self.online_buddys = []
+        self.add_event_handler("presence_available", self.online_resource)
+        self.add_event_handler("presence_unavailable", self.offline_resource)
+        self.add_event_handler("disconnected", self.disconnected)
+        self.add_event_handler("session_resumed", self.resumed)
+        self.register_handler(
+            Callback('Payload chunk',
+                     StanzaPath('message/payload'),
+                     self.payload_chunk))
+        self.presence = PresenceIndex()
+        self.outbox = None
+        self.outbox_expiry = False
         self.logger = logger
         self.msg_cb = None
-        self.ready = False
+        self.payload_cb = None
+        self.payloads = PayloadAssembler()
+        self.dispatcher = None
+        self.log_bodies = True
+        self.needs_privacy = False
+        self.privacy = PrivacyManager(self, self.logger)
+        self.rpc = RpcManager(self, self.logger)
+        self.transfers = DirectTransferManager(self, self.logger,
+                                               self.payload_received)
+        self.roster_store = None
+        self.keepalive = None
+        self.stream_management = False
+        self.ready = threading.Event()
+        self.sessions_started = 0
+        # keepalive pings waiting for an answer, by iq id
+        self.pings_sent = {}
+        self.set_metrics(NULL_REGISTRY)
+
+    def setup_session(self, keepalive=True, stream_management=False):
+        """
+        Set reconnection and subscription policies, and register
+        privacy and ping plugins. Keepalive pings are sent every 45s
+        unless keepalive is False (i.e. they are driven from outside
+        with keepalive_ping), or an AdaptiveKeepalive that will watch
+        the session.
+
+        With stream_management, stanzas are acknowledged and the
+        session is resumed on reconnection (XEP-0198).
+        """
+        self.auto_reconnect = True
+        self.auto_authorize = False
+        self.register_plugin('xep_0016')  # Privacy
+        self.register_plugin('xep_0199')  # Ping
+        if isinstance(keepalive, AdaptiveKeepalive):
+            keepalive.register(self)
+            self.keepalive = keepalive
+        elif keepalive:
+            self.plugin['xep_0199'].enable_keepalive(interval=45, timeout=5)
+        if stream_management:
+            self.register_plugin('xep_0198',  # Stream Management
+                                 pconfig={'allow_resume': True})
+            self.stream_management = True
+            # SleekXMPP forgets the stream management state whenever a
+            # stream ends, even to reconnect: it could never resume
+            self.del_event_handler('session_end',
+                                   self.plugin['xep_0198'].session_end)
+            self.add_event_handler('session_end', self.stream_ended)
+            self.add_event_handler('sm_failed', self.stream_failed)
+            plugin = self.plugin['xep_0198']
+            for order in (plugin.order, plugin.resume_order):
+                self.unregister_feature('sm', order)
+                self.register_feature('sm', self.stream_feature,
+                                      restart=True, order=order)
+
+    def set_metrics(self, registry):
+        """
+        Record counters and histograms in a MetricsRegistry, see
+        pyp2p.metrics for exporters. Metrics are disabled with
+        NULL_REGISTRY, the default
+        """
+        self.metrics = registry
+        self.sent_count = registry.counter(
+            'pyp2p_messages_sent_total', "Chat messages sent")
+        self.received_count = registry.counter(
+            'pyp2p_messages_received_total', "Chat messages received")
+        self.skipped_count = registry.counter(
+            'pyp2p_messages_skipped_offline_total',
+            "Messages not sent because the recipient was offline")
+        self.callback_latency = registry.histogram(
+            'pyp2p_callback_seconds', "Message callback duration")
+        self.roster_rtt = registry.histogram(
+            'pyp2p_roster_rtt_seconds', "Roster request round trip time")
+        self.keepalive_rtt = registry.histogram(
+            'pyp2p_keepalive_rtt_seconds', "Keepalive ping round trip time")
+        self.disconnect_count = registry.counter(
+            'pyp2p_disconnects_total', "Stream disconnections")
+        self.reconnect_count = registry.counter(
+            'pyp2p_reconnects_total',
+            "Sessions started or resumed again after a disconnection")
+        self.online_count = registry.counter(
+            'pyp2p_presence_online_total', "Buddy resources got online")
+        self.offline_count = registry.counter(
+            'pyp2p_presence_offline_total', "Buddy resources got offline")
+        self.privacy.rtt = registry.histogram(
+            'pyp2p_privacy_rtt_seconds', "Privacy request round trip time")
+        if self.dispatcher is not None:
+            self.dispatcher.latency = self.callback_latency
+
+    def keepalive_ping(self, timeout=5):
+        """
+        Ping the server without blocking, the stream is
+        reconnected if no answer comes within timeout seconds
+        """
+        if not self.is_ready():
+            return
+        iq = self.Iq()
+        iq['type'] = 'get'
+        iq['to'] = self.boundjid.host
+        iq.enable('ping')
+        if self.metrics.enabled:
+            self.pings_sent[iq['id']] = time.time()
+        iq.send(block=False, timeout=timeout,
+                callback=self.keepalive_pong,
+                timeout_callback=self.keepalive_lost)
+
+    def keepalive_pong(self, iq):
+        """ Process keepalive ping answer """
+        sent = self.pings_sent.pop(iq['id'], None)
+        if sent is not None:
+            self.keepalive_rtt.observe(time.time() - sent)
+        self.event("keepalive_pong", iq)
+
+    def keepalive_lost(self, iq):
+        """ Process keepalive ping timeout """
+        self.logger.warn("No keepalive answer, reconnecting")
+        self.pings_sent.pop(iq['id'], None)
+        self.event("keepalive_lost", iq)
+        self.reconnect()
 
     def is_ready(self):
         """ Accessor for ready to send state"""
-        return self.ready
+        return self.ready.is_set()
 
-    def set_msg_callback(self, cb):
+    def wait_ready(self, timeout=None):
+        """
+        Waits until the session is ready to send, raises
+        PyP2pTimedOut if timeout (in seconds) expires first
         """
-        Set a callback to be called upon message reception
+        if not self.ready.wait(timeout):
+            raise PyP2pTimedOut("Session not ready after %ss" % timeout)
+
+    def set_msg_callback(self, cb, workers=0, max_pending=1000,
+                         put_timeout=None):
         """
+        Set a callback to be called upon message reception.
+
+        With workers > 0 the callback is run by a pool of worker
+        threads (see MessageDispatcher), otherwise it is run by the
+        SleekXMPP event thread.
+        """
+        if self.dispatcher is not None:
+            self.dispatcher.stop(wait=False)
+            self.dispatcher = None
         self.msg_cb = cb
+        if cb is not None and workers > 0:
+            self.dispatcher = MessageDispatcher(callback=cb,
+                                                workers=workers,
+                                                max_pending=max_pending,
+                                                put_timeout=put_timeout,
+                                                latency=self.callback_latency)
+
+    def set_payload_callback(self, cb):
+        """
+        Set a callback to be called upon binary payload reception,
+        as cb(from_jid=..., payload=...)
+        """
+        self.payload_cb = cb
+
+    def set_rpc_handler(self, handler, workers=0, max_pending=1000):
+        """
+        Serve remote calls: handler(from_jid=..., payload=...) returns
+        the response. With workers > 0 it is run by a pool of worker
+        threads, otherwise by the SleekXMPP event thread.
+        """
+        self.rpc.set_handler(handler, workers=workers,
+                             max_pending=max_pending)
+
+    def call(self, jid, payload, timeout=30):
+        """
+        Call a remote handler without blocking. Returns a RpcCall,
+        whose result() is the response; it raises PyP2pTimedOut if
+        no response came within timeout seconds
+        """
+        return self.rpc.call(jid, payload, timeout=timeout)
+
+    def enable_direct_transfer(self, host=None, max_size=MAX_SIZE,
+                               timeout=10):
+        """
+        Send and accept bulk payloads over direct TCP connections
+        between peers. host is the address to listen on and to give
+        to peers, the local address of the xmpp connection by default
+        """
+        self.transfers.enable(host=host, max_size=max_size, timeout=timeout)
+
+    def set_log_bodies(self, enabled):
+        """
+        Enable or disable logging of received messages bodies
+        """
+        self.log_bodies = enabled
+
+    @property
+    def online_buddys(self):
+        """ Snapshot of the online buddies bare jids """
+        return self.presence.snapshot()
 
-    def wait_online(self):
-        """ Waits until we got online
+    def enable_outbox(self, max_depth=100, ttl=300, drop_policy=DROP_OLDEST):
         """
-        while self.jid not in self.online_buddys:
-            time.sleep(1)
+        Hold messages for offline buddies instead of dropping them,
+        they are sent when the buddy gets online
+        """
+        self.outbox = Outbox(max_depth=max_depth, ttl=ttl,
+                             drop_policy=drop_policy)
+        # one expiry task sweeps whatever outbox is enabled, messages
+        # are expired on push and pop anyway
+        if ttl is not None and not self.outbox_expiry:
+            self.schedule('outbox expiry', ttl, self.expire_outbox,
+                          repeat=True)
+            self.outbox_expiry = True
+
+    def expire_outbox(self):
+        """ Drop the held messages whose ttl expired """
+        if self.outbox is not None:
+            self.outbox.expire()
+
+    def is_online(self, jid):
+        """ Tell if a buddy (bare or full jid) is online """
+        return self.presence.is_online(jid)
+
+    def wait_online(self, jid=None, timeout=None):
+        """ Waits until a buddy (ourself by default) got online,
+            raises PyP2pTimedOut if timeout (in seconds) expires first
+        """
+        if jid is None:
+            jid = self.boundjid.bare
+        if not self.presence.wait_online(jid, timeout):
+            raise PyP2pTimedOut("%s not online after %ss" % (jid, timeout))
 
     def online_buddy(self, presence):
         """ Process presence notifications """
-        jid = JID(presence['from']).bare
-        self.logger.debug('%s got online' % jid)
-        self.online_buddys.append(jid)
+        jid = JID(presence['from'])
+        self.logger.debug('%s got online' % jid.bare)
+        self.presence.add(jid.full)
+
+        if self.outbox is not None:
+            self.flush_outbox(jid.bare)
+
+    def flush_outbox(self, jid):
+        """ Send the messages held for a buddy """
+        for msg in self.outbox.pop(jid):
+            self.send_message(mto=jid, mbody=msg, mtype='chat')
+            self.sent_count.inc()
 
     def offline_buddy(self, presence):
-        """ Process presence notifications """
-        jid = JID(presence['from']).bare
-        self.logger.debug('%s got offline' % jid)
-        try:
-            self.online_buddys.remove(jid)
-        except ValueError:
+        """ Process presence notifications, the buddy was already
+            dropped by offline_resource
+        """
+        self.logger.debug('%s got offline' % JID(presence['from']).bare)
+
+    def online_resource(self, presence):
+        """ Track every available resource of a buddy """
+        self.online_count.inc()
+        self.presence.add(JID(presence['from']).full)
+
+    def offline_resource(self, presence):
+        """ Track every unavailable resource of a buddy """
+        self.offline_count.inc()
+        jid = JID(presence['from']).full
+        if not self.presence.knows(jid):
             self.logger.warn('%s was available but unoticed' % jid)
+        self.presence.remove(jid)
 
     def message(self, msg):
         """
@@ -98,9 +369,113 @@ class SessionBot(sleekxmpp.ClientXMPP):
         """
         if msg['type'] in ('chat', 'normal'):
             from_jid = JID(msg['from']).bare
-            self.logger.info("%s:%s" % (from_jid, msg['body']))
-            if self.msg_cb is not None:
-                self.msg_cb(from_jid=from_jid, msg_body=msg['body'])
+            self.received_count.inc()
+            if self.log_bodies:
+                self.logger.info("%s:%s", from_jid, msg['body'])
+            if self.dispatcher is not None:
+                self.dispatcher.dispatch(from_jid, msg['body'])
+            elif self.msg_cb is not None:
+                if not self.metrics.enabled:
+                    self.msg_cb(from_jid=from_jid, msg_body=msg['body'])
+                    return
+                started = time.time()
+                try:
+                    self.msg_cb(from_jid=from_jid, msg_body=msg['body'])
+                finally:
+                    self.callback_latency.observe(time.time() - started)
+
+    def payload_chunk(self, msg):
+        """
+        Process a payload chunk, the payload callback is called
+        once every chunk of the payload was received
+        """
+        from_jid = JID(msg['from']).bare
+        chunk = msg['payload']
+        try:
+            seq, total = chunk['seq'], chunk['total']
+        except ValueError:
+            self.logger.warning("%s: malformed payload chunk" % from_jid)
+            return
+        try:
+            data = self.payloads.feed(from_jid, chunk['id'], seq, total,
+                                      chunk['encoding'], chunk['data'])
+        except PyP2pBadFormat as error:
+            self.logger.warning("%s: %s" % (from_jid, error.msg))
+            return
+        if data is not None:
+            self.payload_received(from_jid, data)
+
+    def payload_received(self, from_jid, data):
+        """ Hand a complete payload to the payload callback """
+        self.logger.debug("%s: payload of %d bytes" % (from_jid, len(data)))
+        if self.payload_cb is not None:
+            self.payload_cb(from_jid=from_jid, payload=data)
+
+    def disconnected(self, event):
+        """
+        Process disconnection: nothing can be sent until next
+        session start, and presences are outdated unless the session
+        may be resumed
+        """
+        self.ready.clear()
+        self.disconnect_count.inc()
+        self.pings_sent.clear()
+        if not self.stream_management:
+            self.presence.clear()
+
+    def stream_ended(self, event):
+        """
+        Process the end of a managed stream: its state is kept to
+        resume the session, unless the session was closed on purpose
+        """
+        if not self.auto_reconnect:
+            self.plugin['xep_0198'].session_end(event)
+
+    def stream_feature(self, features):
+        """
+        Enable or resume stream management. SleekXMPP only waits for
+        the answer to a resumption once it is requested, and misses a
+        quick one: the waiter is registered first here
+        """
+        plugin = self.plugin['xep_0198']
+        if 'stream_management' in self.features or not plugin.sm_id:
+            return plugin._handle_sm_feature(features)
+        waiter = Waiter('resumed_or_failed',
+                        MatchMany([MatchXPath(Resumed.tag_name()),
+                                   MatchXPath(Failed.tag_name())]))
+        self.register_handler(waiter)
+        plugin.enabled.set()
+        resume = Resume(self)
+        resume['h'] = plugin.handled
+        resume['previd'] = plugin.sm_id
+        resume.send(now=True)
+        result = waiter.wait()
+        if result is not None and result.name == 'resumed':
+            return True
+        # forget the stream now, so that it is enabled again once
+        # bound: sm_failed is only processed after the negotiation
+        plugin.session_end(result)
+        return False
+
+    def stream_failed(self, event):
+        """
+        Process a stream management failure: the server forgot the
+        session, buddies may have got offline meanwhile. The stream
+        state is reset, unless a new stream is being enabled
+        """
+        self.logger.info("Stream management failed")
+        if not self.plugin['xep_0198'].enabled.is_set():
+            self.plugin['xep_0198'].session_end(event)
+        self.presence.clear()
+
+    def resumed(self, event):
+        """
+        Process stream management resumption: the session state was
+        kept by the server, and unacknowledged stanzas are sent again
+        """
+        self.logger.info("Session resumed")
+        self.reconnect_count.inc()
+        self.ready.set()
 
     def failed_auth(self, event):
         """
@@ -121,14 +496,37 @@ class SessionBot(sleekxmpp.ClientXMPP):
                      event does not provide any additional
                      data.
         """
+        started = self.session_starting()
         try:
             self.get_roster()
+            self.roster_rtt.observe(time.time() - started)
         except IqError as err:
             self.logger.error('%s' % err.iq['error']['condition'])
         except IqTimeout:
             self.logger.error('Request timed out')
+        self.session_started()
+
+    def session_starting(self):
+        """
+        Count session starts, returns the time the roster request
+        is sent at
+        """
+        if self.sessions_started:
+            self.reconnect_count.inc()
+        self.sessions_started += 1
+        return time.time()
+
+    def session_started(self):
+        """
+        Once the roster is known: set privacy if needed, broadcast
+        presence and get ready to send
+        """
+        if self.needs_privacy:
+            self.set_privacy()
+            self.needs_privacy = False
+        self.presence.clear()
         self.send_presence()
-        self.ready = True
+        self.ready.set()
 
     def subscribe(self, targetjid):
         """
@@ -142,108 +540,232 @@ class SessionBot(sleekxmpp.ClientXMPP):
         """
         self.send_presence(pto=targetjid, ptype='unsubscribe')
 
+    def set_roster_cache(self, storage):
+        """
+        Keep the roster and its version in a storage, so that next
+        sessions start with the cached roster and only request the
+        changes from the server (XEP-0237). Must be called before
+        connecting
+        """
+        self.roster_store = RosterStore(storage)
+        self.roster.set_backend(self.roster_store)
+
+    def set_privacy_cache(self, storage):
+        """
+        Persist privacy lists fingerprints through a storage, so
+        that unchanged lists are not set again by next sessions
+        """
+        self.privacy.set_storage(storage)
+
     def set_privacy(self):
         """
         Set privacy to block anything from users that
         are not in the roster
         """
-
-        iq = self.Iq()
-        iq['type'] = 'set'
-        iq['privacy']['list']['name'] = 'roster_only'
-        rules = iq['privacy']['list']
-
-        # deny message if subscrition is none
-        rules.add_item(value='none',
-                       action='deny',
-                       order='437',
-                       itype='subscription',
-                       message=True)
-
-        try:
-            iq.send(now=True)
-            self.logger.info("Privacy rules defined")
-        except IqError as e:
-            self.logger.error("Error: %s" % e.iq['error']['condition'])
-        except IqTimeout:
-            self.logger.error("No response from server.")
-
-        iq = self.Iq()
-        iq['type'] = 'set'
-        iq['privacy']['default']['name'] = 'roster_only'
-
-        try:
-            iq.send(now=True)
-            self.logger.info("Default privacy rules set")
-        except IqError as e:
-            self.logger.error("Error: %s" % e.iq['error']['condition'])
-        except IqTimeout:
-            self.logger.error("No response from server.")
+        self.privacy.ensure_list(ROSTER_ONLY)
 
     def get_privacy_list(self, list_name):
         """
         Get privacy list
         """
-        iq = self.Iq()
-        iq['type'] = 'get'
-        iq['privacy']['list']['name'] = list_name
-        try:
-            resp = iq.send(now=True)
-            self.logger.info("Privacy get")
-            return resp
-        except IqError as e:
-            self.logger.error("Error: %s" % e)
-        except IqTimeout:
-            self.logger.error("No response from server.")
+        return self.privacy.get_list(list_name)
 
     def get_lists(self):
         """
         Get privacy lists
         """
-        iq = self.Iq()
-        iq['type'] = 'get'
-        iq.enable('privacy')
-        try:
-            resp = iq.send(now=True)
-            self.logger.info("Privacy lists get")
-            return resp
-        except IqError as e:
-            self.logger.error("Error: %s" % e)
-        except IqTimeout:
-            self.logger.error("No response from server.")
+        return self.privacy.get_lists()
 
     def bot_send(self, recipient, msg):
         """
-        Send message, only if buddy is online
+        Send message, only if buddy is online. Otherwise the
+        message is queued when the outbox is enabled
         """
 
-        if recipient in self.online_buddys:
+        if self.presence.is_online(recipient):
             self.send_message(mto=recipient,
                               mbody=msg,
                               mtype='chat')
+            self.sent_count.inc()
+        elif self.outbox is not None and self.outbox.push(recipient, msg):
+            self.logger.info("%s queued (not online)" % recipient)
+            # the buddy may have got online meanwhile
+            if self.presence.is_online(recipient):
+                self.flush_outbox(bare_jid(recipient))
         else:
             self.logger.info("%s skipped (not online)" % recipient)
+            self.skipped_count.inc()
+
+    def bot_send_payload(self, recipient, data, compress=True,
+                         chunk_size=CHUNK_SIZE):
+        """
+        Send binary data, only if buddy is online. Data is
+        compressed, base64 encoded and split over as many messages
+        as needed. Returns the payload id, or None when skipped
+        """
+        if not self.presence.is_online(recipient):
+            self.logger.info("%s skipped (not online)" % recipient)
+            self.skipped_count.inc()
+            return None
+
+        payload_id = new_payload_id()
+        encoding, chunks = encode_payload(data, chunk_size=chunk_size,
+                                          compress=compress)
+        for seq, text in enumerate(chunks):
+            msg = self.make_message(mto=recipient, mtype='chat')
+            msg['payload']['id'] = payload_id
+            msg['payload']['seq'] = str(seq)
+            msg['payload']['total'] = str(len(chunks))
+            msg['payload']['encoding'] = encoding
+            msg['payload']['data'] = text
+            msg.send()
+        return payload_id
+
+    def bot_send_bulk(self, recipient, data, timeout=None):
+        """
+        Send binary data, only if buddy is online, over a direct
+        connection when enabled and possible, in-band otherwise.
+        Blocks until the direct transfer completes or fails.
+
+        Returns DIRECT or INBAND, or None when skipped
+        """
+        if not self.presence.is_online(recipient):
+            self.logger.info("%s skipped (not online)" % recipient)
+            self.skipped_count.inc()
+            return None
+        if self.transfers.send(recipient, data, timeout=timeout):
+            return DIRECT
+        if self.bot_send_payload(recipient, data) is None:
+            return None
+        return INBAND
+
+    def bot_send_batch(self, messages, chunk_size=BATCH_CHUNK_SIZE):
+        """
+        Send several messages, only to buddies that are online.
+
+        Each body is serialized once, whatever the number of its
+        recipients, and stanzas are written to the stream by chunks.
+        Outgoing stanza filters are bypassed, unless stream management
+        is enabled: stanzas are then sent one by one to be acknowledged.
+
+        Arguments:
+            messages -- An iterable of (recipient, body) tuples.
+
+        Returns a list of (recipient, status) tuples, in the order of
+        messages, giving the delivery status SENT, QUEUED or
+        SKIPPED_OFFLINE of each message: a recipient may appear in
+        several messages.
+        """
+        online = self.presence.snapshot()
+        status = []
+        templates = {}
+        chunk = []
+        sent = skipped = 0
+
+        for recipient, msg in messages:
+            if bare_jid(recipient) not in online:
+                if self.outbox is not None and self.outbox.push(recipient, msg):
+                    status.append((recipient, QUEUED))
+                else:
+                    self.logger.info("%s skipped (not online)" % recipient)
+                    status.append((recipient, SKIPPED_OFFLINE))
+                    skipped += 1
+                continue
+
+            status.append((recipient, SENT))
+            sent += 1
+            if self.stream_management:
+                self.send_message(mto=recipient, mbody=msg, mtype='chat')
+                continue
+
+            template = templates.get(msg)
+            if template is None:
+                template = self.message_template(msg)
+                templates[msg] = template
+
+            chunk.append(template[0] + quoteattr(recipient) + template[1])
+            if len(chunk) >= chunk_size:
+                self.send_raw(''.join(chunk))
+                chunk = []
+
+        if chunk:
+            self.send_raw(''.join(chunk))
+        self.sent_count.inc(sent)
+        self.skipped_count.inc(skipped)
+        return status
+
+    def message_template(self, msg):
+        """
+        Serialize a chat message without recipient, returns the
+        text to put before and after the recipient attribute value
+        """
+        stanza = self.make_message(mto=None, mbody=msg, mtype='chat')
+        data = tostring(stanza.xml, xmlns=self.default_ns,
+                        stream=self, top_level=True)
+        head = '<message'
+        return head + ' to=', data[len(head):]
 
 
 class P2pSession(SessionBot):
-    def __init__(self, server_address, port, jid, password):
+    def __init__(self, server_address, port, jid, password,
+                 keepalive=True, connect=True, create_account=False,
+                 roster_storage=None, stream_management=False, metrics=None):
         self.server_address = server_address
         self.port = port
         logging.basicConfig(level=logging.DEBUG)
         logger = logging.getLogger("p2psession")
 
         SessionBot.__init__(self, jid=jid, password=password, logger=logger)
-        self.auto_reconnect = True
-        self.auto_authorize = False
-        SessionBot.register_plugin(self, 'xep_0016')  # Privacy
-        SessionBot.register_plugin(self, 'xep_0199')  # Ping
-        self.plugin['xep_0199'].enable_keepalive(interval=45, timeout=5)
-
-        # Connect to the XMPP server and start processing XMPP stanzas.
-        logger.info("Connecting...")
+        SessionBot.setup_session(self, keepalive=keepalive,
+                                 stream_management=stream_management)
+        if roster_storage is not None:
+            SessionBot.set_roster_cache(self, roster_storage)
+        if metrics is not None:
+            SessionBot.set_metrics(self, metrics)
+
+        # Register the account on the stream of the session, instead
+        # of a dedicated connection
+        self.registration_status = None
+        if create_account:
+            SessionBot.register_plugin(self, 'xep_0030')  # Service Discovery
+            SessionBot.register_plugin(self, 'xep_0004')  # Data forms
+            SessionBot.register_plugin(self, 'xep_0077')  # In-band Registration
+            self.add_event_handler("register", self.register_account)
+
+        if connect:
+            self.session_connect()
+
+    def session_connect(self):
+        """
+        Connect to the XMPP server and start processing XMPP stanzas
+        """
+        self.logger.info("Connecting...")
         if SessionBot.connect(self, address=(self.server_address, self.port)):
-            logger.info("Processing...")
+            self.logger.info("Processing...")
             SessionBot.process(self, block=False)
+            return True
+        return False
+
+    def register_account(self, form):
+        """
+        Submit the registration form, the session goes on with
+        authentication whether the account was created or already
+        existed
+        """
+        status, error = submit_registration(self)
+        self.registration_status = status
+        if status == CREATED:
+            self.logger.info("Account created for %s!" % self.boundjid)
+            self.privacy.invalidate()
+            self.needs_privacy = True
+        elif status == CONFLICT:
+            self.logger.info("Account already exists for %s" % self.boundjid)
+        else:
+            self.logger.error("Could not register account: %s" % error)
+
+        # do not register again when reconnecting
+        if status != TIMEOUT:
+            self.del_event_handler("register", self.register_account)
 
     def get_session_jid(self):
         """
@@ -252,6 +774,10 @@ class P2pSession(SessionBot):
         return self.boundjid.bare
 
     def get_session_roster(self):
+        """
+        Return the roster, served from the roster cache until the
+        server answers when there is one
+        """
         return self.client_roster
 
     def session_disconnect(self):
@@ -260,6 +786,15 @@ class P2pSession(SessionBot):
         """
         SessionBot.send_presence(self, ptype='unavailable')
         SessionBot.disconnect(self)
+        if self.keepalive is not None:
+            self.keepalive.unregister(self)
+            self.keepalive = None
+        if self.roster_store is not None:
+            self.roster_store.flush()
+        self.rpc.close()
+        if self.dispatcher is not None:
+            self.dispatcher.stop()
+            self.dispatcher = None
 
     def remove(self, targetjid):
         """
@@ -272,13 +807,57 @@ class P2pSession(SessionBot):
         Send a single message to a recipient
         """
 
-        for count in range(3):
-            if self.is_ready():
-                break
-            time.sleep(1)
+        try:
+            self.wait_ready(timeout=3)
+        except PyP2pTimedOut:
+            self.logger.debug("Session not ready, sending anyway")
 
         SessionBot.bot_send(self, recipient=recipient, msg=msg)
 
+    def session_send_payload(self, recipient, data, compress=True):
+        """
+        Send binary data to a recipient, returns the payload id
+        """
+        try:
+            self.wait_ready(timeout=3)
+        except PyP2pTimedOut:
+            self.logger.debug("Session not ready, sending anyway")
+
+        return SessionBot.bot_send_payload(self, recipient=recipient,
+                                           data=data, compress=compress)
+
+    def session_send_bulk(self, recipient, data, timeout=None):
+        """
+        Send bulk binary data to a recipient, directly when
+        possible, returns DIRECT or INBAND
+        """
+        try:
+            self.wait_ready(timeout=3)
+        except PyP2pTimedOut:
+            self.logger.debug("Session not ready, sending anyway")
+
+        return SessionBot.bot_send_bulk(self, recipient=recipient,
+                                        data=data, timeout=timeout)
+
+    def session_send_many(self, recipients, msg):
+        """
+        Send the same message to several recipients, returns the
+        (recipient, status) tuple of each, see bot_send_batch
+        """
+        return self.send_batch((recipient, msg) for recipient in recipients)
+
+    def send_batch(self, messages):
+        """
+        Send a batch of (recipient, message) tuples, returns the
+        (recipient, status) tuple of each message, see bot_send_batch
+        """
+        try:
+            self.wait_ready(timeout=3)
+        except PyP2pTimedOut:
+            self.logger.debug("Session not ready, sending anyway")
+
+        return SessionBot.bot_send_batch(self, messages=messages)
+
     def authorize_subscriptions(self):
         """
         Set the xmpp bot to automatically autorize authorize_subscriptions
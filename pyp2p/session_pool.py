@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015 the pyp2p authors and contributors
+# <see AUTHORS and LICENSE files>
+
+import logging
+import threading
+import time
+
+from pyp2p.core.exceptions import PyP2pBadArgument, PyP2pResourceNotFound
+from pyp2p.keepalive import AdaptiveKeepalive
+from pyp2p.scheduler import Scheduler, ScheduledTask, TimerWheel
+from pyp2p.session import P2pSession
+
+
+class SessionPool(object):
+    """
+
+        Runs many P2pSession in one process, one per jid.
+
+        Session starts are staggered, keepalive pings of every session
+        are driven by one shared AdaptiveKeepalive, and SleekXMPP
+        reconnection backoff is capped for every session.
+
+    """
+
+    def __init__(self, server_address, port, stagger=0.05,
+                 keepalive_interval=45, keepalive_timeout=5,
+                 max_keepalive_interval=180, max_reconnect_delay=300):
+        """  - stagger is the delay, in seconds, between two session starts
+             - keepalive_interval, max_keepalive_interval and
+               keepalive_timeout tune the pings sent to the server by
+               idle sessions
+             - max_reconnect_delay caps the exponential backoff between
+               reconnection attempts
+        """
+        logging.basicConfig(level=logging.DEBUG)
+        self.logger = logging.getLogger("sessionpool")
+
+        self.server_address = server_address
+        self.port = port
+        self.stagger = stagger
+        self.max_reconnect_delay = max_reconnect_delay
+
+        self.lock = threading.Lock()
+        self.sessions = {}
+        self.tasks = {}
+        self.started = set()
+        self.next_start = 0
+        self.counters = {'started': 0,
+                         'failed': 0,
+                         'stopped': 0,
+                         'reconnects': 0,
+                         'keepalive_lost': 0}
+
+        self.scheduler = Scheduler(name="pyp2p session pool")
+        self.scheduler.start()
+        self.wheel = TimerWheel(name="pyp2p session pool keepalive")
+        self.wheel.start()
+        self.keepalive = AdaptiveKeepalive(timer=self.wheel,
+                                           min_interval=keepalive_interval,
+                                           max_interval=max_keepalive_interval,
+                                           timeout=keepalive_timeout)
+
+    def start_session(self, jid, password):
+        """ Schedule the start of a session, returns the delay in
+            seconds before it is actually started
+        """
+        with self.lock:
+            if jid in self.sessions or jid in self.tasks:
+                raise PyP2pBadArgument("Session already started for %s" % jid)
+            now = time.time()
+            start_at = max(now, self.next_start)
+            self.next_start = start_at + self.stagger
+            task = ScheduledTask(start_at, self._open, None)
+            # the task tells _open whether it is still the wanted start
+            task.args = (jid, password, task)
+            self.tasks[jid] = task
+        self.scheduler.push(task)
+        return start_at - now
+
+    def _open(self, jid, password, task):
+        session = P2pSession(server_address=self.server_address,
+                             port=self.port,
+                             jid=jid,
+                             password=password,
+                             keepalive=self.keepalive,
+                             connect=False)
+        session.reconnect_max_delay = self.max_reconnect_delay
+        session.add_event_handler("session_start",
+                                  lambda event: self._count_start(jid))
+        session.add_event_handler("keepalive_lost",
+                                  lambda iq: self._count('keepalive_lost'))
+
+        with self.lock:
+            # stopped, or stopped and started again, while opening
+            cancelled = self.tasks.get(jid) is not task
+            if not cancelled:
+                self.sessions[jid] = session
+                self.tasks.pop(jid)
+        if cancelled:
+            self.logger.debug("Session of %s stopped while opening" % jid)
+            self.keepalive.unregister(session)
+            return
+
+        # connecting may block until the server answers, keep it
+        # out of the shared scheduler thread
+        thread = threading.Thread(target=self._connect, args=(jid, session))
+        thread.daemon = True
+        thread.start()
+
+    def _connect(self, jid, session):
+        if not session.session_connect():
+            self.logger.error("Could not connect %s" % jid)
+            self._count('failed')
+
+    def _count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def _count_start(self, jid):
+        with self.lock:
+            if jid in self.started:
+                self.counters['reconnects'] += 1
+            else:
+                self.started.add(jid)
+                self.counters['started'] += 1
+
+    def stop_session(self, jid):
+        """ End the session of a jid """
+        with self.lock:
+            task = self.tasks.pop(jid, None)
+            session = self.sessions.pop(jid, None)
+            self.started.discard(jid)
+        if task is None and session is None:
+            raise PyP2pResourceNotFound("No session for %s" % jid)
+        if task is not None:
+            task.cancel()
+        if session is not None:
+            session.session_disconnect()
+        self._count('stopped')
+
+    def stop(self):
+        """ End every session, and the shared scheduler """
+        for jid in self.jids():
+            self.stop_session(jid)
+        self.scheduler.stop()
+        self.wheel.stop()
+
+    def get_session(self, jid):
+        """ Return the session of a jid, or None if not started yet """
+        return self.sessions.get(jid)
+
+    def jids(self):
+        """ Return the jids of started or pending sessions """
+        with self.lock:
+            return list(set(self.sessions) | set(self.tasks))
+
+    def __len__(self):
+        return len(self.jids())
+
+    def get_metrics(self):
+        """ Return aggregated counters of the sessions """
+        with self.lock:
+            metrics = dict(self.counters)
+            sessions = list(self.sessions.values())
+            metrics['pending'] = len(self.tasks)
+        metrics['sessions'] = len(sessions)
+        metrics['ready'] = sum(1 for session in sessions
+                               if session.is_ready())
+        metrics['online_buddies'] = sum(len(session.presence)
+                                        for session in sessions)
+        return metrics
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015 the pyp2p authors and contributors
+# <see AUTHORS and LICENSE files>
+
+"""This module contains the pyp2p specific stanza extensions"""
+
+from sleekxmpp.stanza import Message
+from sleekxmpp.xmlstream import ElementBase, register_stanza_plugin
+
+
+class Payload(ElementBase):
+    """
+    A chunk of a binary payload, carried by a message:
+
+        <payload xmlns="urn:pyp2p:payload" id="..." seq="0" total="3"
+                 encoding="zlib+base64">...</payload>
+    """
+
+    name = 'payload'
+    namespace = 'urn:pyp2p:payload'
+    plugin_attrib = 'payload'
+    interfaces = set(('id', 'seq', 'total', 'encoding', 'data'))
+
+    def get_seq(self):
+        return int(self._get_attr('seq', '0'))
+
+    def get_total(self):
+        return int(self._get_attr('total', '0'))
+
+    def get_data(self):
+        return self.xml.text or ''
+
+    def set_data(self, value):
+        self.xml.text = value
+
+    def del_data(self):
+        self.xml.text = None
+
+
+class Rpc(ElementBase):
+    """
+    A remote call request, or its response, carried by a message:
+
+        <rpc xmlns="urn:pyp2p:rpc" id="..." type="request">...</rpc>
+    """
+
+    name = 'rpc'
+    namespace = 'urn:pyp2p:rpc'
+    plugin_attrib = 'rpc'
+    interfaces = set(('id', 'type', 'data'))
+
+    def get_data(self):
+        return self.xml.text or ''
+
+    def set_data(self, value):
+        self.xml.text = value
+
+    def del_data(self):
+        self.xml.text = None
+
+
+class Transfer(ElementBase):
+    """
+    A direct transfer offer, or its failure notice, carried by a
+    message:
+
+        <transfer xmlns="urn:pyp2p:transfer" sid="..." type="offer"
+                  host="..." port="..." size="..." sha1="..." token="..."/>
+    """
+
+    name = 'transfer'
+    namespace = 'urn:pyp2p:transfer'
+    plugin_attrib = 'transfer'
+    interfaces = set(('sid', 'type', 'host', 'port', 'size', 'sha1',
+                      'token'))
+
+    def get_port(self):
+        return int(self._get_attr('port', '0'))
+
+    def get_size(self):
+        return int(self._get_attr('size', '0'))
+
+
+register_stanza_plugin(Message, Payload)
+register_stanza_plugin(Message, Rpc)
+register_stanza_plugin(Message, Transfer)
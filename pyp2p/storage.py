@@ -3,9 +3,184 @@
 # Copyright (C) 2015 the pyp2p authors and contributors
 # <see AUTHORS and LICENSE files>
 
+import contextlib
 import logging
 import pickle
 import os
+import tempfile
+import threading
+
+from pyp2p.scheduler import get_shared_scheduler
+
+# size of the blocks read, transformed and written by streams
+BLOCK_SIZE = 65536
+
+# binary pickle protocol: 2 on python 2, the default one on python 3
+# where protocol 2 pickles bytes as text
+BINARY_PROTOCOL = max(2, getattr(pickle, 'DEFAULT_PROTOCOL', 2))
+
+
+@contextlib.contextmanager
+def atomic_file(filename):
+    """
+    Give a temporary file next to filename, then sync it and rename
+    it over filename: readers and crashes see either the old or the
+    new content, never a partial one
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    handle, temp_name = tempfile.mkstemp(dir=directory,
+                                         prefix=os.path.basename(filename),
+                                         suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as container:
+            os.chmod(temp_name, 0o600)
+            yield container
+            container.flush()
+            os.fsync(container.fileno())
+        # python 2 has no os.replace, os.rename replaces files on POSIX
+        getattr(os, 'replace', os.rename)(temp_name, filename)
+    except BaseException:
+        os.remove(temp_name)
+        raise
+    sync_directory(directory)
+
+
+def write_atomically(filename, data):
+    """ Replace the content of filename, see atomic_file """
+    with atomic_file(filename) as container:
+        container.write(data)
+
+
+def sync_directory(directory):
+    """ Make a rename in directory durable, where supported """
+    try:
+        handle = os.open(directory, os.O_RDONLY)
+    except (OSError, AttributeError):
+        return
+    try:
+        os.fsync(handle)
+    except OSError:
+        pass
+    finally:
+        os.close(handle)
+
+
+class StreamWriter(object):
+    """
+
+        File-like object writing to a file what a stateful transform
+        (e.g. a stream cipher) makes of the data, by blocks
+
+    """
+
+    def __init__(self, fileobj, transform, block_size=BLOCK_SIZE):
+        """
+        """
+        self.fileobj = fileobj
+        self.transform = transform
+        self.block_size = block_size
+        self.pending = []
+        self.size = 0
+
+    def write(self, data):
+        self.pending.append(data)
+        self.size += len(data)
+        if self.size >= self.block_size:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            data = b''.join(self.pending)
+            self.pending = []
+            self.size = 0
+            # a large write is transformed by blocks as well
+            for offset in range(0, len(data), self.block_size):
+                self.fileobj.write(
+                    self.transform(data[offset:offset + self.block_size]))
+
+    def close(self):
+        """ Write pending data, the file is left open """
+        self.flush()
+
+
+class StreamReader(object):
+    """
+
+        File-like object reading what a stateful transform makes of
+        the content of a file, by blocks, up to length bytes when given
+
+    """
+
+    def __init__(self, fileobj, transform, block_size=BLOCK_SIZE,
+                 length=None):
+        """
+        """
+        self.fileobj = fileobj
+        self.transform = transform
+        self.block_size = block_size
+        self.remaining = length
+        # the block being read, from offset
+        self.buffer = b''
+        self.offset = 0
+        self.eof = False
+
+    def next_block(self):
+        """ Read and transform a block, returns None at end of file """
+        if self.eof:
+            return None
+        size = self.block_size
+        if self.remaining is not None:
+            size = min(size, self.remaining)
+        block = self.fileobj.read(size) if size else b''
+        if not block:
+            self.eof = True
+            return None
+        if self.remaining is not None:
+            self.remaining -= len(block)
+        return self.transform(block)
+
+    def read(self, size=-1):
+        end = self.offset + size
+        if 0 <= size and end <= len(self.buffer):
+            data = self.buffer[self.offset:end]
+            self.offset = end
+            return data
+
+        # gather the blocks and join them once, reads stay linear
+        parts = [self.buffer[self.offset:]]
+        missing = size - len(parts[0])
+        block = b''
+        while size < 0 or missing > 0:
+            block = self.next_block()
+            if block is None:
+                block = b''
+                break
+            parts.append(block)
+            missing -= len(block)
+        if size >= 0 and missing < 0:
+            parts[-1] = block[:missing]
+            self.buffer, self.offset = block, len(block) + missing
+        else:
+            self.buffer, self.offset = b'', 0
+        return b''.join(parts)
+
+    def readline(self):
+        end = self.buffer.find(b'\n', self.offset)
+        if end >= 0:
+            return self.read(end + 1 - self.offset)
+
+        parts = [self.buffer[self.offset:]]
+        while True:
+            block = self.next_block()
+            if block is None:
+                self.buffer, self.offset = b'', 0
+                return b''.join(parts)
+            end = block.find(b'\n')
+            if end >= 0:
+                parts.append(block[:end + 1])
+                self.buffer, self.offset = block, end + 1
+                return b''.join(parts)
+            parts.append(block)
 
 
 class RawStorage(object):
@@ -13,47 +188,157 @@ class RawStorage(object):
 
         Implements a permanent storage that is human readable
 
+        Data is written atomically. With a commit_delay (in seconds),
+        store() returns at once and the data is written by a shared
+        scheduler thread after that delay, so that a burst of stores
+        costs a single write; call flush() to write it before exiting.
+
+        With cache, retrieve() returns the data read last, as long as
+        the file modification time, size and inode are unchanged and
+        store() was not called. That data is shared between callers
+        and must not be modified.
+
+        store_hook and retrieve_hook transform the whole pickled data.
+        store_stream_hook and retrieve_stream_hook, when set, take
+        precedence: they wrap the file in a StreamWriter or a
+        StreamReader, so that data is pickled and transformed by
+        blocks instead of in memory.
+
+        Data is pickled with the default protocol, which is human
+        readable on python 2, unless protocol is set.
+
     """
 
-    def __init__(self):
+    def __init__(self, filename=None, commit_delay=None, cache=False):
         """
         """
         logging.basicConfig(level=logging.DEBUG)
         self.logger = logging.getLogger("storage")
 
-        self.filename = "store.lock"
+        self.filename = filename or "store.lock"
         self.store_hook = None
         self.retrieve_hook = None
+        self.store_stream_hook = None
+        self.retrieve_stream_hook = None
         self.hooks_extra_args = None
+        self.protocol = None
+        self.commit_delay = commit_delay
+        self.lock = threading.Lock()
+        # pickled data waiting for the group commit
+        self.pending = None
+        self.cache = cache
+        # file signature and data retrieved
+        self.cached = None
 
     def get_filename(self):
         """ Accesssor for filename attribute"""
         return self.filename
 
+    def signature(self):
+        """ Tells whether the file changed, whoever changed it """
+        try:
+            stat = os.stat(self.filename)
+        except OSError:
+            return None
+        return (getattr(stat, 'st_mtime_ns', stat.st_mtime),
+                stat.st_size, stat.st_ino)
+
     def retrieve(self):
         self.logger.info("Retreiving data...")
 
-        with open(self.filename, 'rb') as container:
-            data = container.read()
+        with self.lock:
+            pending = self.pending
+            cached = self.cached
+        if pending is not None:
+            return pickle.loads(pending)
 
-        if self.retrieve_hook is not None:
-            data = self.retrieve_hook(data, self.hooks_extra_args)
+        signature = self.signature() if self.cache else None
+        if signature is not None and cached is not None and \
+                cached[0] == signature:
+            return cached[1]
 
-        data = pickle.loads(data)
+        with open(self.filename, 'rb') as container:
+            if self.retrieve_stream_hook is not None:
+                data = pickle.load(self.retrieve_stream_hook(
+                    container, self.hooks_extra_args))
+            else:
+                data = container.read()
+
+        if self.retrieve_stream_hook is None:
+            if self.retrieve_hook is not None:
+                data = self.retrieve_hook(data, self.hooks_extra_args)
+            data = pickle.loads(data)
 
+        if signature is not None:
+            with self.lock:
+                self.cached = (signature, data)
         return data
 
     def store(self, data):
         """ write data in storage
         """
 
-        self.logger.info("Storing data %s" % str(data))
+        self.logger.info("Storing data...")
+
+        if self.commit_delay is None:
+            with self.lock:
+                self.dump(data)
+                self.cached = None
+            return
+
+        data = pickle.dumps(data, self.protocol)
+        with self.lock:
+            self.cached = None
+            scheduled = self.pending is not None
+            self.pending = data
+        if not scheduled:
+            get_shared_scheduler().call_later(self.commit_delay,
+                                              self.group_commit)
+
+    def group_commit(self):
+        """ Scheduled flush: a failed write is tried again later,
+            its data is still pending meanwhile
+        """
+        try:
+            self.flush()
+        except Exception:
+            self.logger.exception("Group commit to %s failed, retrying"
+                                  % self.filename)
+            get_shared_scheduler().call_later(self.commit_delay,
+                                              self.group_commit)
+
+    def flush(self):
+        """ Write the data waiting for the group commit, if any """
+        with self.lock:
+            data = self.pending
+            if data is None:
+                return
+            self.write(data)
+            self.pending = None
+
+    def dump(self, data):
+        """ Pickle data to the file """
+        if self.store_stream_hook is None:
+            self.write(pickle.dumps(data, self.protocol))
+            return
+
+        with atomic_file(self.filename) as container:
+            stream = self.store_stream_hook(container, self.hooks_extra_args)
+            pickle.dump(data, stream, self.protocol)
+            stream.close()
 
-        data = pickle.dumps(data)
+    def write(self, data):
+        """ Write pickled data to the file """
+        if self.store_stream_hook is not None:
+            with atomic_file(self.filename) as container:
+                stream = self.store_stream_hook(container,
+                                                self.hooks_extra_args)
+                for offset in range(0, len(data), BLOCK_SIZE):
+                    stream.write(data[offset:offset + BLOCK_SIZE])
+                stream.close()
+            return
 
         if self.store_hook is not None:
             data = self.store_hook(data, self.hooks_extra_args)
 
-        with open(self.filename, 'wb') as container:
-            os.chmod(self.filename, 0o600)
-            container.write(data)
+        write_atomically(self.filename, data)
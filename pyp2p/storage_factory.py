@@ -4,10 +4,13 @@
 # <see AUTHORS and LICENSE files>
 
 from pyp2p.storage import RawStorage
-from pyp2p.obfuscated_storage import ObfuscatedStorage
+from pyp2p.obfuscated_storage import ObfuscatedStorage, ObfuscatedLogStorage
+from pyp2p.log_storage import LogStorage
 
 CLASS_MAP = {'basic': RawStorage,
-             'advanced': ObfuscatedStorage}
+             'advanced': ObfuscatedStorage,
+             'log': LogStorage,
+             'advanced_log': ObfuscatedLogStorage}
 
 
 class StorageFactory(object):
@@ -15,15 +18,27 @@ class StorageFactory(object):
         Implements a factory that returns a storage class
     """
 
-    def __init__(self, kind='advanced'):
+    def __init__(self, kind='advanced', filename=None, **options):
         """  - basic kind is a storage in plain text, in a local file
              - advanced kind is an encrypted storage, in a hidden file
                located in user's homedir
+             - log kind is a key-value storage in an append-only
+               log, updated incrementally, in plain text: it must
+               not hold secrets
+             - advanced_log kind is a log storage whose records are
+               encrypted like the advanced kind, in a hidden file
+               located in user's homedir
+             - filename overrides the default file of the kind
+             - other options are given to the storage class, e.g.
+               commit_delay or cache for basic and advanced kinds,
+               legacy to migrate files of the previous advanced format
         """
         self.kind = kind
+        self.filename = filename
+        self.options = options
 
     def get_storage(self):
         """ Returns a storage class
 
         """
-        return CLASS_MAP[self.kind]()
+        return CLASS_MAP[self.kind](filename=self.filename, **self.options)
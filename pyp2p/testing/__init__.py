@@ -0,0 +1,32 @@
+# Copyright (C) 2015 the pyp2p authors and contributors
+# <see AUTHORS and LICENSE files>
+
+"""Helpers to run pyp2p against a local XMPP server"""
+
+import os
+import threading
+
+from pyp2p.testing.xmpp_server import LocalXmppServer
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def get_test_server():
+    """
+    Return the (address, port) of the XMPP server to test against:
+    the PYP2P_TEST_SERVER environment variable ('host:port') when
+    set, otherwise a LocalXmppServer shared by the whole process
+    """
+    global _server
+    target = os.environ.get('PYP2P_TEST_SERVER')
+    if target:
+        address, _, port = target.rpartition(':')
+        return address, port
+    with _server_lock:
+        if _server is None:
+            _server = LocalXmppServer().start()
+        return _server.address
+
+# not a test, whatever nose thinks of its name
+get_test_server.__test__ = False
@@ -0,0 +1,1174 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015 the pyp2p authors and contributors
+# <see AUTHORS and LICENSE files>
+
+"""This module runs a minimal XMPP server, for tests and benchmarks"""
+
+import base64
+import collections
+import hashlib
+import hmac
+import logging
+import os
+import socket
+import threading
+import uuid
+import xml.etree.ElementTree as ET
+from xml.parsers import expat
+
+from sleekxmpp.xmlstream import tostring
+
+CLIENT_NS = 'jabber:client'
+STREAM_NS = 'http://etherx.jabber.org/streams'
+SASL_NS = 'urn:ietf:params:xml:ns:xmpp-sasl'
+BIND_NS = 'urn:ietf:params:xml:ns:xmpp-bind'
+SESSION_NS = 'urn:ietf:params:xml:ns:xmpp-session'
+STANZAS_NS = 'urn:ietf:params:xml:ns:xmpp-stanzas'
+ROSTER_NS = 'jabber:iq:roster'
+ROSTERVER_NS = 'urn:xmpp:features:rosterver'
+PRIVACY_NS = 'jabber:iq:privacy'
+REGISTER_NS = 'jabber:iq:register'
+REGISTER_FEATURE_NS = 'http://jabber.org/features/iq-register'
+PING_NS = 'urn:xmpp:ping'
+SM_NS = 'urn:xmpp:sm:3'
+
+SCRAM_ITERATIONS = 4096
+
+# subscription states, by (from, to) flags
+SUBSCRIPTIONS = {(False, False): 'none',
+                 (True, False): 'from',
+                 (False, True): 'to',
+                 (True, True): 'both'}
+
+# stanzas counted by stream management
+STANZA_TAGS = frozenset(tag for tag in ('{%s}iq' % CLIENT_NS,
+                                        '{%s}message' % CLIENT_NS,
+                                        '{%s}presence' % CLIENT_NS))
+
+
+def split_jid(jid):
+    """ Return the (bare, resource) parts of a jid, bare is lower cased """
+    bare, _, resource = jid.partition('/')
+    return bare.lower(), resource or None
+
+
+def qualify(name):
+    """ Turn an expat 'uri}local' name into an ElementTree '{uri}local' tag """
+    if '}' in name:
+        return '{' + name
+    return name
+
+
+def tag(namespace, name):
+    return '{%s}%s' % (namespace, name)
+
+
+def copy_stanza(elem, **attrs):
+    """ Copy a stanza with some attributes changed, children are shared """
+    copy = ET.Element(elem.tag, dict(elem.attrib))
+    copy.text = elem.text
+    copy.extend(list(elem))
+    for key, value in attrs.items():
+        if value is None:
+            copy.attrib.pop(key, None)
+        else:
+            copy.set(key, value)
+    return copy
+
+
+def stanza_error(elem, condition, error_type='cancel', text=None):
+    """ Build the error reply of a stanza """
+    reply = copy_stanza(elem, to=elem.get('from'), type='error')
+    reply.attrib.pop('from', None)
+    if elem.get('to'):
+        reply.set('from', elem.get('to'))
+    error = ET.SubElement(reply, tag(CLIENT_NS, 'error'), {'type': error_type})
+    ET.SubElement(error, tag(STANZAS_NS, condition))
+    if text:
+        ET.SubElement(error, tag(STANZAS_NS, 'text')).text = text
+    return reply
+
+
+class Account(object):
+    """
+
+        Server side state of an account
+
+    """
+
+    def __init__(self, jid, password):
+        """
+        """
+        self.jid = jid
+        self.roster = {}
+        self.roster_version = 0
+        self.privacy_lists = {}
+        self.default_list = None
+        # subscription requests not delivered yet, by requester
+        self.pending_in = {}
+        self.set_password(password)
+
+    def set_password(self, password):
+        self.password = password
+        self.salt = os.urandom(16)
+        salted = hashlib.pbkdf2_hmac('sha1', password.encode('utf-8'),
+                                     self.salt, SCRAM_ITERATIONS)
+        self.stored_key = hashlib.sha1(
+            hmac.new(salted, b'Client Key', hashlib.sha1).digest()).digest()
+        self.server_key = hmac.new(salted, b'Server Key',
+                                   hashlib.sha1).digest()
+
+    def item(self, contact):
+        return self.roster.setdefault(contact, {'from': False,
+                                                'to': False,
+                                                'ask': None,
+                                                'name': None,
+                                                'groups': []})
+
+    def subscription(self, contact):
+        item = self.roster.get(contact)
+        if item is None:
+            return 'none'
+        return SUBSCRIPTIONS[(item['from'], item['to'])]
+
+
+class ScramExchange(object):
+    """
+
+        Server side of a SCRAM-SHA-1 authentication
+
+    """
+
+    def __init__(self, account, client_first):
+        """
+        """
+        self.account = account
+        self.client_first_bare = client_first.split(',', 2)[2]
+        attrs = dict(item.split('=', 1)
+                     for item in self.client_first_bare.split(','))
+        self.nonce = attrs['r'] + uuid.uuid4().hex
+        self.server_first = 'r=%s,s=%s,i=%d' % (
+            self.nonce,
+            base64.b64encode(account.salt).decode('ascii'),
+            SCRAM_ITERATIONS)
+
+    def verify(self, client_final):
+        """ Check the client proof, returns the server final message """
+        without_proof, _, proof = client_final.rpartition(',p=')
+        attrs = dict(item.split('=', 1) for item in without_proof.split(','))
+        if attrs.get('r') != self.nonce:
+            return None
+        auth_message = ','.join((self.client_first_bare, self.server_first,
+                                 without_proof)).encode('utf-8')
+        signature = hmac.new(self.account.stored_key, auth_message,
+                             hashlib.sha1).digest()
+        proof = bytearray(base64.b64decode(proof))
+        client_key = bytes(bytearray(a ^ b for a, b in
+                                     zip(proof, bytearray(signature))))
+        if not hmac.compare_digest(hashlib.sha1(client_key).digest(),
+                                   self.account.stored_key):
+            return None
+        server_signature = hmac.new(self.account.server_key, auth_message,
+                                    hashlib.sha1).digest()
+        return 'v=' + base64.b64encode(server_signature).decode('ascii')
+
+
+class ManagedStream(object):
+    """
+
+        Stream management (XEP-0198) state of a session, handed over
+        to the new stream when the session is resumed
+
+    """
+
+    def __init__(self, resumable):
+        """
+        """
+        self.id = uuid.uuid4().hex
+        self.resumable = resumable
+        self.lock = threading.Lock()
+        self.handled = 0
+        self.sent = 0
+        self.unacked = collections.deque()
+        self.timer = None
+
+    def track(self, data):
+        """ Keep a stanza sent to the client until it is acknowledged """
+        with self.lock:
+            self.sent += 1
+            self.unacked.append((self.sent, data))
+
+    def acked(self, handled):
+        """ Forget stanzas the client acknowledged """
+        with self.lock:
+            while self.unacked and self.unacked[0][0] <= handled:
+                self.unacked.popleft()
+
+    def pending(self):
+        with self.lock:
+            return [data for _, data in self.unacked]
+
+
+class ClientConnection(object):
+    """
+
+        A client stream: parses incoming stanzas and hands them over
+        to the server, from a thread of its own
+
+    """
+
+    def __init__(self, server, sock):
+        """
+        """
+        self.server = server
+        self.sock = sock
+        self.send_lock = threading.Lock()
+        self.domain = None
+        self.jid = None
+        self.full = None
+        self.scram = None
+        self.restart = False
+        self.closed = False
+        self.lost = False
+        self.sm = None
+        # presence state, protected by the server lock
+        self.available = False
+        self.presence = None
+        self.priority = 0
+        self.active_list = None
+        self.reset_parser()
+
+    def reset_parser(self):
+        self.parser = expat.ParserCreate('UTF-8', '}')
+        self.parser.StartElementHandler = self.start_element
+        self.parser.EndElementHandler = self.end_element
+        self.parser.CharacterDataHandler = self.characters
+        self.depth = 0
+        self.stack = []
+
+    def run(self):
+        try:
+            while not self.closed:
+                data = self.sock.recv(65536)
+                if not data:
+                    break
+                self.parser.Parse(data, False)
+                if self.restart:
+                    self.restart = False
+                    self.reset_parser()
+        except (socket.error, expat.ExpatError) as error:
+            if not self.closed:
+                self.server.logger.debug("Stream of %s lost: %s"
+                                         % (self.full, error))
+        finally:
+            # closed by neither end: the network failed
+            self.lost = not self.closed
+            self.close()
+            self.server.disconnected(self)
+
+    def start_element(self, name, attrs):
+        attrs = dict((qualify(key), value) for key, value in attrs.items())
+        if self.depth == 0:
+            self.stream_opened(attrs)
+        elif self.depth == 1:
+            self.stack.append(ET.Element(qualify(name), attrs))
+        else:
+            self.stack.append(ET.SubElement(self.stack[-1], qualify(name),
+                                            attrs))
+        self.depth += 1
+
+    def end_element(self, name):
+        self.depth -= 1
+        if self.depth == 0:
+            self.send('</stream:stream>')
+            self.close()
+        elif self.depth == 1:
+            elem = self.stack.pop()
+            try:
+                self.server.handle(self, elem)
+            except Exception:
+                self.server.logger.exception("Stanza handling failed")
+        else:
+            self.stack.pop()
+
+    def characters(self, data):
+        if not self.stack:
+            return
+        elem = self.stack[-1]
+        if len(elem):
+            elem[-1].tail = (elem[-1].tail or '') + data
+        else:
+            elem.text = (elem.text or '') + data
+
+    def stream_opened(self, attrs):
+        self.domain = (attrs.get('to') or self.server.domain).lower()
+        self.send("<?xml version='1.0'?>"
+                  "<stream:stream xmlns='%s' xmlns:stream='%s' id='%s' "
+                  "from='%s' version='1.0'>"
+                  % (CLIENT_NS, STREAM_NS, uuid.uuid4().hex, self.domain))
+        if self.jid is None:
+            self.send("<stream:features>"
+                      "<mechanisms xmlns='%s'>"
+                      "<mechanism>SCRAM-SHA-1</mechanism></mechanisms>"
+                      "<register xmlns='%s'/>"
+                      "</stream:features>" % (SASL_NS, REGISTER_FEATURE_NS))
+        else:
+            self.send("<stream:features><bind xmlns='%s'/><ver xmlns='%s'/>"
+                      "<sm xmlns='%s'/></stream:features>"
+                      % (BIND_NS, ROSTERVER_NS, SM_NS))
+
+    def send(self, data):
+        with self.send_lock:
+            if self.closed:
+                return
+            try:
+                self.sock.sendall(data.encode('utf-8'))
+            except socket.error:
+                self.close()
+
+    def send_element(self, elem):
+        data = tostring(elem, xmlns=CLIENT_NS, top_level=True)
+        if self.sm is not None and elem.tag in STANZA_TAGS:
+            self.sm.track(data)
+        self.send(data)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self.sock.close()
+
+
+class LocalXmppServer(object):
+    """
+
+        A minimal XMPP server running in the current process: SASL
+        SCRAM-SHA-1 authentication, resource binding, in-band
+        registration (XEP-0077), roster and subscriptions, presence,
+        privacy lists (XEP-0016), ping (XEP-0199), stream management
+        and resumption (XEP-0198) and message routing.
+
+        Every domain is served, accounts are kept in memory, and
+        messages to offline users are dropped.
+
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, domain='localhost',
+                 close_removed=True, resume_timeout=300):
+        """
+            close_removed  -- Close the streams of an account removed
+                              by in-band registration, like ejabberd
+                              does. Other servers keep them open.
+            resume_timeout -- Seconds a session whose stream was lost
+                              may be resumed (XEP-0198).
+        """
+        self.logger = logging.getLogger("xmppserver")
+        self.host = host
+        self.port = port
+        self.domain = domain
+        self.close_removed = close_removed
+        self.resume_timeout = resume_timeout
+        self.lock = threading.RLock()
+        self.accounts = {}
+        self.sessions = {}
+        # sessions of lost streams, by stream management id
+        self.detached = {}
+        self.connections = set()
+        self.listener = None
+        self.thread = None
+
+    @property
+    def address(self):
+        """ The (host, port) tuple clients connect to """
+        return self.host, self.port
+
+    def start(self):
+        """ Listen and serve clients from a background thread """
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((self.host, self.port))
+        self.listener.listen(128)
+        self.port = self.listener.getsockname()[1]
+        self.thread = threading.Thread(target=self.serve,
+                                       name="pyp2p xmpp server")
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """ Close the listening socket and every client stream """
+        listener, self.listener = self.listener, None
+        if listener is not None:
+            listener.close()
+        with self.lock:
+            connections = list(self.connections)
+            detached, self.detached = self.detached, {}
+        for conn in detached.values():
+            conn.sm.timer.cancel()
+        for conn in connections:
+            conn.close()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def serve(self):
+        listener = self.listener
+        # closing a socket does not wake up a blocked accept everywhere
+        listener.settimeout(0.5)
+        while self.listener is listener:
+            try:
+                sock, address = listener.accept()
+            except socket.timeout:
+                continue
+            except socket.error:
+                break
+            sock.settimeout(None)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            conn = ClientConnection(self, sock)
+            with self.lock:
+                self.connections.add(conn)
+            thread = threading.Thread(target=conn.run,
+                                      name="pyp2p xmpp client")
+            thread.daemon = True
+            thread.start()
+
+    # accounts
+
+    def add_account(self, jid, password):
+        """ Create an account, returns False if it exists already """
+        jid = split_jid(jid)[0]
+        with self.lock:
+            if jid in self.accounts:
+                return False
+            self.accounts[jid] = Account(jid, password)
+            return True
+
+    def remove_account(self, jid):
+        """ Delete an account, and remove it from others rosters """
+        jid = split_jid(jid)[0]
+        deliveries = []
+        with self.lock:
+            account = self.accounts.pop(jid, None)
+            if account is None:
+                return False
+            for other in self.accounts.values():
+                other.pending_in.pop(jid, None)
+                if other.roster.pop(jid, None) is not None:
+                    deliveries += self.roster_push(other, jid, removed=True)
+            conns = self.resources(jid) if self.close_removed else []
+        self.deliver(deliveries)
+        for conn in conns:
+            conn.send('</stream:stream>')
+            conn.close()
+        return True
+
+    def has_account(self, jid):
+        with self.lock:
+            return split_jid(jid)[0] in self.accounts
+
+    # sessions
+
+    def resources(self, jid):
+        """ The streams bound for a bare jid """
+        return [conn for full, conn in self.sessions.items()
+                if split_jid(full)[0] == jid]
+
+    def available(self, jid):
+        return [conn for conn in self.resources(jid) if conn.available]
+
+    def bind(self, conn, resource):
+        with self.lock:
+            if not resource:
+                resource = uuid.uuid4().hex[:12]
+            full = '%s/%s' % (conn.jid, resource)
+            replaced = self.sessions.get(full)
+            self.sessions[full] = conn
+        conn.full = full
+        if replaced is not None and replaced is not conn:
+            replaced.send("<stream:error><conflict xmlns='urn:ietf:params:"
+                          "xml:ns:xmpp-streams'/></stream:error>"
+                          "</stream:stream>")
+            replaced.close()
+        return full
+
+    def drop_stream(self, full):
+        """ Cut the stream of a full jid, as a network failure would """
+        with self.lock:
+            conn = self.sessions.get(full)
+        if conn is not None:
+            try:
+                conn.sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+    def disconnected(self, conn):
+        with self.lock:
+            self.connections.discard(conn)
+            if conn.full is None or self.sessions.get(conn.full) is not conn:
+                return
+            if conn.lost and conn.sm is not None and conn.sm.resumable:
+                # the client may resume the session from a new stream
+                self.detached[conn.sm.id] = conn
+                conn.sm.timer = threading.Timer(self.resume_timeout,
+                                                self.expire, (conn,))
+                conn.sm.timer.daemon = True
+                conn.sm.timer.start()
+                return
+        self.end_session(conn)
+
+    def expire(self, conn):
+        """ End a lost session which was not resumed in time """
+        with self.lock:
+            if self.detached.get(conn.sm.id) is not conn:
+                return
+            del self.detached[conn.sm.id]
+        self.end_session(conn)
+
+    def end_session(self, conn):
+        deliveries = []
+        with self.lock:
+            if self.sessions.get(conn.full) is not conn:
+                return
+            del self.sessions[conn.full]
+            if conn.available and conn.jid in self.accounts:
+                unavailable = ET.Element(tag(CLIENT_NS, 'presence'),
+                                         {'type': 'unavailable',
+                                          'from': conn.full})
+                deliveries = self.presence_broadcast(conn, unavailable)
+        self.deliver(deliveries)
+
+    def deliver(self, deliveries):
+        for conn, elem in deliveries:
+            conn.send_element(elem)
+
+    # stanzas
+
+    def handle(self, conn, elem):
+        """ Process a top level element received from a stream """
+        if conn.sm is not None and elem.tag in STANZA_TAGS:
+            conn.sm.handled += 1
+        if elem.tag == tag(SASL_NS, 'auth'):
+            self.sasl_auth(conn, elem)
+        elif elem.tag == tag(SASL_NS, 'response'):
+            self.sasl_response(conn, elem)
+        elif elem.tag.startswith('{%s}' % SM_NS):
+            self.handle_sm(conn, elem)
+        elif elem.tag == tag(CLIENT_NS, 'iq'):
+            self.handle_iq(conn, elem)
+        elif conn.full is None:
+            conn.send("<stream:error><not-authorized xmlns='urn:ietf:params:"
+                      "xml:ns:xmpp-streams'/></stream:error>"
+                      "</stream:stream>")
+            conn.close()
+        elif elem.tag == tag(CLIENT_NS, 'presence'):
+            self.handle_presence(conn, elem)
+        elif elem.tag == tag(CLIENT_NS, 'message'):
+            self.handle_message(conn, elem)
+
+    def handle_sm(self, conn, elem):
+        """ Stream management (XEP-0198) """
+        name = elem.tag[len(SM_NS) + 2:]
+        if name == 'resume':
+            self.sm_resume(conn, elem)
+        elif name == 'enable':
+            if conn.full is None or conn.sm is not None:
+                self.sm_failed(conn, 'unexpected-request')
+                return
+            conn.sm = ManagedStream(elem.get('resume') in ('true', '1'))
+            conn.send("<enabled xmlns='%s' id='%s' resume='%s' max='%d'/>"
+                      % (SM_NS, conn.sm.id,
+                         'true' if conn.sm.resumable else 'false',
+                         self.resume_timeout))
+        elif conn.sm is None:
+            self.sm_failed(conn, 'unexpected-request')
+        elif name == 'r':
+            conn.send("<a xmlns='%s' h='%d'/>" % (SM_NS, conn.sm.handled))
+        elif name == 'a':
+            conn.sm.acked(int(elem.get('h', 0)))
+
+    def sm_failed(self, conn, condition):
+        conn.send("<failed xmlns='%s'><%s xmlns='%s'/></failed>"
+                  % (SM_NS, condition, STANZAS_NS))
+
+    def sm_resume(self, conn, elem):
+        """ Move a lost session to a new authenticated stream """
+        with self.lock:
+            old = self.detached.get(elem.get('previd'))
+            if (old is None or conn.full is not None or
+                    old.jid != conn.jid):
+                old = None
+            else:
+                del self.detached[old.sm.id]
+                conn.full = old.full
+                conn.sm = old.sm
+                conn.available = old.available
+                conn.presence = old.presence
+                conn.priority = old.priority
+                conn.active_list = old.active_list
+                self.sessions[conn.full] = conn
+        if old is None:
+            self.sm_failed(conn, 'item-not-found')
+            return
+        conn.sm.timer.cancel()
+        conn.sm.acked(int(elem.get('h', 0)))
+        conn.send("<resumed xmlns='%s' previd='%s' h='%d'/>"
+                  % (SM_NS, conn.sm.id, conn.sm.handled))
+        # stanzas the client did not get before the stream was lost
+        for data in conn.sm.pending():
+            conn.send(data)
+
+    def sasl_failure(self, conn, condition='not-authorized'):
+        conn.scram = None
+        conn.send("<failure xmlns='%s'><%s/></failure>" % (SASL_NS, condition))
+
+    def sasl_auth(self, conn, elem):
+        if elem.get('mechanism') != 'SCRAM-SHA-1':
+            self.sasl_failure(conn, 'invalid-mechanism')
+            return
+        try:
+            client_first = base64.b64decode(
+                (elem.text or '').encode('ascii')).decode('utf-8')
+            username = client_first.split(',', 2)[2].split(',')[0][2:]
+            username = username.replace('=2C', ',').replace('=3D', '=')
+            with self.lock:
+                account = self.accounts.get(
+                    ('%s@%s' % (username, conn.domain)).lower())
+            if account is None:
+                self.sasl_failure(conn)
+                return
+            conn.scram = ScramExchange(account, client_first)
+        except (IndexError, KeyError, ValueError, TypeError):
+            self.sasl_failure(conn, 'malformed-request')
+            return
+        conn.send("<challenge xmlns='%s'>%s</challenge>" % (
+            SASL_NS,
+            base64.b64encode(conn.scram.server_first.encode('utf-8'))
+            .decode('ascii')))
+
+    def sasl_response(self, conn, elem):
+        if conn.scram is None:
+            self.sasl_failure(conn)
+            return
+        try:
+            client_final = base64.b64decode(
+                (elem.text or '').encode('ascii')).decode('utf-8')
+            server_final = conn.scram.verify(client_final)
+        except (ValueError, TypeError):
+            server_final = None
+        if server_final is None:
+            self.sasl_failure(conn)
+            return
+        conn.jid = conn.scram.account.jid
+        conn.scram = None
+        conn.restart = True
+        conn.send("<success xmlns='%s'>%s</success>" % (
+            SASL_NS,
+            base64.b64encode(server_final.encode('utf-8')).decode('ascii')))
+
+    def reply(self, conn, elem, child=None):
+        """ Send the result of an iq """
+        result = ET.Element(tag(CLIENT_NS, 'iq'), {'type': 'result',
+                                                   'id': elem.get('id', '')})
+        if conn.full is not None:
+            result.set('to', conn.full)
+        if child is not None:
+            result.append(child)
+        conn.send_element(result)
+
+    def handle_iq(self, conn, elem):
+        iq_type = elem.get('type')
+        query = elem[0] if len(elem) else None
+        query_tag = query.tag if query is not None else None
+
+        if conn.full is None:
+            if query_tag == tag(REGISTER_NS, 'query') and conn.jid is None:
+                self.iq_register(conn, elem, query)
+            elif query_tag == tag(BIND_NS, 'bind') and conn.jid is not None:
+                resource = query.findtext(tag(BIND_NS, 'resource'))
+                bind = ET.Element(tag(BIND_NS, 'bind'))
+                ET.SubElement(bind, tag(BIND_NS, 'jid')).text = \
+                    self.bind(conn, resource)
+                self.reply(conn, elem, bind)
+            else:
+                conn.send_element(stanza_error(elem, 'not-authorized',
+                                               'auth'))
+            return
+
+        elem.set('from', conn.full)
+        to = elem.get('to')
+        if to and split_jid(to)[1] is not None:
+            self.route_iq(conn, elem)
+            return
+        if to and split_jid(to)[0] not in (conn.jid, conn.domain):
+            self.route_iq(conn, elem)
+            return
+        if iq_type in ('result', 'error'):
+            return
+
+        if query_tag == tag(ROSTER_NS, 'query'):
+            self.iq_roster(conn, elem, query)
+        elif query_tag == tag(PRIVACY_NS, 'query'):
+            self.iq_privacy(conn, elem, query)
+        elif query_tag == tag(REGISTER_NS, 'query'):
+            self.iq_register(conn, elem, query)
+        elif query_tag in (tag(PING_NS, 'ping'), tag(SESSION_NS, 'session')):
+            self.reply(conn, elem)
+        else:
+            conn.send_element(stanza_error(elem, 'service-unavailable'))
+
+    def route_iq(self, conn, elem):
+        to = elem.get('to')
+        bare, resource = split_jid(to)
+        with self.lock:
+            target = self.sessions.get('%s/%s' % (bare, resource)) \
+                if resource else None
+            account = self.accounts.get(bare)
+            allowed = account is not None and \
+                self.allowed(account, target, conn.full, 'iq')
+        if target is not None and allowed:
+            target.send_element(elem)
+        elif elem.get('type') in ('get', 'set'):
+            conn.send_element(stanza_error(elem, 'service-unavailable'))
+
+    def iq_register(self, conn, elem, query):
+        """ In-band registration (XEP-0077) """
+        if elem.get('type') == 'get':
+            form = ET.Element(tag(REGISTER_NS, 'query'))
+            ET.SubElement(form, tag(REGISTER_NS, 'instructions')).text = \
+                "Choose a username and password"
+            ET.SubElement(form, tag(REGISTER_NS, 'username'))
+            ET.SubElement(form, tag(REGISTER_NS, 'password'))
+            if conn.jid is not None:
+                ET.SubElement(form, tag(REGISTER_NS, 'registered'))
+            self.reply(conn, elem, form)
+            return
+
+        if query.find(tag(REGISTER_NS, 'remove')) is not None:
+            if conn.jid is None:
+                conn.send_element(stanza_error(elem, 'not-authorized',
+                                               'auth'))
+                return
+            self.reply(conn, elem)
+            self.remove_account(conn.jid)
+            return
+
+        username = query.findtext(tag(REGISTER_NS, 'username'))
+        password = query.findtext(tag(REGISTER_NS, 'password'))
+        if not username or not password:
+            conn.send_element(stanza_error(elem, 'not-acceptable', 'modify'))
+            return
+        jid = ('%s@%s' % (username, conn.domain)).lower()
+        if conn.jid is not None:
+            if jid != conn.jid:
+                conn.send_element(stanza_error(elem, 'not-allowed'))
+                return
+            with self.lock:
+                self.accounts[jid].set_password(password)
+            self.reply(conn, elem)
+        elif self.add_account(jid, password):
+            self.logger.debug("Account created: %s" % jid)
+            self.reply(conn, elem)
+        else:
+            conn.send_element(stanza_error(elem, 'conflict',
+                                           text="Username already exists"))
+
+    # roster
+
+    def roster_item(self, account, contact, removed=False):
+        item = ET.Element(tag(ROSTER_NS, 'item'), {'jid': contact})
+        if removed:
+            item.set('subscription', 'remove')
+            return item
+        state = account.roster[contact]
+        item.set('subscription', account.subscription(contact))
+        if state['ask']:
+            item.set('ask', state['ask'])
+        if state['name']:
+            item.set('name', state['name'])
+        for group in state['groups']:
+            ET.SubElement(item, tag(ROSTER_NS, 'group')).text = group
+        return item
+
+    def roster_push(self, account, contact, removed=False):
+        """ Bump the roster version, returns the pushes to deliver """
+        account.roster_version += 1
+        deliveries = []
+        for conn in self.resources(account.jid):
+            push = ET.Element(tag(CLIENT_NS, 'iq'),
+                              {'type': 'set', 'to': conn.full,
+                               'id': uuid.uuid4().hex})
+            query = ET.SubElement(push, tag(ROSTER_NS, 'query'),
+                                  {'ver': str(account.roster_version)})
+            query.append(self.roster_item(account, contact, removed))
+            deliveries.append((conn, push))
+        return deliveries
+
+    def iq_roster(self, conn, elem, query):
+        deliveries = []
+        with self.lock:
+            account = self.accounts[conn.jid]
+            if elem.get('type') == 'get':
+                version = str(account.roster_version)
+                if query.get('ver') == version:
+                    result = None
+                else:
+                    result = ET.Element(tag(ROSTER_NS, 'query'),
+                                        {'ver': version})
+                    for contact in account.roster:
+                        result.append(self.roster_item(account, contact))
+            else:
+                result = None
+                for item in query.findall(tag(ROSTER_NS, 'item')):
+                    contact = split_jid(item.get('jid', ''))[0]
+                    if not contact or contact == conn.jid:
+                        continue
+                    if item.get('subscription') == 'remove':
+                        deliveries += self.roster_remove(account, contact)
+                        continue
+                    state = account.item(contact)
+                    state['name'] = item.get('name')
+                    state['groups'] = [group.text or '' for group in
+                                       item.findall(tag(ROSTER_NS, 'group'))]
+                    deliveries += self.roster_push(account, contact)
+        self.reply(conn, elem, result)
+        self.deliver(deliveries)
+
+    def roster_remove(self, account, contact):
+        deliveries = []
+        if contact not in account.roster:
+            return deliveries
+        if account.roster[contact]['to'] or account.roster[contact]['ask']:
+            deliveries += self.subscription(account, contact, 'unsubscribe')
+        if account.roster[contact]['from']:
+            deliveries += self.subscription(account, contact, 'unsubscribed')
+        del account.roster[contact]
+        deliveries += self.roster_push(account, contact, removed=True)
+        return deliveries
+
+    # presence
+
+    def handle_presence(self, conn, elem):
+        presence_type = elem.get('type')
+        elem.set('from', conn.full)
+        to = elem.get('to')
+        with self.lock:
+            account = self.accounts.get(conn.jid)
+            if account is None:
+                return
+            if to is None:
+                if presence_type in (None, 'unavailable'):
+                    deliveries = self.presence_broadcast(conn, elem)
+                else:
+                    deliveries = []
+            elif presence_type in ('subscribe', 'subscribed',
+                                   'unsubscribe', 'unsubscribed'):
+                deliveries = self.subscription(account, split_jid(to)[0],
+                                               presence_type)
+            else:
+                deliveries = self.directed_presence(conn, elem)
+        self.deliver(deliveries)
+
+    def presence_broadcast(self, conn, elem):
+        """ Broadcast an available or unavailable presence """
+        account = self.accounts[conn.jid]
+        initial = elem.get('type') is None and not conn.available
+        if elem.get('type') is None:
+            conn.available = True
+            conn.presence = elem
+            try:
+                conn.priority = int(elem.findtext(tag(CLIENT_NS, 'priority'))
+                                    or 0)
+            except ValueError:
+                conn.priority = 0
+        else:
+            conn.available = False
+            conn.presence = None
+
+        deliveries = []
+        for contact, state in account.roster.items():
+            contact_account = self.accounts.get(contact)
+            if not state['from'] or contact_account is None:
+                continue
+            if not self.allowed(account, conn, contact, 'presence-out'):
+                continue
+            for target in self.available(contact):
+                if self.allowed(contact_account, target, conn.full,
+                                'presence-in'):
+                    deliveries.append((target, copy_stanza(elem,
+                                                           to=target.full)))
+        targets = self.available(conn.jid)
+        if conn.available and conn not in targets:
+            targets.append(conn)
+        for target in targets:
+            deliveries.append((target, copy_stanza(elem, to=target.full)))
+
+        if initial:
+            deliveries += self.probe(conn, account)
+        return deliveries
+
+    def probe(self, conn, account):
+        """ Presences and requests an initial presence gets """
+        deliveries = []
+        for contact, state in account.roster.items():
+            if not state['to']:
+                continue
+            for other in self.available(contact):
+                if other is not conn and \
+                        self.allowed(account, conn, other.full, 'presence-in'):
+                    deliveries.append((conn, copy_stanza(other.presence,
+                                                         to=conn.full)))
+        for other in self.available(conn.jid):
+            if other is not conn:
+                deliveries.append((conn, copy_stanza(other.presence,
+                                                     to=conn.full)))
+        for request in account.pending_in.values():
+            deliveries.append((conn, copy_stanza(request, to=conn.full)))
+        return deliveries
+
+    def directed_presence(self, conn, elem):
+        bare, resource = split_jid(elem.get('to'))
+        account = self.accounts.get(bare)
+        if account is None:
+            return []
+        targets = self.available(bare)
+        if resource is not None:
+            targets = [target for target in targets
+                       if target.full == '%s/%s' % (bare, resource)]
+        return [(target, elem) for target in targets
+                if self.allowed(account, target, conn.full, 'presence-in')]
+
+    def subscription(self, account, contact, action):
+        """ Process a subscription request or answer of account """
+        contact_account = self.accounts.get(contact)
+        if contact_account is None or contact == account.jid:
+            return []
+        stanza = ET.Element(tag(CLIENT_NS, 'presence'),
+                            {'type': action, 'from': account.jid,
+                             'to': contact})
+        deliveries = []
+
+        if action == 'subscribe':
+            if contact_account.subscription(account.jid) in ('from', 'both'):
+                # already approved: answer on behalf of the contact
+                return self.subscription(contact_account, account.jid,
+                                         'subscribed')
+            account.item(contact)['ask'] = 'subscribe'
+            deliveries += self.roster_push(account, contact)
+            targets = self.available(contact)
+            if targets:
+                deliveries += [(target, stanza) for target in targets]
+            else:
+                contact_account.pending_in[account.jid] = stanza
+
+        elif action == 'subscribed':
+            contact_item = contact_account.roster.get(account.jid)
+            if contact_item is None or contact_item['ask'] != 'subscribe':
+                return []
+            account.pending_in.pop(contact, None)
+            account.item(contact)['from'] = True
+            deliveries += self.roster_push(account, contact)
+            contact_item['to'] = True
+            contact_item['ask'] = None
+            deliveries += self.roster_push(contact_account, account.jid)
+            targets = self.available(contact)
+            deliveries += [(target, stanza) for target in targets]
+            for conn in self.available(account.jid):
+                deliveries += [(target, copy_stanza(conn.presence,
+                                                    to=target.full))
+                               for target in targets]
+
+        elif action == 'unsubscribe':
+            item = account.roster.get(contact)
+            if item is not None and (item['to'] or item['ask']):
+                item['to'] = False
+                item['ask'] = None
+                deliveries += self.roster_push(account, contact)
+            contact_item = contact_account.roster.get(account.jid)
+            contact_account.pending_in.pop(account.jid, None)
+            if contact_item is not None and contact_item['from']:
+                contact_item['from'] = False
+                deliveries += self.roster_push(contact_account, account.jid)
+            targets = self.available(contact)
+            deliveries += [(target, stanza) for target in targets]
+            deliveries += self.unavailable(contact, account.jid)
+
+        elif action == 'unsubscribed':
+            account.pending_in.pop(contact, None)
+            item = account.roster.get(contact)
+            if item is not None and item['from']:
+                item['from'] = False
+                deliveries += self.roster_push(account, contact)
+            contact_item = contact_account.roster.get(account.jid)
+            if contact_item is not None and \
+                    (contact_item['to'] or contact_item['ask']):
+                contact_item['to'] = False
+                contact_item['ask'] = None
+                deliveries += self.roster_push(contact_account, account.jid)
+            targets = self.available(contact)
+            deliveries += [(target, stanza) for target in targets]
+            deliveries += self.unavailable(account.jid, contact)
+
+        return deliveries
+
+    def unavailable(self, jid, contact):
+        """ Tell contact's resources that the resources of jid are gone """
+        deliveries = []
+        for conn in self.available(jid):
+            for target in self.available(contact):
+                deliveries.append((target, ET.Element(
+                    tag(CLIENT_NS, 'presence'),
+                    {'type': 'unavailable', 'from': conn.full,
+                     'to': target.full})))
+        return deliveries
+
+    # messages
+
+    def handle_message(self, conn, elem):
+        elem.set('from', conn.full)
+        to = elem.get('to') or conn.jid
+        bare, resource = split_jid(to)
+        blocked = False
+        targets = []
+        with self.lock:
+            account = self.accounts.get(bare)
+            if account is not None:
+                full = '%s/%s' % (bare, resource)
+                if resource is not None and full in self.sessions:
+                    targets = [self.sessions[full]]
+                else:
+                    available = [target for target in self.available(bare)
+                                 if target.priority >= 0]
+                    if available:
+                        best = max(target.priority for target in available)
+                        targets = [target for target in available
+                                   if target.priority == best]
+                targets = [target for target in targets if
+                           self.allowed(account, target, conn.full, 'message')]
+                blocked = not targets and \
+                    not self.allowed(account, None, conn.full, 'message')
+        if account is None or blocked:
+            if elem.get('type') != 'error':
+                conn.send_element(stanza_error(elem, 'service-unavailable'))
+            return
+        for target in targets:
+            target.send_element(elem)
+
+    # privacy lists
+
+    def allowed(self, account, conn, jid, kind):
+        """
+        Tell if account's privacy list, the active one of conn or the
+        default one, lets a stanza of kind go between it and jid
+        """
+        name = conn.active_list if conn is not None else None
+        if name is None:
+            name = account.default_list
+        items = account.privacy_lists.get(name)
+        bare = split_jid(jid)[0]
+        # lists do not apply between the resources of an account
+        if not items or bare == account.jid:
+            return True
+        domain = bare.partition('@')[2] or bare
+        state = account.roster.get(bare)
+        for item in items:
+            kinds = [child.tag.split('}', 1)[-1] for child in item]
+            if kinds and kind not in kinds:
+                continue
+            item_type = item.get('type')
+            value = item.get('value')
+            if item_type == 'jid':
+                if value.lower() not in (jid.lower(), bare, domain):
+                    continue
+            elif item_type == 'subscription':
+                if value != account.subscription(bare):
+                    continue
+            elif item_type == 'group':
+                if state is None or value not in state['groups']:
+                    continue
+            return item.get('action') == 'allow'
+        return True
+
+    def iq_privacy(self, conn, elem, query):
+        with self.lock:
+            account = self.accounts[conn.jid]
+            if elem.get('type') == 'get':
+                result = self.privacy_get(conn, account, query)
+                if result is None:
+                    conn.send_element(stanza_error(elem, 'item-not-found'))
+                else:
+                    self.reply(conn, elem, result)
+                return
+            deliveries = self.privacy_set(conn, account, elem, query)
+        self.deliver(deliveries)
+
+    def privacy_get(self, conn, account, query):
+        result = ET.Element(tag(PRIVACY_NS, 'query'))
+        lists = query.findall(tag(PRIVACY_NS, 'list'))
+        if lists:
+            name = lists[0].get('name')
+            if name not in account.privacy_lists:
+                return None
+            privacy_list = ET.SubElement(result, tag(PRIVACY_NS, 'list'),
+                                         {'name': name})
+            privacy_list.extend(account.privacy_lists[name])
+            return result
+        if conn.active_list:
+            ET.SubElement(result, tag(PRIVACY_NS, 'active'),
+                          {'name': conn.active_list})
+        if account.default_list:
+            ET.SubElement(result, tag(PRIVACY_NS, 'default'),
+                          {'name': account.default_list})
+        for name in sorted(account.privacy_lists):
+            ET.SubElement(result, tag(PRIVACY_NS, 'list'), {'name': name})
+        return result
+
+    def privacy_set(self, conn, account, elem, query):
+        if len(query) != 1:
+            conn.send_element(stanza_error(elem, 'bad-request', 'modify'))
+            return []
+        child = query[0]
+        name = child.get('name')
+        if child.tag in (tag(PRIVACY_NS, 'default'),
+                         tag(PRIVACY_NS, 'active')):
+            if name and name not in account.privacy_lists:
+                conn.send_element(stanza_error(elem, 'item-not-found'))
+                return []
+            if child.tag == tag(PRIVACY_NS, 'default'):
+                account.default_list = name
+            else:
+                conn.active_list = name
+            self.reply(conn, elem)
+            return []
+
+        if child.tag != tag(PRIVACY_NS, 'list') or not name:
+            conn.send_element(stanza_error(elem, 'bad-request', 'modify'))
+            return []
+        items = child.findall(tag(PRIVACY_NS, 'item'))
+        if items:
+            try:
+                items.sort(key=lambda item: int(item.get('order')))
+            except (TypeError, ValueError):
+                conn.send_element(stanza_error(elem, 'bad-request', 'modify'))
+                return []
+            account.privacy_lists[name] = items
+        else:
+            if name == account.default_list:
+                conn.send_element(stanza_error(elem, 'conflict'))
+                return []
+            account.privacy_lists.pop(name, None)
+        self.reply(conn, elem)
+
+        deliveries = []
+        for target in self.resources(account.jid):
+            push = ET.Element(tag(CLIENT_NS, 'iq'),
+                              {'type': 'set', 'to': target.full,
+                               'id': uuid.uuid4().hex})
+            ET.SubElement(ET.SubElement(push, tag(PRIVACY_NS, 'query')),
+                          tag(PRIVACY_NS, 'list'), {'name': name})
+            deliveries.append((target, push))
+        return deliveries
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015 the pyp2p authors and contributors
+# <see AUTHORS and LICENSE files>
+
+import socket
+import threading
+import uuid
+
+from sleekxmpp.jid import JID
+from sleekxmpp.xmlstream.handler import Callback
+from sleekxmpp.xmlstream.matcher import StanzaPath
+
+from pyp2p.core.exceptions import PyP2pBadFormat, PyP2pFailed, PyP2pTimedOut
+from pyp2p.direct import DirectSender, receive_direct
+import pyp2p.stanzas  # registers pyp2p stanza extensions
+
+# transfer element types
+OFFER = 'offer'
+FAILED = 'failed'
+
+MAX_SIZE = 64 * 1024 * 1024
+
+
+class DirectTransferManager(object):
+    """
+
+        Negotiates direct TCP transfers between xmpp clients.
+
+        The sender listens on a port and offers it to the receiver
+        in a message holding a <transfer xmlns="urn:pyp2p:transfer"/>
+        element. The receiver connects and fetches the payload, or
+        answers a failure notice when it cannot: the sender then
+        falls back to sending in-band.
+
+    """
+
+    def __init__(self, xmpp, logger, deliver):
+        """  - deliver(from_jid, data) is called with received payloads
+        """
+        self.xmpp = xmpp
+        self.logger = logger
+        self.deliver = deliver
+        self.enabled = False
+        self.host = None
+        self.max_size = MAX_SIZE
+        self.timeout = 10
+        self.lock = threading.Lock()
+        self.outgoing = {}
+
+        xmpp.register_handler(
+            Callback('Direct transfer',
+                     StanzaPath('message/transfer'),
+                     self.received))
+
+    def enable(self, host=None, max_size=MAX_SIZE, timeout=10):
+        """
+        Send and accept direct transfers. Offers give the host
+        address, or the local address of the xmpp connection when
+        none is given
+        """
+        self.host = host
+        self.max_size = max_size
+        self.timeout = timeout
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def advertised_host(self):
+        if self.host not in (None, '0.0.0.0'):
+            return self.host
+        try:
+            return self.xmpp.socket.getsockname()[0]
+        except (AttributeError, socket.error):
+            return '127.0.0.1'
+
+    def send(self, recipient, data, timeout=None):
+        """
+        Send data over a direct connection, blocking until it is
+        acknowledged. Returns False when it could not be sent
+        """
+        if not self.enabled:
+            return False
+        if timeout is None:
+            timeout = self.timeout
+
+        try:
+            sender = DirectSender(data, host=self.host or '0.0.0.0',
+                                  advertise=self.advertised_host())
+        except socket.error as error:
+            self.logger.warning("Cannot listen for direct transfer: %s"
+                                % error)
+            return False
+
+        sid = uuid.uuid4().hex
+        with self.lock:
+            self.outgoing[sid] = (JID(recipient).bare, sender)
+        try:
+            msg = self.xmpp.make_message(mto=recipient, mtype='chat')
+            msg['transfer']['sid'] = sid
+            msg['transfer']['type'] = OFFER
+            for key, value in sender.offer().items():
+                msg['transfer'][key] = str(value)
+            msg.send()
+            sender.serve(timeout=timeout)
+            self.logger.debug("%d bytes sent directly to %s"
+                              % (len(data), recipient))
+            return True
+        except (PyP2pFailed, PyP2pTimedOut) as error:
+            self.logger.info("Direct transfer to %s failed: %s"
+                             % (recipient, error.msg))
+            return False
+        finally:
+            sender.server.close()
+            with self.lock:
+                self.outgoing.pop(sid, None)
+
+    def received(self, msg):
+        """ Process transfer offers and failure notices """
+        transfer = msg['transfer']
+        from_jid = msg['from']
+        if msg['type'] == 'error' or transfer['type'] == FAILED:
+            with self.lock:
+                recipient, sender = self.outgoing.get(transfer['sid'],
+                                                      (None, None))
+            # only the receiver may cancel
+            if sender is not None and recipient == from_jid.bare:
+                sender.cancel()
+        elif transfer['type'] == OFFER:
+            try:
+                offer = dict((key, transfer[key]) for key in
+                             ('sid', 'host', 'port', 'size', 'sha1', 'token'))
+            except ValueError:
+                offer = None
+            if not self.enabled or offer is None or \
+                    not 0 <= offer['size'] <= self.max_size or \
+                    not 0 < offer['port'] < 65536:
+                self.refuse(from_jid, transfer['sid'])
+                return
+            thread = threading.Thread(target=self.fetch,
+                                      args=(from_jid, offer),
+                                      name="pyp2p transfer %s" % offer['sid'])
+            thread.daemon = True
+            thread.start()
+
+    def fetch(self, from_jid, offer):
+        try:
+            data = receive_direct(offer['host'], offer['port'],
+                                  offer['token'], offer['size'],
+                                  offer['sha1'], timeout=self.timeout,
+                                  max_size=self.max_size)
+        except (PyP2pFailed, PyP2pBadFormat) as error:
+            self.logger.info("Direct transfer from %s failed: %s"
+                             % (from_jid, error.msg))
+            self.refuse(from_jid, offer['sid'])
+            return
+        self.deliver(from_jid.bare, data)
+
+    def refuse(self, to_jid, sid):
+        msg = self.xmpp.make_message(mto=to_jid, mtype='chat')
+        msg['transfer']['sid'] = sid
+        msg['transfer']['type'] = FAILED
+        msg.send()
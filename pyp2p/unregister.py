@@ -11,10 +11,14 @@
 
 import sys
 import logging
+import threading
+import time
 
 import sleekxmpp
 from sleekxmpp.exceptions import IqError, IqTimeout
 
+from pyp2p.core.workers import run_concurrently
+
 # Python versions before 3.0 do not use UTF-8 encoding
 # by default. To ensure that Unicode is handled properly
 # throughout SleekXMPP, we will set the default encoding
@@ -25,6 +29,13 @@ if sys.version_info < (3, 0):
 else:
     raw_input = input
 
+# unregistration outcomes
+OK = 'ok'
+TIMEOUT = 'timeout'
+AUTH_FAILED = 'auth-failed'
+FAILED = 'failed'
+UNREACHABLE = 'unreachable'
+
 
 class UnRegisterBot(sleekxmpp.ClientXMPP):
 
@@ -38,12 +49,18 @@ class UnRegisterBot(sleekxmpp.ClientXMPP):
         sleekxmpp.ClientXMPP.__init__(self, jid, password)
 
         self.logger = logger
+        self.status = None
+        self.error = None
+        self.removing = False
+        self.done = threading.Event()
         # The session_start event will be triggered when
         # the bot establishes its connection with the server
         # and the XML streams are ready for use. We want to
         # listen for this event so that we we can initialize
         # our roster.
         self.add_event_handler("session_start", self.start, threaded=True)
+        self.add_event_handler("failed_auth", self.failed_auth)
+        self.add_event_handler("disconnected", self.disconnected)
 
     def start(self, event):
         """
@@ -55,10 +72,40 @@ class UnRegisterBot(sleekxmpp.ClientXMPP):
                      data.
         """
         self.send_presence(ptype='unavailable')
+        self.removing = True
         try:
             self.plugin['xep_0077'].cancel_registration()
+            self.status = OK
+            self.logger.info("User removed: %s" % self.boundjid.bare)
+            # servers may keep the stream open, the work is done anyway
+            self.disconnect()
+        except IqError as e:
+            self.status = FAILED
+            self.error = e.iq['error']['text']
+            self.logger.error("Could not remove account: %s" % self.error)
+            self.disconnect()
         except IqTimeout:
-            pass
+            self.status = TIMEOUT
+            self.error = "No response from server."
+            self.logger.error("No response from server.")
+            self.disconnect()
+
+    def failed_auth(self, event):
+        """
+        Process failed authentification event
+        """
+        self.status = AUTH_FAILED
+        self.error = "Authentification failed"
+        self.logger.warn("Authentification failed !")
+
+    def disconnected(self, event):
+        """
+        Process disconnection, the unregistration is over. The
+        server may close the stream as soon as the account is removed
+        """
+        if self.status is None and self.removing:
+            self.status = OK
+        self.done.set()
 
 
 class Unregister(object):
@@ -67,17 +114,24 @@ class Unregister(object):
         self.server_address = server_address
         self.port = port
 
+    def make_bot(self, logger, jid, password):
+        """
+        Setup the UnRegisterBot and register plugins.
+        """
+        xmpp = UnRegisterBot(logger, jid, password)
+        xmpp.auto_reconnect = False  # prevents reconnection on unregister
+        xmpp.register_plugin('xep_0030')  # Service Discovery
+        xmpp.register_plugin('xep_0004')  # Data forms
+        xmpp.register_plugin('xep_0077')  # In-band Registration
+        return xmpp
+
     def unregister(self, jid, password):
         # Setup logging.
         logging.basicConfig(level=logging.DEBUG)
 
         logger = logging.getLogger("unregister")
 
-        xmpp = UnRegisterBot(logger, jid, password)
-        xmpp.auto_reconnect = False  # prevents reconnection on unregister
-        xmpp.register_plugin('xep_0030')  # Service Discovery
-        xmpp.register_plugin('xep_0004')  # Data forms
-        xmpp.register_plugin('xep_0077')  # In-band Registration
+        xmpp = self.make_bot(logger, jid, password)
 
         # Connect to the XMPP server and start processing XMPP stanzas.
         logger.info("Connecting...")
@@ -88,3 +142,60 @@ class Unregister(object):
             return True
         else:
             return False
+
+    def unregister_many(self, credentials, concurrency=8, timeout=30,
+                        retries=2, retry_delay=1):
+        """
+        Unregister several accounts, with at most concurrency
+        connections in flight.
+
+        Arguments:
+            credentials -- An iterable of (jid, password) tuples.
+            timeout     -- Seconds given to each attempt.
+            retries     -- Number of extra attempts for accounts that
+                           timed out or whose server was unreachable.
+            retry_delay -- Seconds before the first retry, doubled for
+                           each following one.
+
+        Returns a dictionary giving, for each jid, a dictionary with
+        the unregistration 'status' (OK, TIMEOUT, AUTH_FAILED, FAILED
+        or UNREACHABLE), the 'error' text if any, the number of
+        'attempts' and the 'elapsed' time in seconds.
+        """
+        logging.basicConfig(level=logging.DEBUG)
+        logger = logging.getLogger("unregister")
+
+        def attempt(jid, password):
+            xmpp = self.make_bot(logger, jid, password)
+            if not xmpp.connect(address=(self.server_address, self.port),
+                                reattempt=False):
+                return UNREACHABLE, None
+            xmpp.process(block=False)
+            if not xmpp.done.wait(timeout):
+                xmpp.disconnect(wait=False)
+                if xmpp.status == OK:
+                    # removed, only the disconnection was slow
+                    return OK, None
+                return TIMEOUT, "No answer after %ss" % timeout
+            return xmpp.status or FAILED, xmpp.error
+
+        def unregister_one(credential):
+            jid, password = credential
+            started = time.time()
+            for count in range(retries + 1):
+                if count:
+                    time.sleep(retry_delay * 2 ** (count - 1))
+                try:
+                    status, error = attempt(jid, password)
+                except Exception as e:
+                    logger.exception("Unregistration of %s failed" % jid)
+                    status, error = FAILED, str(e)
+                if status not in (TIMEOUT, UNREACHABLE):
+                    break
+            return jid, {'status': status,
+                         'error': error,
+                         'attempts': count + 1,
+                         'elapsed': time.time() - started}
+
+        results = run_concurrently(unregister_one, credentials, concurrency)
+        return dict(result for result in results if result is not None)
@@ -0,0 +1,72 @@
+#!/usr/bin/python
+# Copyright (C) 2015 the pyp2p authors and contributors
+# <see AUTHORS and LICENSE files>
+import sys
+import uuid
+from nose.plugins.skip import SkipTest
+
+if sys.version_info < (3, 6):
+    raise SkipTest("asyncio front-end needs python >= 3.6")
+
+import asyncio
+from pyp2p.async_session import AsyncP2pSession
+from pyp2p.metrics import MetricsRegistry, SnapshotExporter
+from pyp2p.privacy import ROSTER_ONLY
+from pyp2p.register import Register
+from pyp2p.session import SENT, SKIPPED_OFFLINE
+from pyp2p.testing import get_test_server
+from pyp2p.unregister import Unregister
+
+
+class TestAsyncSession:
+
+    def setup(self):
+        self.server, self.port = get_test_server()
+        self.ident = '%s@iot.legrand.net' % uuid.uuid4()
+        self.password = 'titi'
+        self.test_msg = "il n'y a pas de hasard"
+        Register(server_address=self.server,
+                 port=self.port).register(self.ident, self.password)
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.session = AsyncP2pSession(server_address=self.server,
+                                       port=self.port,
+                                       jid=self.ident,
+                                       password=self.password)
+
+    def teardown(self):
+        self.loop.close()
+        Unregister(server_address=self.server,
+                   port=self.port).unregister(self.ident, self.password)
+
+    def run(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def test_message_to_myself(self):
+        registry = MetricsRegistry()
+        self.session.bot.set_metrics(registry)
+        assert self.run(self.session.start(timeout=10))
+        self.run(self.session.wait_online(timeout=10))
+
+        status = self.run(self.session.send_batch(
+            [(self.ident, self.test_msg),
+             ('nobody@iot.legrand.net', self.test_msg)]))
+        assert status == [(self.ident, SENT),
+                          ('nobody@iot.legrand.net', SKIPPED_OFFLINE)]
+
+        messages = self.session.messages()
+        received = self.run(asyncio.wait_for(messages.__anext__(), 10))
+        assert received == (self.ident, self.test_msg)
+        self.run(self.session.stop())
+
+        metrics = SnapshotExporter().export(registry)
+        assert metrics['pyp2p_roster_rtt_seconds']['count'] == 1
+        assert metrics['pyp2p_messages_received_total'] == 1
+
+    def test_privacy_on_start(self):
+        self.session.bot.needs_privacy = True
+        assert self.run(self.session.start(timeout=10))
+
+        assert not self.session.bot.needs_privacy
+        assert ROSTER_ONLY in self.session.bot.privacy.load_digests()
+        self.run(self.session.stop())
@@ -0,0 +1,138 @@
+#!/usr/bin/python
+# Copyright (C) 2015 the pyp2p authors and contributors
+# <see AUTHORS and LICENSE files>
+from pyp2p.direct import DirectSender, receive_direct, TOKEN_LEN
+from pyp2p.core.exceptions import PyP2pBadFormat, PyP2pFailed, PyP2pTimedOut
+from pyp2p.session import P2pSession
+from pyp2p.transfer import OFFER
+
+from nose.tools import assert_raises
+import os
+import socket
+import threading
+import time
+
+
+class TestDirectTransfer:
+
+    def setup(self):
+        self.data = os.urandom(300000)
+        self.sender = DirectSender(self.data, host='127.0.0.1')
+        self.errors = []
+
+    def teardown(self):
+        self.sender.server.close()
+
+    def serve(self, **kwargs):
+        def run():
+            try:
+                self.sender.serve(**kwargs)
+            except Exception as error:
+                self.errors.append(error)
+        thread = threading.Thread(target=run)
+        thread.start()
+        return thread
+
+    def test_transfer(self):
+        thread = self.serve(timeout=5)
+        offer = self.sender.offer()
+        assert offer['host'] == '127.0.0.1'
+        assert offer['size'] == len(self.data)
+        data = receive_direct(offer['host'], offer['port'], offer['token'],
+                              offer['size'], offer['sha1'], timeout=5)
+        thread.join()
+        assert data == self.data
+        assert self.errors == []
+
+    def test_wrong_token_ignored(self):
+        thread = self.serve(timeout=5)
+        offer = self.sender.offer()
+        intruder = socket.create_connection((offer['host'], offer['port']))
+        intruder.sendall(b'x' * TOKEN_LEN)
+        assert intruder.recv(1) == b''
+        intruder.close()
+
+        data = receive_direct(offer['host'], offer['port'], offer['token'],
+                              offer['size'], offer['sha1'], timeout=5)
+        thread.join()
+        assert data == self.data
+        assert self.errors == []
+
+    def test_digest_mismatch(self):
+        thread = self.serve(timeout=5)
+        offer = self.sender.offer()
+        assert_raises(PyP2pBadFormat, receive_direct, offer['host'],
+                      offer['port'], offer['token'], offer['size'],
+                      '0' * 40, 5)
+        thread.join()
+        assert isinstance(self.errors[0], PyP2pFailed)
+
+    def test_no_receiver(self):
+        assert_raises(PyP2pTimedOut, self.sender.serve, 0.2)
+
+    def test_cancel(self):
+        thread = self.serve(timeout=5)
+        self.sender.cancel()
+        thread.join()
+        assert isinstance(self.errors[0], PyP2pFailed)
+
+    def test_unreachable(self):
+        offer = self.sender.offer()
+        self.sender.server.close()
+        assert_raises(PyP2pFailed, receive_direct, offer['host'],
+                      offer['port'], offer['token'], offer['size'],
+                      offer['sha1'], 1)
+
+    def test_bad_size(self):
+        offer = self.sender.offer()
+        for size in (-1, '300000', len(self.data) + 1):
+            assert_raises(PyP2pBadFormat, receive_direct, offer['host'],
+                          offer['port'], offer['token'], size,
+                          offer['sha1'], 1, len(self.data))
+
+
+class TestTransferOffers:
+
+    def setup(self):
+        self.session = P2pSession(server_address='localhost', port=5222,
+                                  jid='bob@iot.legrand.net', password='titi',
+                                  keepalive=False, connect=False)
+        self.transfers = self.session.transfers
+        self.transfers.enable(host='127.0.0.1', max_size=1000, timeout=1)
+        self.refused = []
+        self.transfers.refuse = lambda to_jid, sid: self.refused.append(sid)
+
+    def teardown(self):
+        pass
+
+    def offer(self, sid, size, port='1'):
+        msg = self.session.make_message(mto='bob@iot.legrand.net',
+                                        mfrom='alice@iot.legrand.net/r',
+                                        mtype='chat')
+        msg['transfer']['sid'] = sid
+        msg['transfer']['type'] = OFFER
+        msg['transfer']['host'] = '127.0.0.1'
+        msg['transfer']['port'] = port
+        msg['transfer']['size'] = size
+        msg['transfer']['sha1'] = '0' * 40
+        msg['transfer']['token'] = 'x' * 32
+        return msg
+
+    def test_bad_offers_refused(self):
+        self.transfers.received(self.offer('negative', '-1'))
+        self.transfers.received(self.offer('text', 'huge'))
+        self.transfers.received(self.offer('too-big', '1001'))
+        self.transfers.received(self.offer('bad-port', '10', port='70000'))
+        assert self.refused == ['negative', 'text', 'too-big', 'bad-port']
+
+    def test_failed_fetch_refused(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(('127.0.0.1', 0))
+        port = server.getsockname()[1]
+        server.close()
+        self.transfers.received(self.offer('closed', '10', port=str(port)))
+        deadline = time.time() + 5
+        while not self.refused:
+            assert time.time() < deadline
+            time.sleep(0.01)
+        assert self.refused == ['closed']
@@ -0,0 +1,88 @@
+#!/usr/bin/python
+# Copyright (C) 2015 the pyp2p authors and contributors
+# <see AUTHORS and LICENSE files>
+import threading
+import time
+from pyp2p.dispatcher import MessageDispatcher
+
+
+class TestMessageDispatcher:
+
+    def setup(self):
+        self.received = []
+        self.lock = threading.Lock()
+
+    def teardown(self):
+        pass
+
+    def callback(self, from_jid, msg_body):
+        with self.lock:
+            self.received.append((from_jid, msg_body))
+
+    def test_sender_order(self):
+        dispatcher = MessageDispatcher(callback=self.callback, workers=4)
+        senders = ['user%d@iot.legrand.net' % index for index in range(8)]
+        for count in range(50):
+            for sender in senders:
+                dispatcher.dispatch(sender, count)
+        dispatcher.stop()
+
+        assert len(self.received) == 400
+        for sender in senders:
+            bodies = [body for jid, body in self.received if jid == sender]
+            assert bodies == list(range(50))
+        assert dispatcher.get_stats()['handled'] == 400
+
+    def test_backpressure(self):
+        release = threading.Event()
+
+        def slow_callback(from_jid, msg_body):
+            release.wait()
+
+        dispatcher = MessageDispatcher(callback=slow_callback, workers=1,
+                                       max_pending=1, put_timeout=0.1)
+        jid = 'alice@iot.legrand.net'
+        assert dispatcher.dispatch(jid, 'handled')
+        time.sleep(0.1)  # let the worker take the first message
+        assert dispatcher.dispatch(jid, 'pending')
+        assert not dispatcher.dispatch(jid, 'rejected')
+        assert dispatcher.depth() == 1
+
+        release.set()
+        dispatcher.stop()
+        stats = dispatcher.get_stats()
+        assert stats['rejected'] == 1
+        assert stats['handled'] == 2
+
+    def test_failing_callback(self):
+        def failing_callback(from_jid, msg_body):
+            raise ValueError(msg_body)
+
+        dispatcher = MessageDispatcher(callback=failing_callback, workers=1)
+        dispatcher.dispatch('alice@iot.legrand.net', 'boom')
+        dispatcher.stop()
+        assert dispatcher.get_stats()['failed'] == 1
+
+    def test_stop_full_queue(self):
+        release = threading.Event()
+        handled = []
+
+        def slow_callback(from_jid, msg_body):
+            release.wait()
+            handled.append(msg_body)
+
+        dispatcher = MessageDispatcher(callback=slow_callback, workers=1,
+                                       max_pending=1)
+        jid = 'alice@iot.legrand.net'
+        dispatcher.dispatch(jid, 'handled')
+        time.sleep(0.1)  # let the worker take the first message
+        dispatcher.dispatch(jid, 'pending')
+
+        # must not block on the full queue
+        dispatcher.stop(wait=False)
+        assert not dispatcher.dispatch(jid, 'after stop')
+
+        release.set()
+        dispatcher.threads[0].join(5)
+        assert not dispatcher.threads[0].is_alive()
+        assert handled == ['handled', 'pending']
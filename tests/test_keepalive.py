@@ -0,0 +1,110 @@
+#!/usr/bin/python
+# Copyright (C) 2015 the pyp2p authors and contributors
+# <see AUTHORS and LICENSE files>
+import uuid
+from pyp2p.keepalive import AdaptiveKeepalive
+from pyp2p.register import Register
+from pyp2p.scheduler import TimerWheel
+from pyp2p.session import P2pSession
+from pyp2p.testing import get_test_server
+from pyp2p.unregister import Unregister
+
+
+class FakeSession(object):
+
+    def __init__(self):
+        self.filters = {'in': [], 'out': []}
+        self.handlers = {}
+        self.pings = 0
+
+    def add_filter(self, mode, handler):
+        self.filters[mode].append(handler)
+
+    def del_filter(self, mode, handler):
+        self.filters[mode].remove(handler)
+
+    def add_event_handler(self, name, pointer):
+        self.handlers.setdefault(name, []).append(pointer)
+
+    def del_event_handler(self, name, pointer):
+        self.handlers[name].remove(pointer)
+
+    def event(self, name, data=None):
+        for handler in self.handlers.get(name, []):
+            handler(data)
+
+    def is_ready(self):
+        return True
+
+    def keepalive_ping(self, timeout):
+        self.pings += 1
+
+
+class TestAdaptiveKeepalive:
+
+    def setup(self):
+        self.wheel = TimerWheel(tick=1)
+        self.keepalive = AdaptiveKeepalive(timer=self.wheel, min_interval=10,
+                                           max_interval=40, timeout=5)
+        self.session = FakeSession()
+        self.keepalive.register(self.session)
+        self.state = self.keepalive.states[self.session]
+
+    def teardown(self):
+        self.keepalive.unregister(self.session)
+        self.wheel.stop()
+
+    def test_traffic_is_liveness(self):
+        self.state.last_activity -= 5
+        for stanza_filter in self.session.filters['in']:
+            stanza_filter('<message/>')
+        self.keepalive.check(self.session)
+        assert self.session.pings == 0
+
+    def test_idle_backoff(self):
+        self.state.last_activity -= 10
+        self.keepalive.check(self.session)
+        assert self.session.pings == 1
+
+        for interval in (20, 40, 40):
+            self.session.event('keepalive_pong')
+            assert self.keepalive.get_stats(self.session)['interval'] == interval
+
+    def test_lost_resets(self):
+        self.session.event('keepalive_pong')
+        self.session.event('keepalive_lost')
+        assert self.keepalive.get_stats(self.session)['interval'] == 10
+
+    def test_unregister(self):
+        self.keepalive.unregister(self.session)
+        assert self.session.filters == {'in': [], 'out': []}
+        assert self.keepalive.get_stats(self.session) is None
+        self.keepalive.register(self.session)
+
+
+class TestSessionKeepalive:
+
+    def setup(self):
+        self.server, self.port = get_test_server()
+        self.ident = '%s@iot.legrand.net' % uuid.uuid4()
+        Register(server_address=self.server,
+                 port=self.port).register(self.ident, 'titi')
+        self.wheel = TimerWheel()
+        self.wheel.start()
+        self.keepalive = AdaptiveKeepalive(timer=self.wheel)
+
+    def teardown(self):
+        self.wheel.stop()
+        Unregister(server_address=self.server,
+                   port=self.port).unregister(self.ident, 'titi')
+
+    def test_disconnect_unregisters(self):
+        session = P2pSession(server_address=self.server, port=self.port,
+                             jid=self.ident, password='titi',
+                             keepalive=self.keepalive)
+        session.wait_ready(timeout=10)
+        assert session in self.keepalive.states
+
+        session.session_disconnect()
+        assert session not in self.keepalive.states
+        assert self.keepalive.get_stats(session) is None
@@ -0,0 +1,182 @@
+#!/usr/bin/python
+# Copyright (C) 2015 the pyp2p authors and contributors
+# <see AUTHORS and LICENSE files>
+import logging
+import logging.handlers
+import os
+import shutil
+import tempfile
+from stat import S_IMODE
+from nose.tools import assert_raises
+from pyp2p.core.exceptions import PyP2pBadArgument
+import pyp2p.log_storage
+from pyp2p.log_storage import LogStorage
+from pyp2p.obfuscated_storage import ObfuscatedLogStorage
+from pyp2p.storage_factory import StorageFactory
+
+
+class TestLogStorage:
+
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'store.log')
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def test_factory(self):
+        storage = StorageFactory(kind='log',
+                                 filename=self.filename).get_storage()
+        assert isinstance(storage, LogStorage)
+        assert storage.get_filename() == self.filename
+
+    def test_factory_options(self):
+        for options in ({'commit_delay': 0.5}, {'cache': True}):
+            factory = StorageFactory(kind='log', filename=self.filename,
+                                     **options)
+            assert_raises(PyP2pBadArgument, factory.get_storage)
+
+    def test_put_get_delete(self):
+        storage = LogStorage(filename=self.filename)
+        storage.put('alice@iot.legrand.net', 'mYsEcret007')
+        storage.put('bob@iot.legrand.net', ['roster', 1])
+        assert storage.get('alice@iot.legrand.net') == 'mYsEcret007'
+        assert storage.delete('alice@iot.legrand.net')
+        assert not storage.delete('alice@iot.legrand.net')
+        assert storage.get('alice@iot.legrand.net') is None
+        storage.close()
+
+        storage = LogStorage(filename=self.filename)
+        assert storage.keys() == ['bob@iot.legrand.net']
+        assert storage.get('bob@iot.legrand.net') == ['roster', 1]
+        assert S_IMODE(os.stat(self.filename).st_mode) == 0o600
+
+    def test_store_incremental(self):
+        storage = LogStorage(filename=self.filename)
+        data = dict(('user%d@iot.legrand.net' % index, 'x' * 100)
+                    for index in range(50))
+        storage.store(data)
+        size = os.path.getsize(self.filename)
+
+        data['user0@iot.legrand.net'] = 'changed'
+        del data['user1@iot.legrand.net']
+        storage.store(data)
+        # only the changed and deleted keys were appended
+        assert os.path.getsize(self.filename) - size < 200
+        storage.close()
+
+        assert LogStorage(filename=self.filename).retrieve() == data
+
+    def test_store_list(self):
+        storage = LogStorage(filename=self.filename)
+        data = ['alice@iot.legrand.net', 'mYsEcret007']
+        storage.store(data)
+        assert storage.retrieve() == data
+        storage.store({'alice@iot.legrand.net': 'mYsEcret007'})
+        assert storage.retrieve() == {'alice@iot.legrand.net': 'mYsEcret007'}
+
+    def test_compaction(self):
+        storage = LogStorage(filename=self.filename, compact_min_size=1024)
+        for count in range(200):
+            storage.put('counter', count)
+            storage.put('name', 'alice')
+        assert os.path.getsize(self.filename) < 1024
+        storage.close()
+
+        storage = LogStorage(filename=self.filename)
+        assert storage.get('counter') == 199
+        assert storage.get('name') == 'alice'
+
+    def test_compaction_durable(self):
+        synced = []
+        sync_directory = pyp2p.log_storage.sync_directory
+        pyp2p.log_storage.sync_directory = synced.append
+        try:
+            storage = LogStorage(filename=self.filename)
+            storage.put('counter', 1)
+            storage.compact()
+        finally:
+            pyp2p.log_storage.sync_directory = sync_directory
+        assert synced == [self.directory]
+
+    def test_compaction_rename_failed(self):
+        def rename(source, destination):
+            raise OSError("rename failed")
+        storage = LogStorage(filename=self.filename)
+        storage.put('counter', 1)
+        storage.put('counter', 2)
+        os_rename = os.rename
+        os.rename = rename
+        try:
+            assert_raises(OSError, storage.compact)
+        finally:
+            os.rename = os_rename
+        # the old log is still in use
+        storage.put('other', 3)
+        assert storage.retrieve() == {'counter': 2, 'other': 3}
+        storage.close()
+        assert LogStorage(filename=self.filename).retrieve() == \
+            {'counter': 2, 'other': 3}
+
+    def test_compaction_leftover(self):
+        with open(self.filename + '.compact', 'wb') as temp:
+            temp.write(b'partial')
+        storage = LogStorage(filename=self.filename)
+        storage.put('counter', 1)
+        assert not os.path.exists(self.filename + '.compact')
+
+    def test_data_not_logged(self):
+        handler = logging.handlers.BufferingHandler(100)
+        logging.getLogger().addHandler(handler)
+        try:
+            LogStorage(filename=self.filename).store({'alice': 'mYsEcret007'})
+        finally:
+            logging.getLogger().removeHandler(handler)
+        assert not any('mYsEcret007' in handler.format(record)
+                       for record in handler.buffer)
+
+    def test_torn_record(self):
+        storage = LogStorage(filename=self.filename)
+        storage.put('alice@iot.legrand.net', 'mYsEcret007')
+        storage.put('bob@iot.legrand.net', 'bobsecret')
+        storage.close()
+        with open(self.filename, 'r+b') as log:
+            log.truncate(os.path.getsize(self.filename) - 3)
+
+        storage = LogStorage(filename=self.filename)
+        assert storage.retrieve() == {'alice@iot.legrand.net': 'mYsEcret007'}
+        storage.put('bob@iot.legrand.net', 'bobsecret')
+        storage.close()
+        assert len(LogStorage(filename=self.filename)) == 2
+
+    def test_hooks(self):
+        def scramble(data, key):
+            return bytes(bytearray(byte ^ key for byte in bytearray(data)))
+
+        storage = LogStorage(filename=self.filename)
+        storage.store_hook = storage.retrieve_hook = scramble
+        storage.hooks_extra_args = 0x5a
+        storage.put('alice@iot.legrand.net', 'mYsEcret007')
+        storage.close()
+        with open(self.filename, 'rb') as log:
+            assert b'mYsEcret007' not in log.read()
+
+        storage.put('bob@iot.legrand.net', 'bobsecret')
+        assert storage.get('alice@iot.legrand.net') == 'mYsEcret007'
+
+    def test_encrypted(self):
+        storage = StorageFactory(kind='advanced_log',
+                                 filename=self.filename).get_storage()
+        assert isinstance(storage, ObfuscatedLogStorage)
+        storage.store({'alice@iot.legrand.net': 'mYsEcret007'})
+        storage.put('bob@iot.legrand.net', 'bobsecret')
+        storage.compact()
+        storage.close()
+        with open(self.filename, 'rb') as log:
+            content = log.read()
+        assert b'mYsEcret007' not in content
+        assert b'alice' not in content
+
+        storage = ObfuscatedLogStorage(filename=self.filename)
+        assert storage.retrieve() == {'alice@iot.legrand.net': 'mYsEcret007',
+                                      'bob@iot.legrand.net': 'bobsecret'}
@@ -0,0 +1,89 @@
+#!/usr/bin/python
+# Copyright (C) 2015 the pyp2p authors and contributors
+# <see AUTHORS and LICENSE files>
+import threading
+from nose.tools import assert_raises
+from pyp2p.core.exceptions import PyP2pBadArgument
+from pyp2p.dispatcher import MessageDispatcher
+from pyp2p.metrics import MetricsRegistry, NULL_REGISTRY, NULL_METRIC
+from pyp2p.metrics import SnapshotExporter, PrometheusExporter
+
+
+class TestMetrics:
+
+    def setup(self):
+        self.registry = MetricsRegistry()
+
+    def teardown(self):
+        pass
+
+    def test_counter(self):
+        counter = self.registry.counter('sent_total', "Sent")
+        counter.inc()
+        counter.inc(4)
+        assert self.registry.counter('sent_total', "Sent") is counter
+        assert SnapshotExporter().export(self.registry) == {'sent_total': 5}
+
+    def test_counter_threads(self):
+        counter = self.registry.counter('sent_total', "Sent")
+
+        def increment():
+            for _ in range(1000):
+                counter.inc()
+
+        threads = [threading.Thread(target=increment) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert counter.value == 8000
+
+    def test_histogram(self):
+        histogram = self.registry.histogram('rtt_seconds', "RTT",
+                                            buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 2.0):
+            histogram.observe(value)
+        snapshot = SnapshotExporter().export(self.registry)['rtt_seconds']
+        assert snapshot['count'] == 4
+        assert abs(snapshot['sum'] - 2.65) < 1e-9
+        assert snapshot['buckets'] == [(0.1, 2), (1.0, 3),
+                                       (float('inf'), 4)]
+
+    def test_kind_conflict(self):
+        self.registry.counter('sent_total', "Sent")
+        assert_raises(PyP2pBadArgument, self.registry.histogram,
+                      'sent_total', "Sent")
+
+    def test_prometheus(self):
+        self.registry.counter('sent_total', "Sent").inc(3)
+        histogram = self.registry.histogram('rtt_seconds', "RTT",
+                                            buckets=(0.5,))
+        histogram.observe(0.25)
+        histogram.observe(1.0)
+        text = PrometheusExporter().export(self.registry)
+        assert text == ('# HELP rtt_seconds RTT\n'
+                        '# TYPE rtt_seconds histogram\n'
+                        'rtt_seconds_bucket{le="0.5"} 1\n'
+                        'rtt_seconds_bucket{le="+Inf"} 2\n'
+                        'rtt_seconds_sum 1.25\n'
+                        'rtt_seconds_count 2\n'
+                        '# HELP sent_total Sent\n'
+                        '# TYPE sent_total counter\n'
+                        'sent_total 3\n')
+
+    def test_disabled(self):
+        counter = NULL_REGISTRY.counter('sent_total', "Sent")
+        assert counter is NULL_METRIC
+        counter.inc()
+        NULL_REGISTRY.histogram('rtt_seconds', "RTT").observe(1.0)
+        assert not NULL_REGISTRY.enabled
+        assert SnapshotExporter().export(NULL_REGISTRY) == {}
+
+    def test_dispatcher_latency(self):
+        histogram = self.registry.histogram('callback_seconds', "Callback")
+        dispatcher = MessageDispatcher(callback=lambda **kwargs: None,
+                                       workers=2, latency=histogram)
+        for count in range(10):
+            dispatcher.dispatch('user@iot.legrand.net', count)
+        dispatcher.stop()
+        assert histogram.count == 10
@@ -2,7 +2,13 @@
 # Copyright (C) 2015 the pyp2p authors and contributors
 # <see AUTHORS and LICENSE files>
 import os
+import pickle
+import shutil
+import tempfile
 from stat import S_IMODE
+from Crypto.Cipher import AES
+from pyp2p.obfuscated_storage import MAGIC, HEADER
+from pyp2p.storage import BLOCK_SIZE
 from pyp2p.storage_factory import StorageFactory
 from nose.tools import assert_raises
 
@@ -106,4 +112,81 @@ class TestRandomizeKey:
         key1 = storage.randomize_key(16)
         for loop_index in range(32):
             key_n = storage.randomize_key(16)
-            assert key_n == key1
\ No newline at end of file
+            assert key_n == key1
+
+class TestStreaming:
+
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, '.store.lock')
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def test_large_store(self):
+        storage = StorageFactory(filename=self.filename).get_storage()
+        data = {'blob': os.urandom(3 * BLOCK_SIZE + 7),
+                'lines': ['line %d\n' % index for index in range(20000)]}
+
+        storage.store(data)
+
+        assert storage.retrieve() == data
+
+    def test_whole_and_stream_formats(self):
+        storage = StorageFactory(filename=self.filename).get_storage()
+        data = ['alice@iot.legrand.net', 'mYsEcret007'] * 10000
+
+        storage.store(data)
+        with open(self.filename, 'rb') as container:
+            plain = storage.decrypt(container.read(), storage.hooks_extra_args)
+        assert pickle.loads(plain) == data
+
+        with open(self.filename, 'wb') as container:
+            container.write(storage.encrypt(pickle.dumps(data),
+                                            storage.hooks_extra_args))
+        assert storage.retrieve() == data
+
+    def test_legacy_format(self):
+        storage = StorageFactory(filename=self.filename).get_storage()
+        data = ['alice@iot.legrand.net', 'mYsEcret007']
+        init_vector = os.urandom(AES.block_size)
+        cipher = AES.new(storage.hooks_extra_args, AES.MODE_CFB, init_vector)
+        with open(self.filename, 'wb') as container:
+            container.write(init_vector + cipher.encrypt(pickle.dumps(data)))
+
+        # only read when migrating
+        assert_raises(ValueError, storage.retrieve)
+        storage = StorageFactory(filename=self.filename,
+                                 legacy=True).get_storage()
+        assert storage.retrieve() == data
+        storage.store(data)
+        with open(self.filename, 'rb') as container:
+            assert container.read().startswith(MAGIC)
+        assert storage.retrieve() == data
+
+    def test_tampered(self):
+        storage = StorageFactory(filename=self.filename).get_storage()
+        storage.store(['alice@iot.legrand.net', 'mYsEcret007'])
+        with open(self.filename, 'rb') as container:
+            content = bytearray(container.read())
+
+        for position in (0, len(MAGIC) - 1, len(MAGIC), HEADER.size + 3,
+                         len(content) - 1):
+            tampered = bytearray(content)
+            tampered[position] ^= 1
+            with open(self.filename, 'wb') as container:
+                container.write(bytes(tampered))
+            assert_raises(ValueError, storage.retrieve)
+
+        with open(self.filename, 'wb') as container:
+            container.write(bytes(content[:HEADER.size + 10]))
+        assert_raises(ValueError, storage.retrieve)
+
+    def test_group_commit(self):
+        storage = StorageFactory(filename=self.filename,
+                                 commit_delay=10).get_storage()
+        data = ['alice@iot.legrand.net', 'mYsEcret007']
+        storage.store(data)
+        storage.flush()
+
+        assert StorageFactory(filename=self.filename).get_storage().retrieve() == data
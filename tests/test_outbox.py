@@ -0,0 +1,94 @@
+#!/usr/bin/python
+# Copyright (C) 2015 the pyp2p authors and contributors
+# <see AUTHORS and LICENSE files>
+import time
+from nose.tools import assert_raises
+from pyp2p.core.exceptions import PyP2pBadArgument
+from pyp2p.outbox import Outbox, DROP_NEWEST
+from pyp2p.session import P2pSession
+
+
+class TestOutbox:
+
+    def setup(self):
+        self.alice = 'alice@iot.legrand.net'
+
+    def teardown(self):
+        pass
+
+    def test_push_pop(self):
+        outbox = Outbox()
+        assert outbox.push(self.alice + '/phone', 'one')
+        assert outbox.push(self.alice, 'two')
+
+        assert outbox.depth(self.alice) == 2
+        assert outbox.pop(self.alice) == ['one', 'two']
+        assert outbox.pop(self.alice) == []
+        assert outbox.get_counters()['queued'] == 2
+        assert outbox.get_counters()['flushed'] == 2
+
+    def test_drop_oldest(self):
+        outbox = Outbox(max_depth=2)
+        for msg in ('one', 'two', 'three'):
+            assert outbox.push(self.alice, msg)
+
+        assert outbox.pop(self.alice) == ['two', 'three']
+        assert outbox.get_counters()['dropped'] == 1
+
+    def test_drop_newest(self):
+        outbox = Outbox(max_depth=2, drop_policy=DROP_NEWEST)
+        assert outbox.push(self.alice, 'one')
+        assert outbox.push(self.alice, 'two')
+        assert not outbox.push(self.alice, 'three')
+
+        assert outbox.pop(self.alice) == ['one', 'two']
+        assert outbox.get_counters()['dropped'] == 1
+
+    def test_expire(self):
+        outbox = Outbox(ttl=0.1)
+        outbox.push(self.alice, 'one')
+        time.sleep(0.2)
+        outbox.expire()
+
+        assert outbox.depth() == 0
+        assert outbox.pop(self.alice) == []
+        assert outbox.get_counters()['expired'] == 1
+
+    def test_bad_policy(self):
+        assert_raises(PyP2pBadArgument, Outbox, drop_policy='random')
+
+
+class TestSessionOutbox:
+
+    def setup(self):
+        self.session = P2pSession(server_address='localhost', port=5222,
+                                  jid='bob@iot.legrand.net', password='titi',
+                                  keepalive=False, connect=False)
+
+    def teardown(self):
+        self.session.scheduler.quit()
+
+    def expiry_tasks(self):
+        # the scheduler is not running: added tasks are still queued
+        return [task for task in self.session.scheduler.addq.queue
+                if task.name == 'outbox expiry']
+
+    def test_enable_again(self):
+        self.session.enable_outbox(ttl=300)
+        first = self.session.outbox
+        self.session.enable_outbox(ttl=0.1)
+        assert self.session.outbox is not first
+        assert len(self.expiry_tasks()) == 1
+
+        # the task sweeps the outbox in use
+        self.session.outbox.push('alice@iot.legrand.net', 'one')
+        time.sleep(0.2)
+        self.expiry_tasks()[0].callback()
+        assert self.session.outbox.depth() == 0
+        assert self.session.outbox.get_counters()['expired'] == 1
+
+    def test_no_expiry(self):
+        self.session.enable_outbox(ttl=None)
+        assert self.expiry_tasks() == []
+        self.session.enable_outbox(ttl=300)
+        assert len(self.expiry_tasks()) == 1
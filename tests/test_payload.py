@@ -0,0 +1,155 @@
+#!/usr/bin/python
+# Copyright (C) 2015 the pyp2p authors and contributors
+# <see AUTHORS and LICENSE files>
+from pyp2p.payload import PayloadAssembler, encode_payload, decode_payload
+from pyp2p.payload import BASE64, ZLIB_BASE64
+from pyp2p.core.exceptions import PyP2pBadFormat
+from pyp2p.session import P2pSession
+
+from nose.tools import assert_raises
+import os
+
+
+class TestPayload:
+
+    def setup(self):
+        self.telemetry = b'{"temperature": 21.5, "humidity": 40}' * 1000
+        self.random = os.urandom(5000)
+
+    def teardown(self):
+        pass
+
+    def test_compressed(self):
+        encoding, chunks = encode_payload(self.telemetry)
+        assert encoding == ZLIB_BASE64
+        assert sum(len(chunk) for chunk in chunks) < len(self.telemetry) // 10
+        assert decode_payload(encoding, chunks) == self.telemetry
+
+    def test_not_compressible(self):
+        encoding, chunks = encode_payload(self.random)
+        assert encoding == BASE64
+        assert decode_payload(encoding, chunks) == self.random
+
+    def test_chunks(self):
+        encoding, chunks = encode_payload(self.random, chunk_size=1000)
+        assert len(chunks) == 7
+        assert max(len(chunk) for chunk in chunks) == 1000
+        assert decode_payload(encoding, chunks) == self.random
+
+    def test_empty(self):
+        encoding, chunks = encode_payload(b'')
+        assert chunks == ['']
+        assert decode_payload(encoding, chunks) == b''
+
+    def test_corrupted(self):
+        encoding, chunks = encode_payload(self.telemetry)
+        assert_raises(PyP2pBadFormat, decode_payload, encoding, ['abc'])
+        assert_raises(PyP2pBadFormat, decode_payload, 'rot13', chunks)
+
+    def test_decompression_bomb(self):
+        encoding, chunks = encode_payload(b'\0' * (1024 * 1024))
+        assert encoding == ZLIB_BASE64
+        assert len(decode_payload(encoding, chunks, 1024 * 1024)) == 1024 * 1024
+        assert_raises(PyP2pBadFormat, decode_payload, encoding, chunks,
+                      1024 * 1024 - 1)
+
+
+class TestPayloadAssembler:
+
+    def setup(self):
+        self.assembler = PayloadAssembler(ttl=60, max_pending=2)
+        self.data = os.urandom(3000)
+        self.encoding, self.chunks = encode_payload(self.data,
+                                                    chunk_size=1000)
+
+    def teardown(self):
+        pass
+
+    def feed(self, from_jid, payload_id, seq):
+        return self.assembler.feed(from_jid, payload_id, seq,
+                                   len(self.chunks), self.encoding,
+                                   self.chunks[seq])
+
+    def test_reassembly_out_of_order(self):
+        assert self.feed('alice', 'p1', 2) is None
+        assert self.feed('alice', 'p1', 0) is None
+        assert self.feed('alice', 'p1', 1) is None
+        assert self.feed('alice', 'p1', 3) == self.data
+        assert len(self.assembler) == 0
+
+    def test_senders_kept_apart(self):
+        for seq in range(3):
+            assert self.feed('alice', 'p1', seq) is None
+            assert self.feed('bob', 'p1', seq) is None
+        assert self.feed('bob', 'p1', 3) == self.data
+        assert len(self.assembler) == 1
+
+    def test_duplicate_chunk(self):
+        self.feed('alice', 'p1', 0)
+        self.feed('alice', 'p1', 0)
+        for seq in range(1, 3):
+            assert self.feed('alice', 'p1', seq) is None
+        assert self.feed('alice', 'p1', 3) == self.data
+
+    def test_bad_chunk(self):
+        assert_raises(PyP2pBadFormat, self.assembler.feed,
+                      'alice', 'p1', 4, 4, self.encoding, '')
+        assert_raises(PyP2pBadFormat, self.assembler.feed,
+                      'alice', 'p2', 0, 0, self.encoding, '')
+        assert_raises(PyP2pBadFormat, self.assembler.feed,
+                      'alice', 'p3', 0, 10 ** 9, self.encoding, '')
+
+    def test_max_size(self):
+        self.assembler.max_size = 1000
+        encoding, chunks = encode_payload(b'\0' * 5000)
+        assert_raises(PyP2pBadFormat, self.assembler.feed,
+                      'alice', 'p1', 0, 1, encoding, chunks[0])
+
+    def test_max_pending(self):
+        self.feed('alice', 'p1', 0)
+        self.feed('alice', 'p2', 0)
+        assert_raises(PyP2pBadFormat, self.feed, 'alice', 'p3', 0)
+
+    def test_expiry(self):
+        self.feed('alice', 'p1', 0)
+        self.assembler.ttl = -1
+        self.feed('alice', 'p2', 0)
+        assert len(self.assembler) == 1
+
+
+class TestPayloadStanza:
+
+    def setup(self):
+        self.payloads = []
+        self.session = P2pSession(server_address='localhost', port=5222,
+                                  jid='bob@iot.legrand.net', password='titi',
+                                  keepalive=False, connect=False)
+        self.session.set_payload_callback(self.payload_callback)
+
+    def teardown(self):
+        pass
+
+    def payload_callback(self, from_jid, payload):
+        self.payloads.append(payload)
+
+    def chunk(self, seq, total):
+        encoding, chunks = encode_payload(b'telemetry')
+        msg = self.session.make_message(mto='bob@iot.legrand.net',
+                                        mfrom='alice@iot.legrand.net/r',
+                                        mtype='chat')
+        msg['payload']['id'] = 'p1'
+        msg['payload']['seq'] = seq
+        msg['payload']['total'] = total
+        msg['payload']['encoding'] = encoding
+        msg['payload']['data'] = chunks[0]
+        return msg
+
+    def test_chunk(self):
+        self.session.payload_chunk(self.chunk('0', '1'))
+        assert self.payloads == [b'telemetry']
+
+    def test_malformed_chunk(self):
+        self.session.payload_chunk(self.chunk('first', '1'))
+        self.session.payload_chunk(self.chunk('0', ''))
+        assert self.payloads == []
+        assert len(self.session.payloads) == 0
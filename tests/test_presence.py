@@ -0,0 +1,84 @@
+#!/usr/bin/python
+# Copyright (C) 2015 the pyp2p authors and contributors
+# <see AUTHORS and LICENSE files>
+import threading
+from sleekxmpp.jid import JID
+from pyp2p.presence import PresenceIndex, bare_jid
+
+
+class TestPresenceIndex:
+
+    def setup(self):
+        self.index = PresenceIndex()
+        self.alice = 'alice@iot.legrand.net'
+
+    def teardown(self):
+        pass
+
+    def test_bare_jid(self):
+        assert bare_jid(self.alice + '/phone') == self.alice
+        assert bare_jid(self.alice) == self.alice
+        assert bare_jid(JID(self.alice + '/phone')) == self.alice
+        assert bare_jid(JID(self.alice)) == self.alice
+
+    def test_add(self):
+        assert self.index.add(self.alice + '/phone')
+        assert not self.index.add(self.alice + '/laptop')
+        assert not self.index.add(self.alice + '/phone')
+
+        assert self.index.is_online(self.alice)
+        assert self.index.is_online(self.alice + '/tablet')
+        assert self.alice in self.index
+        assert len(self.index) == 1
+        assert len(self.index.get_resources(self.alice)) == 2
+
+    def test_jid_object(self):
+        self.index.add(self.alice + '/phone')
+        assert self.index.is_online(JID(self.alice))
+        assert self.index.is_online(JID(self.alice + '/tablet'))
+        assert not self.index.is_online(JID('bob@iot.legrand.net'))
+
+    def test_remove_resource(self):
+        self.index.add(self.alice + '/phone')
+        self.index.add(self.alice + '/laptop')
+
+        assert not self.index.remove(self.alice + '/phone')
+        assert self.index.is_online(self.alice)
+        assert self.index.remove(self.alice + '/laptop')
+        assert not self.index.is_online(self.alice)
+
+    def test_remove_bare(self):
+        self.index.add(self.alice + '/phone')
+        self.index.add(self.alice + '/laptop')
+
+        assert self.index.remove(self.alice)
+        assert not self.index.is_online(self.alice)
+        assert not self.index.remove(self.alice)
+
+    def test_knows(self):
+        self.index.add(self.alice + '/phone')
+
+        assert self.index.knows(self.alice)
+        assert self.index.knows(self.alice + '/phone')
+        assert not self.index.knows(self.alice + '/laptop')
+        assert not self.index.knows('bob@iot.legrand.net/phone')
+
+    def test_snapshot(self):
+        bob = 'bob@iot.legrand.net'
+        self.index.add(self.alice + '/phone')
+        self.index.add(bob + '/phone')
+
+        snapshot = self.index.snapshot()
+        self.index.remove(bob)
+
+        assert snapshot == frozenset([self.alice, bob])
+        assert list(self.index) == [self.alice]
+
+    def test_wait_online(self):
+        timer = threading.Timer(0.1, self.index.add, [self.alice + '/phone'])
+        timer.start()
+        assert self.index.wait_online(self.alice, timeout=5)
+        timer.join()
+
+    def test_wait_online_timeout(self):
+        assert not self.index.wait_online(self.alice, timeout=0.1)
@@ -0,0 +1,78 @@
+#!/usr/bin/python
+# Copyright (C) 2015 the pyp2p authors and contributors
+# <see AUTHORS and LICENSE files>
+import logging
+import os
+from pyp2p.metrics import MetricsRegistry
+from pyp2p.privacy import PrivacyManager, ROSTER_ONLY, ROSTER_ONLY_RULES, list_digest
+from pyp2p.storage_factory import StorageFactory
+from sleekxmpp.exceptions import IqError, IqTimeout
+from sleekxmpp.jid import JID
+
+
+class FakeClient(object):
+
+    def __init__(self, jid):
+        self.boundjid = JID(jid)
+        self.handlers = []
+
+    def register_handler(self, handler):
+        self.handlers.append(handler)
+
+    def Iq(self):
+        raise AssertionError("no IQ expected")
+
+
+class FakeIq(dict):
+
+    def __init__(self, answer):
+        dict.__init__(self, error={'condition': 'item-not-found',
+                                   'text': '', 'type': 'cancel'})
+        self.answer = answer
+
+    def send(self, now=False):
+        if isinstance(self.answer, Exception):
+            raise self.answer
+        return self.answer
+
+
+class TestPrivacyManager:
+
+    def setup(self):
+        self.jid = 'alice@iot.legrand.net'
+        self.storage = StorageFactory(kind='basic', filename='privacy.lock').get_storage()
+        self.logger = logging.getLogger("privacy")
+
+    def teardown(self):
+        if os.path.exists(self.storage.get_filename()):
+            os.remove(self.storage.get_filename())
+
+    def test_digest(self):
+        digest = list_digest(ROSTER_ONLY, ROSTER_ONLY_RULES, True)
+        assert digest == list_digest(ROSTER_ONLY, ROSTER_ONLY_RULES, True)
+        assert digest != list_digest(ROSTER_ONLY, ROSTER_ONLY_RULES, False)
+        assert digest != list_digest(ROSTER_ONLY, (), True)
+
+    def test_skip_unchanged(self):
+        digest = list_digest(ROSTER_ONLY, ROSTER_ONLY_RULES, True)
+        self.storage.store({self.jid: {ROSTER_ONLY: digest}})
+
+        manager = PrivacyManager(FakeClient(self.jid), self.logger, self.storage)
+        assert manager.ensure_list(ROSTER_ONLY)
+
+    def test_invalidate(self):
+        digest = list_digest(ROSTER_ONLY, ROSTER_ONLY_RULES, True)
+        self.storage.store({self.jid: {ROSTER_ONLY: digest}})
+
+        manager = PrivacyManager(FakeClient(self.jid), self.logger, self.storage)
+        manager.invalidate()
+        assert self.storage.retrieve() == {self.jid: {}}
+
+    def test_rtt(self):
+        manager = PrivacyManager(FakeClient(self.jid), self.logger, self.storage)
+        manager.rtt = MetricsRegistry().histogram('rtt_seconds', "RTT")
+        assert manager.send(FakeIq('result'), "sent")
+        assert not manager.send(FakeIq(IqError(FakeIq(None))), "sent")
+        assert not manager.send(FakeIq(IqTimeout(FakeIq(None))), "sent")
+        # the timed out request is not counted
+        assert manager.rtt.snapshot()['count'] == 2
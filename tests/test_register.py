@@ -4,10 +4,13 @@
 import pyp2p.register as reg
 import pyp2p.unregister as unreg
 from pyp2p.identifier import Identifier
+from pyp2p.testing import get_test_server
 
 import logging
 import logging.handlers
 
+SERVER, PORT = get_test_server()
+
 class AssertingHandler(logging.handlers.BufferingHandler):
 
     def __init__(self,capacity):
@@ -24,11 +27,11 @@ class AssertingHandler(logging.handlers.BufferingHandler):
 class TestRegister:
  
     def setup(self):
-        self.register = reg.Register(server_address='p2pserver.cloudapp.net', port='80')
+        self.register = reg.Register(server_address=SERVER, port=PORT)
         self.ident = Identifier(domain="iot.legrand.net").get_identifier()
 
     def teardown(self):
-        unreg.Unregister(server_address='p2pserver.cloudapp.net', port='80').unregister(self.ident,'titi')
+        unreg.Unregister(server_address=SERVER, port=PORT).unregister(self.ident,'titi')
 
     def test_register(self):
         assert self.register.register(self.ident,'titi')
@@ -47,3 +50,57 @@ class TestRegister:
     def test_register_twice(self):
         assert self.register.register(self.ident,'titi')
         assert self.register.register(self.ident,'titi')
+
+
+class TestRegisterMany:
+
+    def setup(self):
+        self.register = reg.Register(server_address=SERVER, port=PORT)
+        self.idents = [Identifier(domain="iot.legrand.net").get_identifier()
+                       for _ in range(4)]
+
+    def teardown(self):
+        unregister = unreg.Unregister(server_address=SERVER, port=PORT)
+        for ident in self.idents:
+            unregister.unregister(ident, 'titi')
+
+    def test_register_many(self):
+        report = self.register.register_many([(ident, 'titi') for ident in self.idents],
+                                             concurrency=2)
+        assert sorted(report.keys()) == sorted(self.idents)
+        for ident in self.idents:
+            assert report[ident]['status'] == reg.CREATED
+            assert report[ident]['elapsed'] > 0
+
+    def test_register_many_conflict(self):
+        assert self.register.register(self.idents[0], 'titi')
+        report = self.register.register_many([(self.idents[0], 'toto')])
+        assert report[self.idents[0]]['status'] == reg.CONFLICT
+
+    def test_register_many_error(self):
+        asserting_handler = AssertingHandler(200)
+        logging.getLogger().addHandler(asserting_handler)
+        make_bot = self.register.make_bot
+
+        def failing_make_bot(logger, jid, password):
+            if jid == self.idents[0]:
+                raise RuntimeError("broken bot")
+            return make_bot(logger, jid, password)
+
+        self.register.make_bot = failing_make_bot
+        try:
+            report = self.register.register_many(
+                [(ident, 'mYsEcret007') for ident in self.idents[:2]])
+        finally:
+            logging.getLogger().removeHandler(asserting_handler)
+            unreg.Unregister(server_address=SERVER,
+                             port=PORT).unregister(self.idents[1], 'mYsEcret007')
+        assert report[self.idents[0]]['status'] == reg.FAILED
+        assert report[self.idents[0]]['error'] == "broken bot"
+        assert report[self.idents[1]]['status'] == reg.CREATED
+        asserting_handler.assert_logged("Registration of %s failed"
+                                        % self.idents[0])
+        # the stanzas logged by sleekxmpp hold the password, not ours
+        assert not any('mYsEcret007' in asserting_handler.format(record)
+                       for record in asserting_handler.buffer
+                       if record.name in ('register', 'workers'))
@@ -0,0 +1,119 @@
+#!/usr/bin/python
+# Copyright (C) 2015 the pyp2p authors and contributors
+# <see AUTHORS and LICENSE files>
+import os
+import time
+from pyp2p.register import Register
+from pyp2p.roster_store import RosterStore
+from pyp2p.session import P2pSession
+from pyp2p.storage_factory import StorageFactory
+from pyp2p.testing.xmpp_server import LocalXmppServer
+
+
+class TestRosterStore:
+
+    def setup(self):
+        self.storage = StorageFactory(kind='basic', filename='roster.lock').get_storage()
+        self.owner = 'alice@iot.legrand.net'
+        self.bob = 'bob@iot.legrand.net'
+        self.state = {'name': 'bob', 'groups': [], 'from': True, 'to': True,
+                      'pending_in': False, 'pending_out': False,
+                      'whitelisted': False, 'subscription': 'both'}
+
+    def teardown(self):
+        if os.path.exists(self.storage.get_filename()):
+            os.remove(self.storage.get_filename())
+
+    def test_empty(self):
+        store = RosterStore(self.storage)
+        assert store.entries(None) == []
+        assert store.entries(self.owner) == []
+        assert store.version(self.owner) == ''
+        assert store.load(self.owner, self.bob, {}) is None
+
+    def test_persist(self):
+        store = RosterStore(self.storage, flush_delay=60)
+        store.save(self.owner, self.bob, self.state, {})
+        store.set_version(self.owner, 'ver42')
+        store.flush()
+
+        store = RosterStore(self.storage)
+        assert store.entries(None) == [self.owner]
+        assert store.entries(self.owner) == [self.bob]
+        assert store.version(self.owner) == 'ver42'
+        assert store.load(self.owner, self.bob, {}) == self.state
+
+    def test_remove(self):
+        store = RosterStore(self.storage, flush_delay=60)
+        store.save(self.owner, self.bob, self.state, {})
+        removed = dict(self.state, removed=True)
+        store.save(self.owner, self.bob, removed, {})
+        store.flush()
+
+        assert RosterStore(self.storage).entries(self.owner) == []
+
+
+class TestRosterCache:
+
+    def setup(self):
+        self.storage = StorageFactory(kind='basic', filename='roster.lock').get_storage()
+        self.server = LocalXmppServer().start()
+        self.address, self.port = self.server.address
+        self.alice = 'alice@iot.legrand.net'
+        self.bob = 'bob@iot.legrand.net'
+        register = Register(server_address=self.address, port=self.port)
+        register.register(self.alice, 'titi')
+        register.register(self.bob, 'titi')
+        self.sessions = []
+
+        # record the roster version of every roster request
+        self.requested = []
+        iq_roster = self.server.iq_roster
+
+        def spy(conn, elem, query):
+            if elem.get('type') == 'get':
+                self.requested.append(query.get('ver'))
+            iq_roster(conn, elem, query)
+        self.server.iq_roster = spy
+
+    def teardown(self):
+        for session in self.sessions:
+            session.session_disconnect()
+        self.server.stop()
+        if os.path.exists(self.storage.get_filename()):
+            os.remove(self.storage.get_filename())
+
+    def session(self, jid, **kwargs):
+        session = P2pSession(server_address=self.address, port=self.port,
+                             jid=jid, password='titi', keepalive=False,
+                             **kwargs)
+        self.sessions.append(session)
+        session.wait_ready(timeout=10)
+        return session
+
+    def wait(self, condition, timeout=10):
+        deadline = time.time() + timeout
+        while not condition():
+            assert time.time() < deadline
+            time.sleep(0.05)
+
+    def test_second_start_cached(self):
+        alice = self.session(self.alice, roster_storage=self.storage)
+        bob = self.session(self.bob)
+        alice.authorize_subscriptions()
+        bob.authorize_subscriptions()
+        alice.subscribe(targetjid=self.bob)
+        alice.wait_online(self.bob, timeout=10)
+        roster = alice.client_roster
+        self.wait(lambda: roster[self.bob]['subscription'] == 'both')
+        alice.session_disconnect()
+        self.sessions.remove(alice)
+
+        version = str(self.server.accounts[self.alice].roster_version)
+        assert self.requested[0] == ''
+        del self.requested[:]
+
+        alice = self.session(self.alice, roster_storage=self.storage)
+        # the cached version is current: the server sends no roster
+        assert self.requested == [version]
+        assert alice.client_roster[self.bob]['subscription'] == 'both'
@@ -0,0 +1,136 @@
+#!/usr/bin/python
+# Copyright (C) 2015 the pyp2p authors and contributors
+# <see AUTHORS and LICENSE files>
+import logging
+import threading
+from pyp2p.rpc import RpcManager, RpcCall
+from pyp2p.scheduler import Scheduler
+from pyp2p.core.exceptions import PyP2pFailed, PyP2pTimedOut
+from sleekxmpp.jid import JID
+from sleekxmpp.stanza import Message
+
+from nose.tools import assert_raises
+
+
+class FakeClient(object):
+    """ Routes messages to its peer without any server """
+
+    default_ns = 'jabber:client'
+    use_message_ids = False
+
+    def __init__(self, jid):
+        self.boundjid = JID(jid)
+        self.peer = None
+        self.rpc = None
+        self.drop = False
+
+    def register_handler(self, handler):
+        pass
+
+    def make_message(self, mto, mtype):
+        msg = Message(stream=self, sto=mto, stype=mtype)
+        msg['from'] = self.boundjid
+        return msg
+
+    def send(self, stanza, now=False):
+        if not self.drop:
+            self.peer.rpc.received(Message(xml=stanza.xml))
+
+
+class TestRpcCall:
+
+    def setup(self):
+        self.call = RpcCall('1', 'bob@iot.legrand.net')
+
+    def teardown(self):
+        pass
+
+    def test_result(self):
+        done = []
+        self.call.add_done_callback(done.append)
+        assert not self.call.done()
+        assert_raises(PyP2pTimedOut, self.call.result, 0.01)
+        self.call.set_result('pong')
+        assert self.call.done()
+        assert self.call.result() == 'pong'
+        assert done == [self.call]
+
+    def test_error(self):
+        self.call.set_error(PyP2pFailed("boom"))
+        self.call.set_result('late')
+        assert_raises(PyP2pFailed, self.call.result)
+
+
+class TestRpcManager:
+
+    def setup(self):
+        self.scheduler = Scheduler()
+        self.scheduler.start()
+        logger = logging.getLogger("rpc")
+        self.alice = FakeClient('alice@iot.legrand.net/device')
+        self.bob = FakeClient('bob@iot.legrand.net/device')
+        self.alice.peer, self.bob.peer = self.bob, self.alice
+        self.alice.rpc = RpcManager(self.alice, logger, self.scheduler)
+        self.bob.rpc = RpcManager(self.bob, logger, self.scheduler)
+
+    def teardown(self):
+        self.scheduler.stop()
+
+    def echo(self, from_jid, payload):
+        if payload == 'fail':
+            raise ValueError("bad request")
+        return "%s:%s" % (from_jid, payload)
+
+    def test_call(self):
+        self.bob.rpc.set_handler(self.echo)
+        call = self.alice.rpc.call('bob@iot.legrand.net', 'ping', timeout=1)
+        assert call.result(timeout=1) == 'alice@iot.legrand.net:ping'
+        assert len(self.alice.rpc) == 0
+
+    def test_many_in_flight(self):
+        self.bob.drop = True
+        self.bob.rpc.set_handler(self.echo)
+        calls = [self.alice.rpc.call('bob@iot.legrand.net/device', str(n))
+                 for n in range(50)]
+        assert len(self.alice.rpc) == 50
+        # answer in reverse order
+        self.bob.drop = False
+        for call in reversed(calls):
+            self.bob.rpc.serve('alice@iot.legrand.net/device', call.id,
+                               call.id)
+        assert [call.result(timeout=1) for call in calls] == \
+            ['alice@iot.legrand.net:%s' % call.id for call in calls]
+
+    def test_handler_error(self):
+        self.bob.rpc.set_handler(self.echo)
+        call = self.alice.rpc.call('bob@iot.legrand.net', 'fail')
+        assert_raises(PyP2pFailed, call.result, 1)
+
+    def test_no_handler(self):
+        call = self.alice.rpc.call('bob@iot.legrand.net', 'ping')
+        assert_raises(PyP2pFailed, call.result, 1)
+
+    def test_timeout(self):
+        self.bob.drop = True
+        call = self.alice.rpc.call('bob@iot.legrand.net', 'ping', timeout=0.1)
+        assert_raises(PyP2pTimedOut, call.result, 1)
+        assert len(self.alice.rpc) == 0
+
+    def test_workers(self):
+        served = []
+
+        def handler(from_jid, payload):
+            served.append(threading.current_thread().name)
+            return payload
+
+        self.bob.rpc.set_handler(handler, workers=2)
+        call = self.alice.rpc.call('bob@iot.legrand.net', 'ping')
+        assert call.result(timeout=1) == 'ping'
+        assert served[0].startswith('pyp2p dispatcher')
+        self.bob.rpc.close()
+
+    def test_close(self):
+        self.bob.drop = True
+        call = self.alice.rpc.call('bob@iot.legrand.net', 'ping')
+        self.alice.rpc.close()
+        assert_raises(PyP2pFailed, call.result, 1)
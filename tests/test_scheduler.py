@@ -0,0 +1,89 @@
+#!/usr/bin/python
+# Copyright (C) 2015 the pyp2p authors and contributors
+# <see AUTHORS and LICENSE files>
+import threading
+import time
+from pyp2p.scheduler import Scheduler, TimerWheel
+
+
+class TestScheduler:
+
+    def setup(self):
+        self.scheduler = Scheduler()
+        self.scheduler.start()
+        self.calls = []
+
+    def teardown(self):
+        self.scheduler.stop()
+
+    def record(self, value):
+        self.calls.append(value)
+
+    def test_call_later_order(self):
+        self.scheduler.call_later(0.2, self.record, 'second')
+        self.scheduler.call_later(0.1, self.record, 'first')
+        time.sleep(0.4)
+        assert self.calls == ['first', 'second']
+
+    def test_cancel(self):
+        task = self.scheduler.call_later(0.1, self.record, 'cancelled')
+        task.cancel()
+        time.sleep(0.2)
+        assert self.calls == []
+
+    def test_call_every(self):
+        done = threading.Event()
+
+        def tick():
+            self.record('tick')
+            if len(self.calls) == 3:
+                done.set()
+
+        task = self.scheduler.call_every(0.05, tick, delay=0)
+        assert done.wait(2)
+        task.cancel()
+        assert self.calls == ['tick'] * 3
+
+    def test_failing_task(self):
+        self.scheduler.call_later(0, lambda: 1 / 0)
+        self.scheduler.call_later(0.1, self.record, 'alive')
+        time.sleep(0.2)
+        assert self.calls == ['alive']
+
+
+class TestTimerWheel:
+
+    def setup(self):
+        self.wheel = TimerWheel(tick=0.01, slots=8)
+        self.calls = []
+
+    def teardown(self):
+        self.wheel.stop()
+
+    def record(self, value):
+        self.calls.append(value)
+
+    def test_slots(self):
+        self.wheel.call_later(0.03, self.record, 'second')
+        self.wheel.call_later(0.01, self.record, 'first')
+        # beyond one turn of the wheel
+        self.wheel.call_later(0.2, self.record, 'third')
+        cancelled = self.wheel.call_later(0.02, self.record, 'cancelled')
+        cancelled.cancel()
+        assert len(self.wheel) == 3
+
+        for _ in range(19):
+            for task in self.wheel.advance():
+                task.func(*task.args)
+        assert self.calls == ['first', 'second']
+
+        for task in self.wheel.advance():
+            task.func(*task.args)
+        assert self.calls == ['first', 'second', 'third']
+        assert len(self.wheel) == 0
+
+    def test_run(self):
+        done = threading.Event()
+        self.wheel.start()
+        self.wheel.call_later(0.05, done.set)
+        assert done.wait(2)
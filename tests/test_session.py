@@ -1,21 +1,23 @@
 #!/usr/bin/python
 # Copyright (C) 2015 the pyp2p authors and contributors
 # <see AUTHORS and LICENSE files>
-from pyp2p.register import Register
+from pyp2p.register import Register, CREATED
 from pyp2p.unregister import Unregister
-from pyp2p.session import P2pSession
+from pyp2p.session import P2pSession, SENT, SKIPPED_OFFLINE, DIRECT, INBAND
 from pyp2p.identifier import Identifier
+from pyp2p.metrics import MetricsRegistry, SnapshotExporter, PrometheusExporter
+from pyp2p.testing import get_test_server
 
 import logging
 import logging.handlers
+import os
 import time
 
 class TestSession:
  
     def setup(self):
         self.ident = Identifier(domain="iot.legrand.net").get_identifier()
-        self.server = 'p2pserver.cloudapp.net'
-        self.port = '80'
+        self.server, self.port = get_test_server()
         self.password = 'titi'
         self.test_msg = "il n'y a pas de hasard"
         Register(server_address=self.server,
@@ -45,14 +47,61 @@ class TestSession:
         assert self.from_jid == self.ident
         assert self.msg_body == self.test_msg
 
+    def payload_callback(self, from_jid, payload):
+        self.from_jid = from_jid
+        self.payload = payload
+
+    def test_payload_to_myself(self):
+        session = P2pSession(server_address=self.server,
+                             port=self.port,
+                             jid=self.ident,
+                             password=self.password)
+
+        session.set_msg_callback(cb=self.callback)
+        session.set_payload_callback(cb=self.payload_callback)
+        blob = b'\x00\x01telemetry' * 10000
+
+        session.wait_online(timeout=10)
+        session.session_send_payload(recipient=self.ident, data=blob)
+        time.sleep(1)  # let the chunks transit
+        session.session_disconnect()
+        assert self.from_jid == self.ident
+        assert self.payload == blob
+        assert self.msg_body is None
+
+    def test_metrics(self):
+        registry = MetricsRegistry()
+        session = P2pSession(server_address=self.server,
+                             port=self.port,
+                             jid=self.ident,
+                             password=self.password,
+                             metrics=registry)
+
+        session.set_msg_callback(cb=self.callback)
+        session.wait_online(timeout=10)
+        session.session_send(recipient=self.ident, msg=self.test_msg)
+        session.session_send(recipient='nobody@iot.legrand.net',
+                             msg=self.test_msg)
+        time.sleep(1)  # let the message transit
+        session.session_disconnect()
+
+        metrics = SnapshotExporter().export(registry)
+        assert metrics['pyp2p_messages_sent_total'] == 1
+        assert metrics['pyp2p_messages_received_total'] == 1
+        assert metrics['pyp2p_messages_skipped_offline_total'] == 1
+        assert metrics['pyp2p_callback_seconds']['count'] == 1
+        assert metrics['pyp2p_roster_rtt_seconds']['count'] == 1
+        assert metrics['pyp2p_presence_online_total'] >= 1
+        assert 'pyp2p_messages_sent_total 1' in \
+            PrometheusExporter().export(registry)
+
 
 class TestPrivacy:
  
     def setup(self):
         self.alice_ident = Identifier(domain="iot.legrand.net").get_identifier()
         self.bob_ident = Identifier(domain="iot.legrand.net").get_identifier()
-        self.server = 'p2pserver.cloudapp.net'
-        self.port = '80'
+        self.server, self.port = get_test_server()
         self.password = 'titi'
         self.test_msg = "il n'y a pas de hasard"
 
@@ -144,8 +193,7 @@ class TestMessageCallback:
  
     def setup(self):
         self.ident = Identifier(domain="iot.legrand.net").get_identifier()
-        self.server = 'p2pserver.cloudapp.net'
-        self.port = '80'
+        self.server, self.port = get_test_server()
         self.password = 'titi'
         self.test_msg = "il n'y a pas de hasard"
         Register(server_address=self.server,
@@ -182,8 +230,7 @@ class TestSubscription:
     def setup(self):
         self.alice_ident = Identifier(domain="iot.legrand.net").get_identifier()
         self.bob_ident = Identifier(domain="iot.legrand.net").get_identifier()
-        self.server = 'p2pserver.cloudapp.net'
-        self.port = '80'
+        self.server, self.port = get_test_server()
         self.password = 'titi'
         self.test_msg = "il n'y a pas de hasard"
 
@@ -261,14 +308,17 @@ class AssertingHandler(logging.handlers.BufferingHandler):
                 return
         assert False
 
+    def assert_not_logged(self,msg):
+        for record in self.buffer:
+            assert msg not in self.format(record)
+
 
 class TestSendOnlineOnly:
  
     def setup(self):
         self.alice_ident = Identifier(domain="iot.legrand.net").get_identifier()
         self.bob_ident = Identifier(domain="iot.legrand.net").get_identifier()
-        self.server = 'p2pserver.cloudapp.net'
-        self.port = '80'
+        self.server, self.port = get_test_server()
         self.password = 'titi'
         self.test_msg = "il n'y a pas de hasard"
 
@@ -331,15 +381,165 @@ class TestSendOnlineOnly:
 
         # mutual subscription initiated by alice
         alice_session.subscribe(targetjid = self.bob_ident) 
+        alice_session.wait_online(self.bob_ident, timeout=10)
+        logging.getLogger().addHandler(self.asserting_handler)
 
         bob_session.session_disconnect()
 
         time.sleep(1) # let subscription process occur
-        logging.getLogger().addHandler(self.asserting_handler)
+        assert not alice_session.is_online(self.bob_ident)
 
         alice_session.session_send(recipient=self.bob_ident, msg=self.test_msg)
         time.sleep(1)  # let the msg be logged    
 
         self.asserting_handler.assert_logged("%s skipped (not online)" % self.bob_ident)
+        self.asserting_handler.assert_not_logged("unoticed")
 
         logging.getLogger().removeHandler(self.asserting_handler)
+
+    def test_outbox_flushed(self):
+        alice_session = P2pSession(server_address=self.server,
+                                   port=self.port,
+                                   jid=self.alice_ident,
+                                   password=self.password)
+        bob_session = P2pSession(server_address=self.server,
+                                 port=self.port,
+                                 jid=self.bob_ident,
+                                 password=self.password)
+        alice_session.authorize_subscriptions()
+        bob_session.authorize_subscriptions()
+        alice_session.subscribe(targetjid=self.bob_ident)
+        alice_session.wait_online(self.bob_ident, timeout=10)
+
+        bob_session.session_disconnect()
+        deadline = time.time() + 10
+        while alice_session.is_online(self.bob_ident):
+            assert time.time() < deadline
+            time.sleep(0.05)
+
+        alice_session.enable_outbox()
+        alice_session.session_send(recipient=self.bob_ident,
+                                   msg=self.test_msg)
+        assert alice_session.outbox.depth(self.bob_ident) == 1
+
+        bob_session = P2pSession(server_address=self.server,
+                                 port=self.port,
+                                 jid=self.bob_ident,
+                                 password=self.password)
+        bob_session.set_msg_callback(cb=self.callback)
+        deadline = time.time() + 10
+        while self.msg_body is None:
+            assert time.time() < deadline
+            time.sleep(0.05)
+        assert self.from_jid == self.alice_ident
+        assert self.msg_body == self.test_msg
+        assert alice_session.outbox.depth(self.bob_ident) == 0
+
+        alice_session.session_disconnect()
+        bob_session.session_disconnect()
+
+    def test_send_many(self):
+        alice_session = P2pSession(server_address=self.server,
+                             port=self.port,
+                             jid=self.alice_ident,
+                              password=self.password)
+
+        bob_session = P2pSession(server_address=self.server,
+                             port=self.port,
+                             jid=self.bob_ident,
+                              password=self.password)
+
+        alice_session.authorize_subscriptions()
+        bob_session.authorize_subscriptions()
+
+        # mutual subscription initiated by alice
+        alice_session.subscribe(targetjid = self.bob_ident)
+
+        bob_session.set_msg_callback(cb=self.callback)
+
+        time.sleep(1) # let subscription process occur
+        nobody = Identifier(domain="iot.legrand.net").get_identifier()
+        status = alice_session.session_send_many(recipients=[self.bob_ident, nobody,
+                                                             self.bob_ident],
+                                                 msg=self.test_msg)
+        time.sleep(1)  # let the msg be logged
+        assert status == [(self.bob_ident, SENT),
+                          (nobody, SKIPPED_OFFLINE),
+                          (self.bob_ident, SENT)]
+        assert self.from_jid == self.alice_ident
+        assert self.msg_body == self.test_msg
+
+    def payload_callback(self, from_jid, payload):
+        self.from_jid = from_jid
+        self.payload = payload
+
+    def bulk_transfer(self, bob_direct):
+        alice_session = P2pSession(server_address=self.server,
+                             port=self.port,
+                             jid=self.alice_ident,
+                              password=self.password)
+
+        bob_session = P2pSession(server_address=self.server,
+                             port=self.port,
+                             jid=self.bob_ident,
+                              password=self.password)
+
+        alice_session.authorize_subscriptions()
+        bob_session.authorize_subscriptions()
+
+        # mutual subscription initiated by alice
+        alice_session.subscribe(targetjid = self.bob_ident)
+
+        alice_session.enable_direct_transfer(host='127.0.0.1', timeout=3)
+        if bob_direct:
+            bob_session.enable_direct_transfer(host='127.0.0.1', timeout=3)
+        bob_session.set_payload_callback(cb=self.payload_callback)
+
+        time.sleep(1) # let subscription process occur
+        firmware = os.urandom(1024 * 1024)
+        mode = alice_session.session_send_bulk(recipient=self.bob_ident,
+                                               data=firmware)
+        time.sleep(1)  # let in-band chunks transit
+        assert self.from_jid == self.alice_ident
+        assert self.payload == firmware
+        return mode
+
+    def test_bulk_direct(self):
+        assert self.bulk_transfer(bob_direct=True) == DIRECT
+
+    def test_bulk_fallback(self):
+        assert self.bulk_transfer(bob_direct=False) == INBAND
+
+
+class TestRegisterAndLogin:
+
+    def setup(self):
+        self.ident = Identifier(domain="iot.legrand.net").get_identifier()
+        self.server, self.port = get_test_server()
+        self.password = 'titi'
+        self.test_msg = "il n'y a pas de hasard"
+        self.from_jid = None
+        self.msg_body = None
+
+    def teardown(self):
+        Unregister(server_address=self.server,
+                   port=self.port).unregister(self.ident, self.password)
+
+    def callback(self, from_jid, msg_body):
+        self.from_jid = from_jid
+        self.msg_body = msg_body
+
+    def test_register_and_login(self):
+        session = Register(server_address=self.server,
+                           port=self.port).register_and_login(self.ident,
+                                                              self.password)
+        session.set_msg_callback(cb=self.callback)
+
+        session.wait_online(timeout=10)
+        assert session.registration_status == CREATED
+        session.session_send(recipient=self.ident, msg=self.test_msg)
+        time.sleep(1)  # let the msg transit
+        session.session_disconnect()
+
+        assert self.from_jid == self.ident
+        assert self.msg_body == self.test_msg
@@ -0,0 +1,97 @@
+#!/usr/bin/python
+# Copyright (C) 2015 the pyp2p authors and contributors
+# <see AUTHORS and LICENSE files>
+import time
+import uuid
+from nose.tools import assert_raises
+from pyp2p.core.exceptions import PyP2pBadArgument, PyP2pResourceNotFound
+from pyp2p.register import Register
+from pyp2p.session_pool import SessionPool
+from pyp2p.testing import get_test_server
+from pyp2p.unregister import Unregister
+
+
+class TestSessionPool:
+
+    def setup(self):
+        self.server, self.port = get_test_server()
+        self.password = 'titi'
+        self.jids = ['%s@iot.legrand.net' % uuid.uuid4() for _ in range(2)]
+        register = Register(server_address=self.server, port=self.port)
+        for jid in self.jids:
+            register.register(jid, self.password)
+        self.pool = SessionPool(server_address=self.server, port=self.port)
+
+    def teardown(self):
+        self.pool.stop()
+        unregister = Unregister(server_address=self.server, port=self.port)
+        for jid in self.jids:
+            unregister.unregister(jid, self.password)
+
+    def wait_session(self, jid, timeout=10):
+        deadline = time.time() + timeout
+        while self.pool.get_session(jid) is None:
+            assert time.time() < deadline
+            time.sleep(0.05)
+        session = self.pool.get_session(jid)
+        session.wait_ready(timeout=timeout)
+        return session
+
+    def wait_metric(self, name, value, timeout=10):
+        # starts are counted by an event handler, once the session is ready
+        deadline = time.time() + timeout
+        while self.pool.get_metrics()[name] != value:
+            assert time.time() < deadline
+            time.sleep(0.05)
+
+    def test_open(self):
+        for jid in self.jids:
+            self.pool.start_session(jid, self.password)
+        assert sorted(self.pool.jids()) == sorted(self.jids)
+
+        for jid in self.jids:
+            assert self.wait_session(jid).get_session_jid() == jid
+        self.wait_metric('started', 2)
+        metrics = self.pool.get_metrics()
+        assert metrics['ready'] == 2
+        assert metrics['pending'] == 0
+
+    def test_reuse(self):
+        jid = self.jids[0]
+        self.pool.start_session(jid, self.password)
+        assert_raises(PyP2pBadArgument, self.pool.start_session,
+                      jid, self.password)
+        session = self.wait_session(jid)
+        assert self.pool.get_session(jid) is session
+
+        self.pool.stop_session(jid)
+        self.pool.start_session(jid, self.password)
+        assert self.wait_session(jid) is not session
+
+    def test_stop(self):
+        jid = self.jids[0]
+        self.pool.start_session(jid, self.password)
+        session = self.wait_session(jid)
+
+        self.pool.stop_session(jid)
+        assert self.pool.get_session(jid) is None
+        assert len(self.pool) == 0
+        assert session not in self.pool.keepalive.states
+        assert self.pool.get_metrics()['stopped'] == 1
+        assert_raises(PyP2pResourceNotFound, self.pool.stop_session, jid)
+
+    def test_stop_while_opening(self):
+        jid = self.jids[0]
+        self.pool.stagger = 60
+        self.pool.start_session(self.jids[1], self.password)
+        self.pool.start_session(jid, self.password)
+        task = self.pool.tasks[jid]
+
+        # the scheduler started opening the session when it is stopped
+        self.pool.stop_session(jid)
+        task.func(*task.args)
+
+        assert self.pool.get_session(jid) is None
+        assert jid not in self.pool.jids()
+        assert all(session.boundjid.bare != jid
+                   for session in self.pool.keepalive.states)
@@ -1,6 +1,14 @@
 #!/usr/bin/python
 # Copyright (C) 2015 the pyp2p authors and contributors
 # <see AUTHORS and LICENSE files>
+import io
+import os
+import shutil
+import tempfile
+import time
+from stat import S_IMODE
+from nose.tools import assert_raises
+from pyp2p.storage import RawStorage, StreamReader, StreamWriter
 from pyp2p.storage_factory import StorageFactory
 
 class TestStorage:
@@ -38,3 +46,140 @@ class TestStorage:
 
         assert data[0] in read_data[0]
         assert data[1] in read_data[1]
+
+    def test_store_atomic(self):
+        directory = tempfile.mkdtemp()
+        filename = os.path.join(directory, 'store.lock')
+        storage = RawStorage(filename=filename)
+        storage.store(['alice@iot.legrand.net', 'mYsEcret007'])
+
+        def failing_hook(data, args):
+            raise IOError("disk full")
+
+        storage.store_hook = failing_hook
+        assert_raises(IOError, storage.store, ['bob@iot.legrand.net'])
+        storage.store_hook = None
+
+        assert storage.retrieve() == ['alice@iot.legrand.net', 'mYsEcret007']
+        assert os.listdir(directory) == ['store.lock']
+        assert S_IMODE(os.stat(filename).st_mode) == 0o600
+        shutil.rmtree(directory)
+
+    def test_group_commit(self):
+        directory = tempfile.mkdtemp()
+        filename = os.path.join(directory, 'store.lock')
+        storage = RawStorage(filename=filename, commit_delay=0.2)
+        for count in range(10):
+            storage.store({'count': count})
+        assert not os.path.exists(filename)
+        assert storage.retrieve() == {'count': 9}
+
+        time.sleep(0.5)
+        assert os.path.exists(filename)
+        assert RawStorage(filename=filename).retrieve() == {'count': 9}
+
+        storage.store({'count': 10})
+        storage.flush()
+        assert RawStorage(filename=filename).retrieve() == {'count': 10}
+        shutil.rmtree(directory)
+
+    def test_group_commit_failed(self):
+        directory = tempfile.mkdtemp()
+        filename = os.path.join(directory, 'store.lock')
+        writes = []
+
+        def fail_once(data, key):
+            writes.append(data)
+            if len(writes) == 1:
+                raise IOError("disk full")
+            return data
+        storage = RawStorage(filename=filename, commit_delay=0.1)
+        storage.store_hook = fail_once
+        storage.store({'a': 1})
+        deadline = time.time() + 5
+        while not writes:
+            assert time.time() < deadline
+            time.sleep(0.01)
+        storage.store({'a': 2})
+        assert storage.retrieve() == {'a': 2}
+
+        while storage.pending is not None:
+            assert time.time() < deadline
+            time.sleep(0.01)
+        assert RawStorage(filename=filename).retrieve() == {'a': 2}
+        shutil.rmtree(directory)
+
+    def test_retrieve_cached(self):
+        directory = tempfile.mkdtemp()
+        filename = os.path.join(directory, 'store.lock')
+        storage = StorageFactory(kind='basic', filename=filename,
+                                 cache=True).get_storage()
+        assert_raises(IOError, storage.retrieve)
+
+        storage.store({'alice@iot.legrand.net': 'mYsEcret007'})
+        data = storage.retrieve()
+        assert storage.retrieve() is data
+
+        # written by another process
+        RawStorage(filename=filename).store({'bob@iot.legrand.net': 'b0b'})
+        assert storage.retrieve() == {'bob@iot.legrand.net': 'b0b'}
+
+        storage.store({'carol@iot.legrand.net': 'c4rol'})
+        assert storage.retrieve() == {'carol@iot.legrand.net': 'c4rol'}
+        shutil.rmtree(directory)
+
+    def test_stream_reader(self):
+        lines = [('line %d\n' % index).encode('ascii') for index in range(100)]
+        reader = StreamReader(io.BytesIO(b''.join(lines) + b'end'),
+                              transform=lambda block: block, block_size=7)
+        for line in lines:
+            assert reader.readline() == line
+        assert reader.readline() == b'end'
+        assert reader.read(10) == b''
+
+    def test_stream_reader_mixed(self):
+        data = os.urandom(5000)
+        reader = StreamReader(io.BytesIO(data),
+                              transform=lambda block: block, block_size=7)
+        assert reader.read(3) == data[:3]
+        assert reader.read(100) == data[3:103]
+        assert reader.read(0) == b''
+        line = reader.readline()
+        assert line == data[103:data.index(b'\n', 103) + 1]
+        offset = 103 + len(line)
+        assert reader.read() == data[offset:]
+
+    def test_stream_reader_large(self):
+        # reading must not copy what was gathered at each block
+        data = os.urandom(8 * 1024 * 1024).replace(b'\n', b' ')
+        started = time.time()
+        reader = StreamReader(io.BytesIO(data + b'\nend'),
+                              transform=lambda block: block, block_size=1024)
+        assert reader.read(len(data) - 1) == data[:-1]
+        assert reader.readline() == data[-1:] + b'\n'
+        reader = StreamReader(io.BytesIO(data + b'\nend'),
+                              transform=lambda block: block, block_size=1024)
+        assert reader.readline() == data + b'\n'
+        assert reader.read() == b'end'
+        assert time.time() - started < 2
+
+    def test_stream_writer(self):
+        output = io.BytesIO()
+        writer = StreamWriter(output, transform=lambda block: block.upper(),
+                              block_size=16)
+        for _ in range(10):
+            writer.write(b'abcde')
+        writer.close()
+        assert output.getvalue() == b'ABCDE' * 10
+
+    def test_stream_writer_large(self):
+        blocks = []
+
+        def transform(block):
+            blocks.append(block)
+            return block
+
+        writer = StreamWriter(io.BytesIO(), transform=transform, block_size=16)
+        writer.write(b'a' * 100)
+        writer.close()
+        assert [len(block) for block in blocks] == [16] * 6 + [4]
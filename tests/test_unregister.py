@@ -4,11 +4,15 @@
 import pyp2p.unregister as unreg
 import pyp2p.register as reg
 from pyp2p.identifier import Identifier
+from pyp2p.testing import get_test_server
+from pyp2p.testing.xmpp_server import LocalXmppServer
 
 import logging
 import logging.handlers
 import time
 
+SERVER, PORT = get_test_server()
+
 class AssertingHandler(logging.handlers.BufferingHandler):
 
     def __init__(self,capacity):
@@ -28,7 +32,7 @@ class TestUnregister:
         self.asserting_handler = AssertingHandler(200)
         logging.getLogger().addHandler(self.asserting_handler)
         self.ident = Identifier(domain="iot.legrand.net").get_identifier()
-        reg.Register(server_address='p2pserver.cloudapp.net', port='80').register(self.ident,'titi')
+        reg.Register(server_address=SERVER, port=PORT).register(self.ident,'titi')
         self.asserting_handler.assert_logged("Account created")
 
     def teardown(self):
@@ -36,8 +40,46 @@ class TestUnregister:
 
     def test_unregister(self):
         time.sleep(2)
-        self.unregister = unreg.Unregister(server_address='p2pserver.cloudapp.net', port='80')
+        self.unregister = unreg.Unregister(server_address=SERVER, port=PORT)
         self.unregister.unregister(self.ident,'titi')
         time.sleep(1)
         self.asserting_handler.assert_logged("User removed")
 
+
+
+class TestUnregisterMany:
+
+    def setup(self):
+        self.idents = [Identifier(domain="iot.legrand.net").get_identifier()
+                       for _ in range(4)]
+        reg.Register(server_address=SERVER,
+                     port=PORT).register_many([(ident, 'titi') for ident in self.idents])
+
+    def teardown(self):
+        pass
+
+    def test_unregister_many(self):
+        unregister = unreg.Unregister(server_address=SERVER, port=PORT)
+        report = unregister.unregister_many([(ident, 'titi') for ident in self.idents],
+                                            concurrency=2)
+        assert sorted(report.keys()) == sorted(self.idents)
+        for ident in self.idents:
+            assert report[ident]['status'] == unreg.OK
+            assert report[ident]['attempts'] == 1
+
+    def test_unregister_many_stream_kept_open(self):
+        server = LocalXmppServer(close_removed=False).start()
+        try:
+            address, port = server.address
+            reg.Register(server_address=address,
+                         port=port).register(self.idents[0], 'titi')
+            unregister = unreg.Unregister(server_address=address, port=port)
+            report = unregister.unregister_many([(self.idents[0], 'titi')],
+                                                timeout=5)
+        finally:
+            server.stop()
+        assert report[self.idents[0]]['status'] == unreg.OK
+        assert report[self.idents[0]]['attempts'] == 1
+        assert report[self.idents[0]]['elapsed'] < 5
+        unreg.Unregister(server_address=SERVER, port=PORT).unregister_many(
+            [(ident, 'titi') for ident in self.idents])
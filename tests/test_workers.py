@@ -0,0 +1,54 @@
+#!/usr/bin/python
+# Copyright (C) 2015 the pyp2p authors and contributors
+# <see AUTHORS and LICENSE files>
+import logging
+import logging.handlers
+import threading
+import time
+from nose.tools import assert_raises
+from pyp2p.core.exceptions import PyP2pBadArgument
+from pyp2p.core.workers import run_concurrently
+
+
+class TestRunConcurrently:
+
+    def setup(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+
+    def teardown(self):
+        pass
+
+    def square(self, value):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(0.01)
+        with self.lock:
+            self.running -= 1
+        return value * value
+
+    def test_results_order(self):
+        results = run_concurrently(self.square, range(20), concurrency=3)
+        assert results == [value * value for value in range(20)]
+        assert self.max_running <= 3
+
+    def test_failure(self):
+        results = run_concurrently(lambda value: 1 / value, [1, 0], concurrency=2)
+        assert results == [1, None]
+
+    def test_failure_not_logging_item(self):
+        handler = logging.handlers.BufferingHandler(10)
+        logging.getLogger("workers").addHandler(handler)
+        try:
+            run_concurrently(lambda item: 1 / item[2],
+                             [('alice', 'mYsEcret007', 0)], concurrency=1)
+        finally:
+            logging.getLogger("workers").removeHandler(handler)
+        messages = [handler.format(record) for record in handler.buffer]
+        assert messages
+        assert not any('mYsEcret007' in message for message in messages)
+
+    def test_bad_concurrency(self):
+        assert_raises(PyP2pBadArgument, run_concurrently, self.square, [1], 0)
@@ -0,0 +1,182 @@
+#!/usr/bin/python
+# Copyright (C) 2015 the pyp2p authors and contributors
+# <see AUTHORS and LICENSE files>
+import threading
+import time
+import xml.etree.ElementTree as ET
+from pyp2p.session import P2pSession
+from pyp2p.testing.xmpp_server import LocalXmppServer, CLIENT_NS, SM_NS
+import pyp2p.register as reg
+import pyp2p.unregister as unreg
+
+
+class TestLocalXmppServer:
+
+    def setup(self):
+        self.server = LocalXmppServer().start()
+        self.alice = 'alice@iot.legrand.net'
+        self.bob = 'bob@iot.legrand.net'
+
+    def teardown(self):
+        self.server.stop()
+
+    def test_accounts(self):
+        assert self.server.add_account(self.alice, 'titi')
+        assert not self.server.add_account('Alice@iot.legrand.net', 'toto')
+        assert self.server.has_account('Alice@IOT.legrand.net')
+        assert self.server.remove_account(self.alice)
+        assert not self.server.has_account(self.alice)
+
+    def test_register_unregister(self):
+        address, port = self.server.address
+        assert reg.Register(server_address=address,
+                            port=port).register(self.alice, 'titi')
+        assert self.server.has_account(self.alice)
+        assert unreg.Unregister(server_address=address,
+                                port=port).unregister(self.alice, 'titi')
+        assert not self.server.has_account(self.alice)
+
+    def test_subscription(self):
+        self.server.add_account(self.alice, 'titi')
+        self.server.add_account(self.bob, 'titi')
+        alice = self.server.accounts[self.alice]
+        bob = self.server.accounts[self.bob]
+
+        # bob is offline: the request waits for him
+        self.server.subscription(alice, self.bob, 'subscribe')
+        assert alice.roster[self.bob]['ask'] == 'subscribe'
+        assert self.alice in bob.pending_in
+
+        self.server.subscription(bob, self.alice, 'subscribed')
+        assert alice.subscription(self.bob) == 'to'
+        assert bob.subscription(self.alice) == 'from'
+        assert not bob.pending_in
+
+        # approved already, answered by the server
+        self.server.subscription(bob, self.alice, 'subscribe')
+        self.server.subscription(alice, self.bob, 'subscribed')
+        assert alice.subscription(self.bob) == 'both'
+        assert bob.subscription(self.alice) == 'both'
+
+    def test_removed_from_rosters(self):
+        self.server.add_account(self.alice, 'titi')
+        self.server.add_account(self.bob, 'titi')
+        alice = self.server.accounts[self.alice]
+        alice.item(self.bob)['to'] = True
+        self.server.remove_account(self.bob)
+        assert self.bob not in alice.roster
+
+
+class TestStreamManagement:
+
+    def setup(self):
+        self.server = LocalXmppServer().start()
+        self.alice = 'alice@iot.legrand.net'
+        self.server.add_account(self.alice, 'titi')
+        address, port = self.server.address
+        self.messages = []
+        self.resumed = threading.Event()
+        self.session = P2pSession(server_address=address, port=port,
+                                  jid=self.alice, password='titi',
+                                  stream_management=True)
+        self.session.set_msg_callback(self.callback)
+        self.session.add_event_handler("session_resumed",
+                                       lambda event: self.resumed.set())
+        self.session.wait_ready(timeout=10)
+        self.sm = self.session.plugin['xep_0198']
+
+    def teardown(self):
+        self.session.session_disconnect()
+        self.server.stop()
+
+    def callback(self, from_jid, msg_body):
+        self.messages.append(msg_body)
+
+    def wait(self, condition, timeout=10):
+        deadline = time.time() + timeout
+        while not condition():
+            assert time.time() < deadline
+            time.sleep(0.01)
+
+    def test_enable(self):
+        conn = self.server.sessions[self.session.boundjid.full]
+        assert conn.sm is not None
+        assert conn.sm.resumable
+        assert self.sm.sm_id == conn.sm.id
+        assert 'stream_management' in self.session.features
+
+    def test_ack(self):
+        # the client asks for an ack every few stanzas
+        for count in range(10):
+            self.session.send_message(mto=self.alice, mbody=str(count),
+                                      mtype='chat')
+        self.wait(lambda: len(self.messages) == 10)
+        self.sm.request_ack()
+        self.wait(lambda: self.sm.last_ack == self.sm.seq)
+        assert not self.sm.unacked_queue
+
+        conn = self.server.sessions[self.session.boundjid.full]
+        assert conn.sm.unacked
+        conn.send("<r xmlns='%s'/>" % SM_NS)
+        self.wait(lambda: not conn.sm.unacked)
+        assert conn.sm.handled == self.sm.seq
+
+    def test_resume(self):
+        self.session.wait_online(timeout=10)
+        full = self.session.boundjid.full
+        sm_id = self.sm.sm_id
+        self.server.drop_stream(full)
+        # the client waits a second or two before reconnecting
+        self.wait(lambda: sm_id in self.server.detached, timeout=1)
+        assert full in self.server.sessions
+
+        message = ET.Element('{%s}message' % CLIENT_NS,
+                             {'from': self.alice, 'to': full, 'type': 'chat'})
+        ET.SubElement(message, '{%s}body' % CLIENT_NS).text = 'missed'
+        self.server.sessions[full].send_element(message)
+
+        assert self.resumed.wait(10)
+        self.wait(lambda: self.messages == ['missed'])
+        assert self.session.boundjid.full == full
+        assert self.sm.sm_id == sm_id
+        assert not self.server.detached
+        assert self.server.sessions[full].sm.id == sm_id
+        # the presence of the session survived
+        assert self.session.presence.knows(full)
+
+    def test_resume_failed(self):
+        failed = []
+        self.session.add_event_handler("sm_failed", failed.append)
+        self.session.wait_online(timeout=10)
+        self.session.presence.add('bob@iot.legrand.net/gone')
+        self.server.resume_timeout = 0.1
+        full = self.session.boundjid.full
+        sm_id = self.sm.sm_id
+        self.server.drop_stream(full)
+        # the server forgets the stream before the client reconnects
+        self.wait(lambda: full not in self.server.sessions)
+        self.wait(lambda: self.session.is_ready() and
+                  self.session.boundjid.full in self.server.sessions)
+
+        # a new stream is enabled once bound
+        conn = self.server.sessions[self.session.boundjid.full]
+        self.wait(lambda: conn.sm is not None)
+        self.wait(lambda: self.sm.sm_id == conn.sm.id)
+        assert self.sm.sm_id != sm_id
+        assert 'stream_management' in self.session.features
+        assert len(failed) == 1
+        assert not self.session.is_online('bob@iot.legrand.net')
+
+        # and resumed on the next reconnection
+        self.server.resume_timeout = 300
+        self.server.drop_stream(conn.full)
+        assert self.resumed.wait(10)
+        assert len(failed) == 1
+
+    def test_expire(self):
+        self.server.resume_timeout = 0.1
+        self.session.auto_reconnect = False
+        full = self.session.boundjid.full
+        self.server.drop_stream(full)
+        self.wait(lambda: full not in self.server.sessions)
+        assert not self.server.detached